@@ -16,11 +16,20 @@ import re
 from pisa import FTYPE
 from pisa.core.binning import OneDimBinning, MultiDimBinning
 from pisa.core.map import Map, MapSet
-from pisa.core.translation import histogram, lookup, resample
+from pisa.core.translation import (
+    find_bin_indices, histogram, histogram_counts, histogram_indices, lookup_indices,
+    resample
+)
+from pisa.utils.cache import LRUCache
 from pisa.utils.comparisons import ALLCLOSE_KW
 from pisa.utils.log import logging
 
 
+UNROLLED_BINNINGS_CACHE_SIZE = 32
+"""Number of binnings for which `Container.unroll_binning` keeps the unrolled
+bin centers"""
+
+
 class ContainerSet():
     """
     Class to hold a set of container objects
@@ -33,11 +42,19 @@ class ContainerSet():
 
     representation : MultiDimBinning, "events" or None
 
+    fused : bool
+        Whether services should operate on the arrays of all containers at
+        once where they support it (see `get_fused`)
+
     """
-    def __init__(self, name, containers=None, representation=None):
+    def __init__(self, name, containers=None, representation=None, fused=False):
         self.name = name
         self.linked_containers = []
         self.containers = []
+        self.fused = fused
+        # dict of form [(variable, representation_hash)] holding the fused
+        # array and the per-container data it was created from
+        self._fused_arrays = {}
         if containers is None:
             containers = []
         for container in containers:
@@ -155,6 +172,62 @@ class ContainerSet():
         containers_to_be_iterated = [c for c in self.containers if not c.linked] + self.linked_containers
         return iter(containers_to_be_iterated)
 
+    @property
+    def fused_slices(self):
+        '''Slices into fused arrays (see `get_fused`) for the individual
+        containers, in the order of `containers`'''
+        slices = []
+        start = 0
+        for container in self.containers:
+            slices.append(slice(start, start + container.size))
+            start += container.size
+        return slices
+
+    def get_fused(self, key):
+        '''Get the data under `key` of all containers (in their current
+        representation) concatenated into one contiguous array, such that
+        a kernel can process all of them in a single call.
+
+        The containers' arrays are replaced by views into the fused array, so
+        in-place modifications of either are shared; they still need to be
+        marked via `Container.mark_changed`. As long as no container's array
+        is replaced, subsequent calls return the same array without copying.
+        Scalar auxiliary data (e.g. `nubar`) is broadcast to container size.
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        fused_array : np.ndarray
+
+        '''
+        cache_key = (key, hash(self.representation))
+        values = [container[key] for container in self.containers]
+        cached = self._fused_arrays.get(cache_key)
+        if cached is not None and len(cached[1]) == len(values) and all(
+            val is cached_val for val, cached_val in zip(values, cached[1])
+        ):
+            return cached[0]
+
+        logging.trace(f'Fusing `{key}` of containers {self.names}')
+        slices = self.fused_slices
+        parts = []
+        for val, slc in zip(values, slices):
+            if np.ndim(val) == 0:
+                val = np.full(slc.stop - slc.start, val)
+            parts.append(val)
+        fused_array = np.concatenate(parts)
+        views = []
+        for container, val, slc in zip(self.containers, values, slices):
+            if isinstance(val, np.ndarray):
+                val = fused_array[slc]
+                container.current_data[key] = val
+            views.append(val)
+        self._fused_arrays[cache_key] = (fused_array, views)
+        return fused_array
+
     def get_mapset(self, key, error=None):
         """For a given key, get a MapSet
 
@@ -313,6 +386,23 @@ class Container():
         # dict of form [representation_hash]
         self.precedence = defaultdict(int)
 
+        # Keys marked as changed while change tracking is active
+        # (None if inactive)
+        self._changed_keys = None
+
+        # Cached bin index of each event for translations to and from binned
+        # representations; dict of form
+        # [(binning_hash, sample_representation_hash)] -> (names, indices)
+        self._bin_indices = {}
+
+        # Cached number of events per bin, same keys as `_bin_indices`
+        self._bin_counts = {}
+
+        # Cached counts of the grid points of one binning in another, for
+        # resampling; dict of form [(src_binning_hash, dest_binning_hash)]
+        # -> counts
+        self._resample_counts = {}
+
         self.representation = representation
 
     def __repr__(self):
@@ -402,6 +492,13 @@ class Container():
         
     def mark_changed(self, key):
         '''mark a key as changed and only what is in the current representation is valid'''
+        if self._changed_keys is not None:
+            self._changed_keys.add(key)
+        # bin indices are only valid as long as the events' coordinates are
+        for index_key, (names, _) in list(self._bin_indices.items()):
+            if key in names:
+                del self._bin_indices[index_key]
+                self._bin_counts.pop(index_key, None)
         # invalidate all
         for rep in self.validity[key]:
             self.validity[key][rep] = False
@@ -412,6 +509,60 @@ class Container():
     def mark_valid(self, key):
         '''validate data as is in current representation, regardless'''
         self.validity[key][hash(self.representation)] = True
+
+    def start_tracking_changes(self):
+        '''Start recording all keys that get marked as changed'''
+        self._changed_keys = set()
+
+    def stop_tracking_changes(self):
+        '''Stop recording changed keys and return those recorded since the
+        last call to `start_tracking_changes`'''
+        changed_keys = self._changed_keys
+        self._changed_keys = None
+        return set() if changed_keys is None else changed_keys
+
+    def get_snapshot(self, keys):
+        '''Copy the data under `keys` in every representation in which it is
+        currently valid
+
+        Parameters
+        ----------
+        keys : iterable of str
+
+        Returns
+        -------
+        snapshot : dict
+            Of form [variable][representation_hash], to be passed to
+            `restore_snapshot`
+
+        '''
+        snapshot = {}
+        for key in keys:
+            snapshot[key] = {
+                rep_hash: np.copy(self.data[rep_hash][key])
+                for rep_hash, valid in self.validity[key].items()
+                if valid and key in self.data[rep_hash]
+            }
+        return snapshot
+
+    def restore_snapshot(self, snapshot):
+        '''Restore data and validity from a snapshot created via
+        `get_snapshot`. Existing arrays are overwritten in place where
+        possible, such that references to them remain valid.'''
+        for key, arrays in snapshot.items():
+            for rep_hash in self.validity[key]:
+                self.validity[key][rep_hash] = False
+            for rep_hash, array in arrays.items():
+                current = self.data[rep_hash].get(key)
+                if (isinstance(current, np.ndarray)
+                    and current.shape == array.shape
+                    and current.dtype == array.dtype):
+                    np.copyto(current, array)
+                else:
+                    self.data[rep_hash][key] = np.copy(array)
+                self.validity[key][rep_hash] = True
+            if not key in self.tranlation_modes.keys():
+                self.tranlation_modes[key] = self.default_translation_mode
         
     def __getitem__(self, key):
         data = self.__get_data(key)        
@@ -505,11 +656,23 @@ class Container():
 
         return self.current_data[key]
     
+    _unrolled_binnings = LRUCache(max_entries=UNROLLED_BINNINGS_CACHE_SIZE)
+    """Unrolled bin centers of recently used binnings, of form
+    [binning_hash][dimension index]"""
+
     @staticmethod
     def unroll_binning(key, binning):
-        '''Get an Array containing the unrolled binning'''
-        grid = binning.meshgrid(entity='weighted_centers', attach_units=False)
-        return grid[binning.index(key)].ravel()
+        '''Get an Array containing the unrolled binning. Arrays are computed
+        once per binning and returned as read-only views.'''
+        grids = Container._unrolled_binnings.get(hash(binning))
+        if grids is None:
+            grids = []
+            for grid in binning.meshgrid(entity='weighted_centers', attach_units=False):
+                grid = grid.ravel()
+                grid.flags.writeable = False
+                grids.append(grid)
+            Container._unrolled_binnings[hash(binning)] = grids
+        return grids[binning.index(key)]
 
     
     def get_hist(self, key):
@@ -652,7 +815,14 @@ class Container():
 
         self.representation = dest_representation
         new_sample = [self[name] for name in dest_representation.names]
-        new_hist = resample(weights, sample, src_representation, new_sample, dest_representation)                
+        # the grid points of a binning only depend on the binning itself
+        counts_key = (hash(src_representation), hash(dest_representation))
+        if counts_key not in self._resample_counts:
+            self._resample_counts[counts_key] = histogram_counts(
+                sample, dest_representation, use_fh=False
+            )
+        new_hist = resample(weights, sample, src_representation, new_sample, dest_representation,
+                            flat_hist_counts=self._resample_counts[counts_key])
         return new_hist      
         
     def array_to_binned(self, key, src_representation, dest_representation, averaged=True):
@@ -671,39 +841,24 @@ class Container():
         -----
         right now, CPU-only
         """
-        # TODO: make work for n-dim
         logging.trace('Transforming %s array to binned data'%(key))
         
         assert src_representation in self.array_representations
         assert isinstance(dest_representation, MultiDimBinning)
-        
-        if not dest_representation.is_irregular:
-            sample = []
-            dimensions = []
-            for d in dest_representation:
-                if d.is_log:
-                    self.representation = "log_events"
-                    sample.append(self[d.name])
-                    dimensions.append(OneDimBinning(
-                        d.name,
-                        domain=np.log(d.domain.m),
-                        num_bins=d.num_bins
-                    ))
-                else:
-                    self.representation = "events"
-                    sample.append(self[d.name])
-                    dimensions.append(d)
-            hist_binning = MultiDimBinning(dimensions)
+
+        indices = self.get_bin_indices(dest_representation, src_representation)
+        if averaged:
+            flat_hist_counts = self.get_bin_counts(dest_representation, src_representation)
         else:
-            self.representation = src_representation
-            sample = [self[name] for name in dest_representation.names]
-            hist_binning = dest_representation
+            flat_hist_counts = None
 
         self.representation = src_representation
         weights = self[key]
         self.representation = dest_representation
-        hist = histogram(sample, weights, hist_binning, averaged=averaged)
-        return hist
+        return histogram_indices(
+            indices, weights, dest_representation.size, averaged=averaged,
+            flat_hist_counts=flat_hist_counts
+        )
 
     def binned_to_array(self, key, src_representation, dest_representation):
         """Augmented binned data to array data"""
@@ -712,12 +867,40 @@ class Container():
         
         self.representation = src_representation
         weights = self[key]
-        
-        if not src_representation.is_irregular:
-            logging.trace(f"Container `{self.name}`: regularized lookup for {key}")
+
+        indices = self.get_bin_indices(src_representation, dest_representation)
+        self.representation = dest_representation
+        return lookup_indices(indices, weights)
+
+    def get_bin_indices(self, binning, sample_representation):
+        """Get the flat index of the bin of `binning` each event falls into
+        (see `pisa.core.translation.find_bin_indices`), computed once and
+        cached until any of the events' coordinates is marked as changed.
+
+        Parameters
+        ----------
+        binning : MultiDimBinning
+
+        sample_representation : str
+            Array representation to take the coordinates from in case of an
+            irregular `binning`; regular dimensions are binned linearly in
+            "events" or "log_events"
+
+        Returns
+        -------
+        indices : np.ndarray of int64
+
+        """
+        index_key = self._bin_index_key(binning, sample_representation)
+        if index_key in self._bin_indices:
+            return self._bin_indices[index_key][1]
+
+        logging.trace(f"Container `{self.name}`: finding bin indices in {binning.names}")
+        representation = self.representation
+        if not binning.is_irregular:
             sample = []
             dimensions = []
-            for d in src_representation:
+            for d in binning:
                 if d.is_log:
                     self.representation = "log_events"
                     sample.append(self[d.name])
@@ -732,12 +915,46 @@ class Container():
                     dimensions.append(d)
             hist_binning = MultiDimBinning(dimensions)
         else:
-            logging.trace(f"Container `{self.name}`: irregular lookup for {key}")
-            self.representation = dest_representation
-            sample = [self[name] for name in src_representation.names]
-            hist_binning = src_representation
-   
-        return lookup(sample, weights, hist_binning)
+            self.representation = sample_representation
+            sample = [self[name] for name in binning.names]
+            hist_binning = binning
+        self.representation = representation
+
+        indices = find_bin_indices(sample, hist_binning)
+        self._bin_indices[index_key] = (tuple(binning.names), indices)
+        return indices
+
+    def get_bin_counts(self, binning, sample_representation):
+        """Get the number of events in each bin of `binning` (see
+        `get_bin_indices`), computed once and cached as long as the bin
+        indices are.
+
+        Parameters
+        ----------
+        binning : MultiDimBinning
+
+        sample_representation : str
+
+        Returns
+        -------
+        counts : np.ndarray
+
+        """
+        indices = self.get_bin_indices(binning, sample_representation)
+        index_key = self._bin_index_key(binning, sample_representation)
+        if index_key not in self._bin_counts:
+            self._bin_counts[index_key] = np.bincount(
+                indices[indices >= 0], minlength=binning.size
+            ).astype(FTYPE)
+        return self._bin_counts[index_key]
+
+    @staticmethod
+    def _bin_index_key(binning, sample_representation):
+        """Key of the bin indices and counts of the events in `binning`;
+        regular binnings don't depend on `sample_representation`"""
+        if binning.is_irregular:
+            return (hash(binning), hash(sample_representation))
+        return (hash(binning), None)
 
     def get_keep_mask(self, keep_criteria):
         """Returns a mask that only keeps the events that survive the given cut(s).
@@ -797,6 +1014,9 @@ def test_container():
     bx = container['x']
     m = np.meshgrid(binning.midpoints[0].m, binning.midpoints[1].m)[1].ravel()
     assert np.allclose(bx, m, **ALLCLOSE_KW), f'test:\n{bx}\n!= ref:\n{m}'
+    # unrolled binning is computed once and handed out read-only
+    assert container['x'] is bx
+    assert not bx.flags.writeable
 
     # array repr
     container.representation = 'events'
@@ -819,6 +1039,21 @@ def test_container():
 
     assert np.allclose(a, w, **ALLCLOSE_KW), f'test:\n{a}\n!= ref:\n{w}'
 
+    # coordinates modified in place: cached bin indices and counts are stale
+    # until marked as changed
+    container.representation = binning
+    container['w']
+    container.representation = 'events'
+    new_x = 100 - x
+    container['x'][:] = new_x
+    container.mark_changed('x')
+    container.mark_changed('w')
+    container.representation = binning
+    bd = container['w']
+    ref = histogram([new_x, y], w, binning, averaged=True)
+    assert not np.allclose(ref, diag.ravel(), **ALLCLOSE_KW)
+    assert np.allclose(bd, ref, **ALLCLOSE_KW), f'test:\n{bd}\n!= ref:\n{ref}'
+
 
 def test_container_set():
     container1 = Container('test1')
@@ -876,6 +1111,29 @@ def test_container_set():
     assert len(shared_keys_rep_indep) == 2
     assert len(shared_keys_rep_dep) == 1
 
+    # fused arrays
+    container1 = Container('test1')
+    container2 = Container('test2')
+    container1['x'] = np.arange(3, dtype=FTYPE)
+    container2['x'] = np.arange(3, 8, dtype=FTYPE)
+    container1.set_aux_data('nubar', 1)
+    container2.set_aux_data('nubar', -1)
+    data = ContainerSet('data', [container1, container2], fused=True)
+    data.representation = 'events'
+    x = data.get_fused('x')
+    assert np.array_equal(x, np.arange(8))
+    assert np.array_equal(data.get_fused('nubar'), [1]*3 + [-1]*5)
+    assert data.fused_slices == [slice(0, 3), slice(3, 8)]
+    # containers share memory with the fused array
+    x *= 2
+    assert np.array_equal(container2['x'], 2*np.arange(3, 8))
+    assert data.get_fused('x') is x
+    # replacing one container's array leads to a new fused array
+    container1['x'] = np.zeros(3, dtype=FTYPE)
+    x_new = data.get_fused('x')
+    assert x_new is not x
+    assert np.array_equal(x_new, [0]*3 + list(2*np.arange(3, 8)))
+
 
 if __name__ == '__main__':
     test_container()
@@ -11,6 +11,7 @@ from collections.abc import Iterable, Mapping, MutableSequence, Set, Sequence
 from collections import OrderedDict
 from copy import deepcopy
 from functools import total_ordering
+from itertools import count
 from operator import setitem
 from os.path import join
 from shutil import rmtree
@@ -64,6 +65,24 @@ __license__ = '''Copyright (c) 2014-2019, The IceCube Collaboration
  limitations under the License.'''
 
 
+_VERSION_COUNTER = count()
+"""Source of param versions; globally unique such that replacing a param by a
+different object also results in a different version"""
+
+
+def _values_equal(val0, val1):
+    """Cheap check whether two param values are identical (conservatively
+    returns False e.g. for equivalent quantities in different units)"""
+    if type(val0) is not type(val1): # pylint: disable=unidiomatic-typecheck
+        return False
+    if isinstance(val0, ureg.Quantity):
+        return val0.units == val1.units and np.array_equal(val0.m, val1.m)
+    try:
+        return bool(val0 == val1)
+    except ValueError:
+        return False
+
+
 # TODO: Make property "frozen" or "read_only" so params in param set e.g.
 # returned by a template maker -- which updating the values of will NOT have
 # the effect the user might expect -- will be explicitly forbidden?
@@ -161,6 +180,7 @@ class Param:
         '_value',
         '_range',
         '_units',
+        '_version',
         'normalize_values',
     )
     _state_attrs = (
@@ -197,6 +217,7 @@ class Param:
         self._units = None
         self._nominal_value = None
         self._prior = None
+        self._version = next(_VERSION_COUNTER)
 
         self.value = value
         self.scales_as_log = scales_as_log
@@ -276,12 +297,19 @@ class Param:
                         'Passed values must have units if the param has units'
                 val = val.to(self._value.units)
             self.validate_value(val)
+        if not _values_equal(self._value, val):
+            self._version = next(_VERSION_COUNTER)
         self._value = val
         if hasattr(self._value, 'units'):
             self._units = self._value.units
         else:
             self._units = ureg.Unit('dimensionless')
 
+    @property
+    def version(self):
+        """int : counter that changes whenever the value is changed"""
+        return self._version
+
     @property
     def magnitude(self):
         return self._value.magnitude
@@ -387,6 +415,7 @@ class Param:
                 % (self.name, rval)
             )
         rval = np.min([1., rval])  # make exactly 1. if rounding error occurred
+        old_value = self._value
         srange0 = srange[0].m_as(self._units)
         srange1 = srange[1].m_as(self._units)
         if self.scales_as_log:
@@ -403,6 +432,8 @@ class Param:
         if self.value > max(srange): self.value = max(srange)
         if self.value < min(srange): self.value = min(srange)
         self.validate_value(self.value)
+        if not _values_equal(old_value, self._value):
+            self._version = next(_VERSION_COUNTER)
 
     @property
     def tex(self):
@@ -544,6 +575,7 @@ class Param:
 
         """
         self._value.ito(units)
+        self._version = next(_VERSION_COUNTER)
 
     @property
     def prior_llh(self):
@@ -598,6 +630,7 @@ class DerivedParam(Param):
         '_value',
         '_range',
         '_units',
+        '_version',
         'normalize_values',
         '_depends_names',
         '_dependson',
@@ -642,6 +675,7 @@ class DerivedParam(Param):
         self._dependson = tuple([])
         self._configured = False
         self._callable = None
+        self._version = next(_VERSION_COUNTER)
 
         self._range = None
         self._tex = None
@@ -686,6 +720,13 @@ class DerivedParam(Param):
     def validate_value(self, value):
         return 
 
+    @property
+    def version(self):
+        """tuple : versions of the params this one depends on"""
+        if not self._configured:
+            return self._version
+        return tuple(param.version for param in self._dependson.values())
+
     @property
     def range(self): 
         # if this is not re-implemented, the setter gets very confused 
@@ -1553,6 +1594,14 @@ class ParamSet(MutableSequence, Set):
     def state(self):
         return tuple(obj.state for obj in self._params)
 
+    @property
+    def versions(self):
+        """tuple : version counters of the params. Changes whenever any
+        param value changes or params are replaced, so this is a cheap way of
+        detecting changes compared with `values_hash` (but, unlike the latter,
+        does not return to a previous state when values do)."""
+        return tuple(obj.version for obj in self._params)
+
     @property
     def values_hash(self):
         """int : hash only on the current param values (not full state)"""
@@ -2147,6 +2196,25 @@ def test_ParamSet():
     logging.debug(str((param_set2)))
     assert param_set2 == param_set
 
+    # Test that versions only change along with values
+    versions = param_set.versions
+    param_set.reco_energy = ureg.Quantity("10.1 GeV")
+    param_set.free._rescaled_values = param_set.free._rescaled_values
+    assert param_set.versions == versions
+    param_set.reco_energy = ureg.Quantity("10.2 GeV")
+    assert param_set.versions[0] != versions[0]
+    assert param_set.versions[1] == versions[1]
+    # replacing a param by a different one always changes the versions, ...
+    versions = param_set.versions
+    param_set.reco_coszen = Param(
+        name='reco_coszen', value=0.1, prior=None, range=[-1, 1], is_fixed=True
+    )
+    assert param_set.versions[1] != versions[1]
+    # ... while a copy keeps the version along with the value
+    versions = param_set.versions
+    param_set.reco_coszen = deepcopy(param_set.reco_coszen)
+    assert param_set.versions == versions
+
     # Test case added as a result of issue #543
     # https://github.com/IceCubeOpenSource/pisa/issues/543
     param_set = ParamSet(
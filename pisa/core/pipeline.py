@@ -84,6 +84,16 @@ class Pipeline():
     profile : bool
         Perform timings
 
+    Notes
+    -----
+    If the `partial_runs` option is set in the pipeline section of the config
+    (or the attribute is set to True), the pipeline keeps a copy of all data
+    modified by the stages' `apply` functions after each stage, and `run`
+    resumes from the first stage whose params have changed since the previous
+    run, restoring the data as of just before that stage. This requires all
+    stages' outputs to be fully determined by their params, and costs one
+    copy of the modified data (e.g. `weights`) per stage in memory.
+
     """
 
     def __init__(self, config, profile=False):
@@ -100,10 +110,15 @@ class Pipeline():
         self.pisa_version = None
 
         self.name = config['pipeline']['name']
-        self.data = ContainerSet(self.name)
+        self.fused_storage = config['pipeline'].get('fused_storage', False)
+        """Whether services may process all containers' data at once"""
+        self.data = ContainerSet(self.name, fused=self.fused_storage)
         self.detector_name = config['pipeline']['detector_name']
         self._output_binning = config['pipeline']['output_binning']
         self.output_key = config['pipeline']['output_key']
+        self.partial_runs = config['pipeline'].get('partial_runs', False)
+        """Whether to only re-run stages from the first one with changed
+        params"""
 
         self._profile = profile
         self._setup_times = []
@@ -111,6 +126,8 @@ class Pipeline():
         self._get_outputs_times = []
 
         self._stages = []
+        self._stage_snapshots = []
+        self._stage_param_versions = []
         self._config = config
         self._init_stages()
         self._apply_modes = [s.apply_mode for s in self.stages]
@@ -543,6 +560,7 @@ class Pipeline():
         if apply_modes != self._apply_modes:
             # possible that stage apply_modes got manipulated in between runs
             self.assert_apply_modes_consistency()
+            self._clear_stage_snapshots()
         if self.profile:
             start_t = time()
             self._run_function()
@@ -555,10 +573,57 @@ class Pipeline():
 
     def _run_function(self):
         """Run the pipeline to compute"""
+        if self.partial_runs:
+            self._run_partial()
+            return
         for stage in self.stages:
             logging.debug(f"Working on stage {stage.stage_name}.{stage.service_name}")
             stage.run()
 
+    def _first_dirty_stage(self):
+        """Index of the first stage whose params changed since it was last
+        run (or the number of stages if none did)"""
+        for i, stage in enumerate(self.stages):
+            if (i >= len(self._stage_param_versions)
+                or stage.params.versions != self._stage_param_versions[i]):
+                return i
+        return len(self.stages)
+
+    def _run_partial(self):
+        """Run the pipeline starting from the first stage with changed params,
+        restoring the data as left by the preceding stage in the previous run"""
+        start = self._first_dirty_stage()
+        logging.debug(f"Resuming pipeline run at stage #{start}")
+        changed_keys = {c.name: set() for c in self.data.containers}
+        if start > 0:
+            snapshots = self._stage_snapshots[start - 1]
+            for container in self.data.containers:
+                container.restore_snapshot(snapshots[container.name])
+                changed_keys[container.name].update(snapshots[container.name])
+        del self._stage_snapshots[start:]
+        del self._stage_param_versions[start:]
+
+        for stage in self.stages[start:]:
+            logging.debug(f"Working on stage {stage.stage_name}.{stage.service_name}")
+            stage.compute()
+            for container in self.data.containers:
+                container.start_tracking_changes()
+            stage.apply()
+            snapshots = {}
+            for container in self.data.containers:
+                changed_keys[container.name].update(container.stop_tracking_changes())
+                snapshots[container.name] = container.get_snapshot(
+                    changed_keys[container.name]
+                )
+            self._stage_snapshots.append(snapshots)
+            self._stage_param_versions.append(stage.params.versions)
+
+    def _clear_stage_snapshots(self):
+        """Forget the data kept for partial runs, such that the next run
+        starts from the first stage"""
+        self._stage_snapshots = []
+        self._stage_param_versions = []
+
     def setup(self):
         """Wrapper around `_setup_function`"""
         if self.profile:
@@ -571,7 +636,8 @@ class Pipeline():
 
     def _setup_function(self):
         """Setup (reset) all stages"""
-        self.data = ContainerSet(self.name)
+        self._clear_stage_snapshots()
+        self.data = ContainerSet(self.name, fused=self.fused_storage)
         for stage in self.stages:
             stage.data = self.data
             stage.setup()
@@ -901,6 +967,101 @@ def test_Pipeline():
     counts_tot2 = sum(out2.num_entries.values())
     assert np.isclose(counts_tot2, counts_tot)
 
+    #
+    # Test: compute cache restores outputs of previously seen param values
+    #
+    config = parse_pipeline_config("settings/pipeline/example.cfg")
+    config[('osc', 'prob3')]['compute_cache_size'] = 2
+    p = Pipeline(config)
+    osc = p.stages[p.index('osc')]
+    t23_0 = p.params.theta23.value
+    out0 = p.get_outputs()
+    p.params.theta23.value = t23_0 + 3 * ureg.deg
+    out1 = p.get_outputs()
+    p.params.theta23.value = t23_0
+    out2 = p.get_outputs()
+    assert osc.compute_cache_hits == 1
+    assert osc.compute_cache_misses == 2
+    for m0, m1, m2 in zip(out0, out1, out2):
+        assert np.array_equal(m0.nominal_values, m2.nominal_values)
+        assert not np.array_equal(m0.nominal_values, m1.nominal_values)
+
+    #
+    # Test: setup cache restores earth layers in a second, identical pipeline
+    #
+    import tempfile
+    from shutil import rmtree
+    from pisa.core import stage as stage_module
+    config[('osc', 'prob3')]['setup_cache'] = True
+    cache_dir = stage_module.CACHE_DIR
+    stage_module.CACHE_DIR = tempfile.mkdtemp()
+    try:
+        outputs, osc_layers, osc_hits = [], [], []
+        for _ in range(2):
+            p = Pipeline(config)
+            osc = p.stages[p.index('osc')]
+            osc_hits.append(osc.setup_cache_hits)
+            osc.data.representation = osc.calc_mode
+            osc_layers.append(osc.data.containers[0]['densities'])
+            outputs.append(p.get_outputs())
+    finally:
+        rmtree(stage_module.CACHE_DIR)
+        stage_module.CACHE_DIR = cache_dir
+    assert osc_hits == [0, 1]
+    assert np.array_equal(osc_layers[0], osc_layers[1])
+    for m0, m1 in zip(*outputs):
+        assert np.array_equal(m0.nominal_values, m1.nominal_values)
+
+    #
+    # Test: partial runs give the same outputs as full runs
+    #
+    config = parse_pipeline_config("settings/pipeline/example.cfg")
+    p_full = Pipeline(config)
+    config['pipeline']['partial_runs'] = True
+    p_part = Pipeline(config)
+    aeff_idx = p_part.index('aeff')
+    t23_0 = p_part.params.theta23.value
+    for pname, val, first_dirty in [
+        (None, None, 0),
+        ('aeff_scale', 1.3 * ureg.dimensionless, aeff_idx),
+        ('theta23', t23_0 + 3 * ureg.deg, p_part.index('osc')),
+        ('aeff_scale', 1.0 * ureg.dimensionless, aeff_idx),
+        (None, None, len(p_part.stages)),
+    ]:
+        if pname is not None:
+            p_full.params[pname].value = val
+            p_part.params[pname].value = val
+        assert p_part._first_dirty_stage() == first_dirty # pylint: disable=protected-access
+        for m0, m1 in zip(p_full.get_outputs(), p_part.get_outputs()):
+            assert np.allclose(m0.nominal_values, m1.nominal_values, rtol=1e-12)
+
+    #
+    # Test: fused storage gives the same outputs as per-container processing
+    #
+    config = parse_pipeline_config("settings/pipeline/example.cfg")
+    config[('osc', 'prob3')]['calc_mode'] = 'events'
+    p_sep = Pipeline(config)
+    config['pipeline']['fused_storage'] = True
+    p_fused = Pipeline(config)
+    assert p_fused.data.fused
+    for m0, m1 in zip(p_sep.get_outputs(), p_fused.get_outputs()):
+        assert np.allclose(m0.nominal_values, m1.nominal_values, rtol=1e-12)
+
+    #
+    # Test: probabilities interpolated from a node grid approximate the
+    # event-by-event calculation
+    #
+    config = parse_pipeline_config("settings/pipeline/example.cfg")
+    node_mode = config[('osc', 'prob3')]['calc_mode']
+    config[('osc', 'prob3')]['calc_mode'] = 'events'
+    p_events = Pipeline(config)
+    config[('osc', 'prob3')]['node_mode'] = node_mode
+    p_nodes = Pipeline(config)
+    for m0, m1 in zip(p_events.get_outputs(), p_nodes.get_outputs()):
+        diff = np.abs(m0.nominal_values - m1.nominal_values)
+        assert np.max(diff) < 2e-2 * np.max(m0.nominal_values), m0.name
+        assert np.isclose(np.sum(m0.nominal_values), np.sum(m1.nominal_values), rtol=1e-2)
+
     #
     # Test: a pipeline using a VarBinning
     #
@@ -8,15 +8,18 @@ from __future__ import absolute_import, division
 from copy import deepcopy
 from collections.abc import Mapping
 import inspect
+import os
 from time import time
 
+from pisa import CACHE_DIR, FTYPE
 from pisa.core.binning import MultiDimBinning
 from pisa.core.container import Container, ContainerSet
 from pisa.utils.format import format_times
 from pisa.utils.log import logging
 from pisa.core.param import ParamSelector
+from pisa.utils.cache import DiskCache, LRUCache
 from pisa.utils.format import arg_str_seq_none
-from pisa.utils.hash import hash_obj
+from pisa.utils.hash import hash_file, hash_obj
 
 
 __all__ = ["Stage"]
@@ -73,6 +76,28 @@ class Stage():
         `setup()` can be automatically rerun whenever `calc_mode` is
         changed.
 
+    compute_cache_size : int or None
+        If set, keep the outputs of up to this many `compute()` calls with
+        distinct param values in memory, and restore them instead of calling
+        `compute_function()` again when the same param values recur. Outputs
+        are all container keys marked as changed by `compute_function()`, plus
+        the stage attributes listed in `compute_cache_attrs`. Only use for
+        services whose outputs are fully determined by their params.
+
+    compute_cache_max_mem : float or None
+        Memory budget in MB for the outputs held by the compute cache (only
+        effective together with `compute_cache_size`)
+
+    setup_cache : bool
+        If True, services store the products of expensive setup steps (see
+        `setup_cached`) on disk under `CACHE_DIR`, and load them from there
+        when instantiated again with identical inputs.
+
+    setup_cache_max_size : float or None
+        Size limit in MB of the setup cache directory; least recently used
+        entries are evicted when it is exceeded. If None, the default of
+        `pisa.utils.cache.DiskCache` applies.
+
     """
 
     def __init__(
@@ -88,6 +113,10 @@ class Stage():
         apply_mode=None,
         profile=False,
         in_standalone_mode=False,
+        compute_cache_size=None,
+        compute_cache_max_mem=None,
+        setup_cache=False,
+        setup_cache_max_size=None,
     ):
         # Allow for string inputs, but have to populate into lists for
         # consistent interfacing to one or multiple of these things
@@ -169,6 +198,9 @@ class Stage():
         """Hash of stage params. Also serves as an indicator of whether `setup()`
         has already been called."""
 
+        self.param_versions = None
+        """Versions of stage params at the time of the last `compute()`"""
+
         self.profile = profile
         """Whether to perform timings"""
 
@@ -179,6 +211,26 @@ class Stage():
         self.in_standalone_mode = in_standalone_mode
         """Whether stage is standalone or part of a pipeline"""
 
+        self._compute_cache = None
+        if compute_cache_size:
+            self._compute_cache = LRUCache(
+                max_entries=compute_cache_size, max_mem=compute_cache_max_mem
+            )
+
+        self.compute_cache_attrs = ()
+        """Names of attributes that `compute_function` keeps state in, which
+        are stored and restored along with its outputs by the compute cache"""
+
+        self._setup_cache = None
+        if setup_cache:
+            self._setup_cache = DiskCache(
+                path=os.path.join(CACHE_DIR, 'setup_cache'),
+                max_size=setup_cache_max_size
+            )
+
+        self.setup_cache_hits = 0
+        """Number of `setup_cached` calls served from the setup cache"""
+
         self.data = data
         """Data based on which stage may make computations and which it may
         modify"""
@@ -200,6 +252,25 @@ class Stage():
                              nindent_detailed=len(func_str) + 1,
                              detailed=detailed, **format_num_kwargs)
             )
+        if self._compute_cache is not None:
+            print('- compute cache: %d hits, %d misses'
+                  % (self.compute_cache_hits, self.compute_cache_misses))
+        if self._setup_cache is not None:
+            print('- setup cache: %d hits' % self.setup_cache_hits)
+
+    @property
+    def compute_cache_hits(self):
+        """Number of `compute()` calls served from the compute cache"""
+        if self._compute_cache is None:
+            return 0
+        return self._compute_cache.hits
+
+    @property
+    def compute_cache_misses(self):
+        """Number of `compute()` calls not found in the compute cache"""
+        if self._compute_cache is None:
+            return 0
+        return self._compute_cache.misses
 
     def select_params(self, selections, error_on_missing=False):
         """Apply the `selections` to contained ParamSet.
@@ -469,37 +540,187 @@ class Stage():
         else:
             self.setup_function()
 
-        # invalidate param hash:
+        # invalidate param hash and any cached outputs:
         self.param_hash = -1
+        self.param_versions = None
+        if self._compute_cache is not None:
+            self._compute_cache.clear()
 
     def setup_function(self):
         """Implement in services (subclasses of Stage)"""
         pass
 
+    def setup_cached(self, func, output_keys, input_keys=(), files=(),
+                     params=(), attrs=()):
+        """Call `func`, which computes `output_keys` in all containers, or
+        load its outputs from the setup cache if it has been called with
+        identical inputs before (by any instance of this service).
+
+        The cache entry is identified by the service's source code, `func`'s
+        name, the current representation, the contents of `input_keys` in all
+        containers, the contents of `files`, the values of `params` and
+        `attrs`, as well as all attributes included in the stage's hash. It is
+        up to the caller to declare everything the outputs depend on.
+
+        Parameters
+        ----------
+        func : callable
+            Called without arguments; must set `output_keys` in all containers
+            of the current representation
+
+        output_keys : sequence of str
+
+        input_keys : sequence of str
+            Container keys that `func` reads
+
+        files : sequence of str
+            (Resource) paths of files that `func` reads
+
+        params : sequence of str
+            Names of stage params whose values `func` depends on
+
+        attrs : sequence of str
+            Names of stage attributes whose values `func` depends on
+
+        Returns
+        -------
+        loaded : bool
+            Whether the outputs were loaded from the setup cache
+
+        """
+        if self._setup_cache is None or self.data is None:
+            func()
+            return False
+
+        representation = self.data.representation
+        key_parts = [
+            self.source_code_hash,
+            func.__name__,
+            sorted(output_keys),
+            FTYPE.__name__,
+            hash_obj(representation),
+            [hash_obj(self.params[name].value) for name in params],
+            [hash_obj(getattr(self, attr)) for attr in attrs],
+            [hash_obj(getattr(self, attr)) for attr in sorted(self._attrs_to_hash)],
+            [hash_file(fname) for fname in files],
+        ]
+        for container in self.data.containers:
+            key_parts.append(container.name)
+            key_parts.extend(hash_obj(container[key]) for key in input_keys)
+        cache_key = hash_obj(key_parts, hash_to='hex')
+
+        arrays = self._setup_cache.load(cache_key)
+        if arrays is not None:
+            try:
+                for container in self.data.containers:
+                    for key in output_keys:
+                        container[key] = arrays[f'{container.name}__{key}']
+            except KeyError:
+                logging.warning(
+                    'Incomplete setup cache entry %s, recomputing', cache_key
+                )
+            else:
+                logging.debug(
+                    'Loaded outputs of %s.%s from setup cache',
+                    self.service_name, func.__name__
+                )
+                self.setup_cache_hits += 1
+                return True
+
+        func()
+        self.data.representation = representation
+        arrays = {}
+        for container in self.data.containers:
+            for key in output_keys:
+                arrays[f'{container.name}__{key}'] = container[key]
+        self._setup_cache.store(cache_key, arrays)
+        return False
+
     def compute(self):
 
-        # simplest caching algorithm: don't compute if params didn't change
+        # simplest caching algorithm: don't compute if params didn't change;
+        # comparing versions is cheap, only hash values if any were touched
+        new_param_versions = self.params.versions
+        if new_param_versions == self.param_versions:
+            logging.trace("cached output")
+            return
+
         new_param_hash = self.params.values_hash
         if new_param_hash == self.param_hash:
             logging.trace("cached output")
+            self.param_versions = new_param_versions
             return
 
         if self.calc_mode is not None:
             self.data.representation = self.calc_mode
 
-        if self.profile:
-            start_t = time()
-            self.compute_function()
-            end_t = time()
-            self.calc_times.append(end_t - start_t)
-        else:
-            self.compute_function()
+        if self._compute_cache is not None:
+            cache_entry = self._compute_cache.get(new_param_hash)
+            if cache_entry is not None:
+                logging.trace("restoring output from compute cache")
+                self._restore_compute_cache_entry(cache_entry)
+                self.param_hash = new_param_hash
+                self.param_versions = new_param_versions
+                return
+            self._set_change_tracking(True)
+
+        try:
+            if self.profile:
+                start_t = time()
+                self.compute_function()
+                end_t = time()
+                self.calc_times.append(end_t - start_t)
+            else:
+                self.compute_function()
+        finally:
+            # never leave tracking on, e.g. if `compute_function` raised
+            if self._compute_cache is not None:
+                changed_keys = self._set_change_tracking(False)
+
+        if self._compute_cache is not None:
+            self._compute_cache[new_param_hash] = (
+                self._create_compute_cache_entry(changed_keys)
+            )
         self.param_hash = new_param_hash
+        self.param_versions = new_param_versions
 
     def compute_function(self):
         """Implement in services (subclasses of Stage)"""
         pass
 
+    def _set_change_tracking(self, active):
+        """Start or stop tracking of changed keys in all containers. When
+        stopping, return the changed keys as dict of form [container name]"""
+        changed_keys = {}
+        if self.data is None:
+            return changed_keys
+        for container in self.data.containers:
+            if active:
+                container.start_tracking_changes()
+            else:
+                changed_keys[container.name] = container.stop_tracking_changes()
+        return changed_keys
+
+    def _create_compute_cache_entry(self, changed_keys):
+        """Snapshot the outputs of `compute_function`"""
+        snapshots = {}
+        if self.data is not None:
+            for container in self.data.containers:
+                snapshots[container.name] = container.get_snapshot(
+                    changed_keys[container.name]
+                )
+        attrs = {
+            attr: deepcopy(getattr(self, attr)) for attr in self.compute_cache_attrs
+        }
+        return {'snapshots': snapshots, 'attrs': attrs}
+
+    def _restore_compute_cache_entry(self, cache_entry):
+        """Restore outputs of `compute_function` from a compute cache entry"""
+        for name, snapshot in cache_entry['snapshots'].items():
+            self.data[name].restore_snapshot(snapshot)
+        for attr, val in cache_entry['attrs'].items():
+            setattr(self, attr, deepcopy(val))
+
     def apply(self):
 
         if self.apply_mode is not None:
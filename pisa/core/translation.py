@@ -27,7 +27,7 @@ from concurrent.futures import ThreadPoolExecutor
 
 from pisa import FTYPE, TARGET, PISA_NUM_THREADS
 from pisa.core.binning import OneDimBinning, MultiDimBinning
-from pisa.utils.comparisons import recursiveEquality
+from pisa.utils.comparisons import ALLCLOSE_KW, recursiveEquality
 from pisa.utils.log import logging, set_verbosity
 from pisa.utils.numba_tools import myjit
 from pisa.utils import vectorizer
@@ -36,10 +36,17 @@ from pisa.utils.profiler import line_profile, profile
 __all__ = [
     'resample',
     'histogram',
+    'histogram_counts',
     'lookup',
+    'find_bin_indices',
+    'histogram_indices',
+    'lookup_indices',
     'find_index',
     'find_index_unsafe',
     'test_histogram',
+    'test_histogram_counts',
+    'test_histogram_nb',
+    'test_bin_indices',
     'test_find_index',
 ]
 
@@ -49,7 +56,8 @@ FX = 'f4' if FTYPE == np.float32 else 'f8'
 
 # --------- resampling ------------
 
-def resample(weights, old_sample, old_binning, new_sample, new_binning):
+def resample(weights, old_sample, old_binning, new_sample, new_binning,
+             flat_hist_counts=None):
     """Resample binned data with a given binning into any arbitrary
     `new_binning`
 
@@ -60,6 +68,10 @@ def resample(weights, old_sample, old_binning, new_sample, new_binning):
     old_binning : PISA MultiDimBinning
     new_sample : list of np.ndarray
     new_binning : PISA MultiDimBinning
+    flat_hist_counts : np.ndarray or None
+        Counts of `old_sample` in `new_binning` as returned by
+        ``histogram_counts(old_sample, new_binning, use_fh=False)``, if
+        already known; computed otherwise
 
     Returns
     -------
@@ -71,8 +83,11 @@ def resample(weights, old_sample, old_binning, new_sample, new_binning):
 
     # This is a two step process: first histogram the weights into the new binning
     # and keep the flat_hist_counts
-    flat_hist = histogram_np(old_sample, weights, new_binning, apply_weights=True)
-    flat_hist_counts = histogram_np(old_sample, weights, new_binning, apply_weights=False)
+    flat_hist = histogram_nb(old_sample, weights, new_binning, apply_weights=True)
+    if flat_hist_counts is None:
+        flat_hist_counts = histogram_counts(old_sample, new_binning, use_fh=False)
+    if flat_hist.ndim == 2:
+        flat_hist_counts = flat_hist_counts[:, np.newaxis]
 
     with np.errstate(divide='ignore', invalid='ignore'):
         flat_hist /= flat_hist_counts
@@ -82,7 +97,7 @@ def resample(weights, old_sample, old_binning, new_sample, new_binning):
     new_hist_vals = lookup(new_sample, weights, old_binning)
 
     # Now, for bin we have 1 or less counts, take the lookedup value instead:
-    mask = flat_hist_counts > 1
+    mask = np.broadcast_to(flat_hist_counts > 1, flat_hist.shape)
     new_hist_vals[mask] = flat_hist[mask]
 
     return new_hist_vals
@@ -90,7 +105,8 @@ def resample(weights, old_sample, old_binning, new_sample, new_binning):
 
 # --------- histogramming methods ---------------
 
-def histogram(sample, weights, binning, averaged, apply_weights=True):
+def histogram(sample, weights, binning, averaged, apply_weights=True,
+              flat_hist_counts=None):
     """Histogram `sample` points, weighting by `weights`, according to `binning`.
 
     Parameters
@@ -98,6 +114,9 @@ def histogram(sample, weights, binning, averaged, apply_weights=True):
     sample : list of np.ndarray
 
     weights : np.ndarray
+        One- or two-dimensional; in the latter case, each of the columns (i.e.
+        values per sample point along first axis) is histogrammed, all in a
+        single pass over the sample
 
     binning : PISA MultiDimBinning
 
@@ -110,27 +129,65 @@ def histogram(sample, weights, binning, averaged, apply_weights=True):
     apply_weights : bool
         wether to use weights or not
 
+    flat_hist_counts : np.ndarray or None
+        Counts of `sample` in `binning` as returned by `histogram_counts`, if
+        already known (only used if `averaged`); computed otherwise
+
     """
     if not isinstance(binning, MultiDimBinning):
         raise ValueError("Binning should be a PISA MultiDimBinning")
 
-    if binning.is_irregular or not binning.is_lin:
-        flat_hist = histogram_np(sample, weights, binning, apply_weights=True)
-    else:
+    use_fh = not binning.is_irregular and binning.is_lin
+    if weights is not None and weights.ndim == 2:
+        # fill all columns in a single pass over the sample, with the edge
+        # conventions of `histogram_fh` where that would have been used
+        flat_hist = histogram_nb(sample, weights, binning, apply_weights=True,
+                                 half_open=use_fh)
+    elif use_fh:
         flat_hist = histogram_fh(sample, weights, binning, apply_weights=True)
+    else:
+        flat_hist = histogram_nb(sample, weights, binning, apply_weights=True)
     if averaged:
-        if binning.is_irregular or not binning.is_lin:
-            flat_hist_counts = histogram_np(sample, weights, binning,
-                                            apply_weights=False)
-        else:
-            flat_hist_counts = histogram_fh(sample, weights, binning,
-                                            apply_weights=False)
+        if flat_hist_counts is None:
+            flat_hist_counts = histogram_counts(sample, binning, use_fh=use_fh)
+        if flat_hist.ndim == 2:
+            flat_hist_counts = flat_hist_counts[:, np.newaxis]
         with np.errstate(divide='ignore', invalid='ignore'):
             flat_hist /= flat_hist_counts
             flat_hist = np.nan_to_num(flat_hist)
 
     return flat_hist
 
+def histogram_counts(sample, binning, use_fh=None):
+    """Number of `sample` points per bin of `binning`.
+
+    Counts only depend on the sample, so callers histogramming several
+    weights for the same sample (see e.g. `Container`) can compute them once
+    and pass them to `histogram` or `resample`.
+
+    Parameters
+    ----------
+    sample : list of np.ndarray or np.ndarray
+
+    binning : PISA MultiDimBinning
+
+    use_fh : bool or None
+        Whether to use `histogram_fh` (or else `histogram_nb`), which differ
+        in the treatment of the uppermost bin edge; if None, `histogram_fh` is
+        used wherever possible, as in `histogram`
+
+    Returns
+    -------
+    flat_hist_counts : np.ndarray
+
+    """
+    if use_fh is None:
+        use_fh = not binning.is_irregular and binning.is_lin
+    if use_fh:
+        return histogram_fh(sample, None, binning, apply_weights=False)
+    return histogram_nb(sample, None, binning, apply_weights=False)
+
+
 def _threaded_fh_histogramdd(sample, weights, bins, bin_range):
     if not TARGET == "parallel":
         return fh.histogramdd(sample=sample, weights=weights, bins=bins, range=bin_range)
@@ -144,10 +201,12 @@ def _threaded_fh_histogramdd(sample, weights, bins, bin_range):
             chunked_weights = []
         ndim = len(sample)
         for i in range(splits):
-            one_chunk = tuple(sample[j][i * chunk:(i+1) * chunk] for j in range(ndim))
+            # last chunk takes the remainder
+            stop = (i+1) * chunk if i < splits - 1 else None
+            one_chunk = tuple(sample[j][i * chunk:stop] for j in range(ndim))
             chunked_sample.append(one_chunk)
             if weights is not None:
-                chunked_weights.append(weights[i * chunk:(i+1) * chunk])
+                chunked_weights.append(weights[i * chunk:stop])
         if weights is not None:
             f = lambda s, w: fh.histogramdd(s, weights=w, bins=bins, range=bin_range)
             results = pool.map(f, chunked_sample, chunked_weights)
@@ -211,6 +270,161 @@ def histogram_np(sample, weights, binning, apply_weights=True):  # pylint: disab
         flat_hist = hist.ravel()
     return flat_hist.astype(FTYPE)
 
+# edge types of the dimensions passed to `_histogramdd`
+_LIN, _LOG, _IRREGULAR, _HALF_OPEN = 0, 1, 2, 3
+
+# number of samples per block processed by `_histogramdd`
+_HIST_BLOCK_SIZE = 1024
+
+
+def histogram_nb(sample, weights, binning, apply_weights=True, half_open=False):  # pylint: disable=missing-docstring
+    """Helper function for numba histograms.
+
+    Supports any binning and by default follows the conventions of
+    `histogram_np` (i.e. `numpy.histogramdd`): bins are half-open
+    ``[lower, upper)``, except for the last bin per dimension, which includes
+    its upper edge. With `half_open`, which requires linearly-regular
+    binnings, all bins exclude their upper edges, exactly as in
+    `histogram_fh`. Samples are split into `PISA_NUM_THREADS` chunks, each of
+    which is histogrammed into a private accumulator. For 2-dim `weights`, all
+    columns are filled in the same pass.
+    """
+    if half_open and (binning.is_irregular or not binning.is_lin):
+        raise ValueError("Binning should be linearly-regular to use half-open bins.")
+    if isinstance(sample, np.ndarray):
+        # (N,) or (N, D) array, as accepted by `numpy.histogramdd`
+        sample = sample.reshape(len(sample), -1).T
+    sample = np.stack([np.asarray(s) for s in sample])
+
+    edges = []
+    edge_types = []
+    # uniform bins: index = (transformed x - start) * scale
+    starts = []
+    scales = []
+    for dim in binning:
+        dim_edges = dim.edge_magnitudes.astype(np.float64)
+        edges.append(dim_edges)
+        if half_open:
+            edge_types.append(_HALF_OPEN)
+        elif dim.is_irregular:
+            edge_types.append(_IRREGULAR)
+        elif dim.is_log:
+            edge_types.append(_LOG)
+            dim_edges = np.log(dim_edges)
+        else:
+            edge_types.append(_LIN)
+        starts.append(dim_edges[0])
+        scales.append(dim.num_bins / (dim_edges[-1] - dim_edges[0]))
+    edge_offsets = np.cumsum([0] + [len(e) for e in edges]).astype(np.int64)
+
+    # 2-dim weights means it's 1-dim data instead of scalars
+    is_array = weights is not None and weights.ndim == 2
+    num_columns = weights.shape[1] if is_array else 1
+    apply_weights = apply_weights and weights is not None
+    if apply_weights:
+        weights = weights.reshape(len(weights), num_columns)
+    else:
+        weights = np.ones((1, 1), dtype=np.float64)
+
+    flat_hist = _histogramdd(
+        sample,
+        weights,
+        apply_weights,
+        np.concatenate(edges),
+        edge_offsets,
+        np.array(edge_types, dtype=np.int64),
+        np.array(starts, dtype=np.float64),
+        np.array(scales, dtype=np.float64),
+        binning.size,
+        num_columns,
+        PISA_NUM_THREADS,
+    )
+    if not is_array:
+        flat_hist = flat_hist[:, 0]
+    return flat_hist.astype(FTYPE)
+
+
+@njit
+def _update_indices(x, indices, edges, num_bins, edge_type, start, scale):
+    """Update the flat bin `indices` of samples `x` by the dimension with bin
+    `edges` (setting them to -1 if outside or nan), following the conventions
+    of `numpy.histogramdd` (or of `fast_histogram` for `_HALF_OPEN`)"""
+    # separate loops per edge type, such that these remain branch-light
+    if edge_type == _HALF_OPEN:
+        for j in range(len(x)):
+            idx = min(int((x[j] - start) * scale), num_bins - 1)
+            if x[j] >= edges[0] and x[j] < edges[num_bins] and indices[j] >= 0:
+                indices[j] = indices[j] * num_bins + idx
+            else:
+                indices[j] = -1
+        return
+
+    for j in range(len(x)):
+        if not (x[j] >= edges[0] and x[j] <= edges[num_bins] and indices[j] >= 0):
+            indices[j] = -1
+            continue
+        if edge_type == _IRREGULAR:
+            # branchless binary search for the last edge <= x
+            idx = 0
+            size = num_bins
+            while size > 1:
+                half = size // 2
+                idx += half * (edges[idx + half] <= x[j])
+                size -= half
+        else:
+            # initial guess from the uniform bin spacing, then fix up against
+            # the actual edges to be robust against rounding
+            if edge_type == _LOG:
+                idx = int((np.log(x[j]) - start) * scale)
+            else:
+                idx = int((x[j] - start) * scale)
+            idx = min(max(idx, 0), num_bins - 1)
+            while idx > 0 and x[j] < edges[idx]:
+                idx -= 1
+            while idx < num_bins - 1 and x[j] >= edges[idx + 1]:
+                idx += 1
+        indices[j] = indices[j] * num_bins + idx
+
+
+@njit(parallel=True if TARGET == "parallel" else False)
+def _histogramdd(sample, weights, apply_weights, edges, edge_offsets,
+                 edge_types, starts, scales, num_bins, num_columns, num_chunks):
+    """Histogram the (num_dims, num_samples) `sample`, summing (num_samples,
+    num_columns) `weights` if `apply_weights` (or else counting), into a
+    (num_bins, num_columns) flat histogram using one private accumulator per
+    chunk of samples"""
+    num_dims, num_samples = sample.shape
+    chunk_size = (num_samples + num_chunks - 1) // num_chunks
+    partial_hists = np.zeros((num_chunks, num_bins, num_columns), dtype=np.float64)
+    for chunk in prange(num_chunks):
+        stop = min((chunk + 1) * chunk_size, num_samples)
+        # find the flat bin indices of small blocks of samples one dimension
+        # at a time, which keeps the inner loops simple, then fill them in
+        indices = np.empty(_HIST_BLOCK_SIZE, dtype=np.int64)
+        for block_start in range(chunk * chunk_size, stop, _HIST_BLOCK_SIZE):
+            block_stop = min(block_start + _HIST_BLOCK_SIZE, stop)
+            block_indices = indices[:block_stop - block_start]
+            block_indices[:] = 0
+            for d in range(num_dims):
+                _update_indices(
+                    sample[d, block_start:block_stop],
+                    block_indices,
+                    edges[edge_offsets[d]:edge_offsets[d + 1]],
+                    edge_offsets[d + 1] - edge_offsets[d] - 1,
+                    edge_types[d],
+                    starts[d],
+                    scales[d],
+                )
+            for j in range(block_stop - block_start):
+                if block_indices[j] < 0:
+                    continue
+                for c in range(num_columns):
+                    if apply_weights:
+                        partial_hists[chunk, block_indices[j], c] += weights[block_start + j, c]
+                    else:
+                        partial_hists[chunk, block_indices[j], c] += 1.
+    return partial_hists.sum(axis=0)
+
 
 # ---------- Lookup methods ---------------
 
@@ -489,6 +703,142 @@ def lookup_regular_3d_array(x, y, z, flat_hist, xmin, xmax, nx, ymin, ymax, ny,
         for d in range(flat_hist.shape[1]):
             out[idx][d] = 0.
 
+# ---------- Index-based methods ---------------
+
+def find_bin_indices(sample, binning):
+    """Find the flat index of the bin of `binning` that each `sample` point
+    falls into, such that repeated histogramming and lookups for the same
+    sample can be done via `histogram_indices` and `lookup_indices`.
+
+    The edge conventions are those of `histogram` and `lookup`: for regular,
+    linear binnings, bins are half-open ``[lower, upper)`` throughout, while
+    for other binnings the upper edge of the last bin is included (as in
+    ``numpy.histogramdd``).
+
+    Parameters
+    ----------
+    sample : num_dims list of length-num_samples np.ndarray
+
+    binning : num_dims MultiDimBinning
+
+    Returns
+    -------
+    indices : length-num_samples np.ndarray of int64
+        Flat (C-order) bin indices, -1 for points outside of the binning or
+        nan
+
+    """
+    if not isinstance(binning, MultiDimBinning):
+        raise ValueError("Binning should be a PISA MultiDimBinning")
+
+    regular = not binning.is_irregular and binning.is_lin
+    indices = np.zeros(len(sample[0]), dtype=np.int64)
+    inside = np.ones(len(sample[0]), dtype=bool)
+    for x, dim in zip(sample, binning):
+        x = np.asarray(x, dtype=np.float64)
+        edges = dim.edge_magnitudes.astype(np.float64)
+        num_bins = dim.num_bins
+        with np.errstate(invalid='ignore'):
+            if regular:
+                inside &= (x >= edges[0]) & (x < edges[-1])
+                idx = (x - edges[0]) * (num_bins / (edges[-1] - edges[0]))
+                idx = np.nan_to_num(idx).astype(np.int64)
+            else:
+                inside &= (x >= edges[0]) & (x <= edges[-1])
+                idx = np.searchsorted(edges, x, side='right') - 1
+        indices *= num_bins
+        indices += np.clip(idx, 0, num_bins - 1)
+    indices[~inside] = -1
+    return indices
+
+
+@njit(parallel=True if TARGET == "parallel" else False)
+def _scatter_add(indices, weights, num_bins, num_chunks):
+    """Sum all columns of 2-dim `weights` into `num_bins` bins given by
+    `indices` (negative ones are skipped) in a single pass, using one partial
+    histogram per chunk of samples"""
+    num_columns = weights.shape[1]
+    chunk_size = (len(indices) + num_chunks - 1) // num_chunks
+    partial_hists = np.zeros((num_chunks, num_bins, num_columns), dtype=np.float64)
+    for chunk in prange(num_chunks):
+        stop = min((chunk + 1) * chunk_size, len(indices))
+        for i in range(chunk * chunk_size, stop):
+            if indices[i] >= 0:
+                for j in range(num_columns):
+                    partial_hists[chunk, indices[i], j] += weights[i, j]
+    return partial_hists.sum(axis=0)
+
+
+def histogram_indices(indices, weights, num_bins, averaged,
+                      flat_hist_counts=None):
+    """Histogram `weights` given pre-computed bin `indices` (see
+    `find_bin_indices`); equivalent to `histogram` for the same sample.
+
+    Parameters
+    ----------
+    indices : np.ndarray of int
+
+    weights : np.ndarray
+        One- or two-dimensional (values per sample point along first axis)
+
+    num_bins : int
+
+    averaged : bool
+        If True, the histogram entries are averages of the numbers that end up
+        in a given bin
+
+    flat_hist_counts : np.ndarray or None
+        Number of `indices` per bin, if already known (only used if
+        `averaged`); computed otherwise
+
+    Returns
+    -------
+    flat_hist : np.ndarray
+
+    """
+    flat_hist = _scatter_add(
+        indices,
+        np.ascontiguousarray(weights.reshape(len(weights), -1), dtype=np.float64),
+        num_bins,
+        PISA_NUM_THREADS,
+    )
+    if weights.ndim == 1:
+        flat_hist = flat_hist[:, 0]
+    flat_hist = flat_hist.astype(FTYPE)
+    if averaged:
+        if flat_hist_counts is None:
+            flat_hist_counts = np.bincount(
+                indices[indices >= 0], minlength=num_bins
+            ).astype(FTYPE)
+        if flat_hist.ndim == 2:
+            flat_hist_counts = flat_hist_counts[:, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flat_hist /= flat_hist_counts
+            flat_hist = np.nan_to_num(flat_hist)
+    return flat_hist
+
+
+def lookup_indices(indices, flat_hist):
+    """Extract the values of `flat_hist` at pre-computed bin `indices` (see
+    `find_bin_indices`), with zeros for negative indices; equivalent to
+    `lookup` for the same sample.
+
+    Parameters
+    ----------
+    indices : np.ndarray of int
+
+    flat_hist : np.ndarray
+
+    Returns
+    -------
+    hist_vals : np.ndarray
+
+    """
+    hist_vals = flat_hist[np.maximum(indices, 0)]
+    hist_vals[indices < 0] = 0.
+    return hist_vals
+
+
 @myjit
 def find_index(val, bin_edges):
     """Find index in binning for `val`. If `val` is below binning range or is
@@ -807,6 +1157,155 @@ def test_histogram():
     logging.info('<< PASS : test_histogram >>')
 
 
+def test_histogram_counts():
+    """Unit tests for `histogram_counts` function."""
+    rand = np.random.RandomState(seed=0)
+    sample = [rand.rand(1000), rand.rand(1000)]
+    weights = rand.rand(1000)
+    for binning in [
+        MultiDimBinning([
+            OneDimBinning(name='x', num_bins=4, is_lin=True, domain=[0, 1]),
+            OneDimBinning(name='y', num_bins=3, is_lin=True, domain=[0, 1]),
+        ]),
+        MultiDimBinning([
+            OneDimBinning(name='x', bin_edges=[0, 0.1, 0.5, 1]),
+            OneDimBinning(name='y', bin_edges=[0, 0.3, 1]),
+        ]),
+    ]:
+        bin_edges = [b.edge_magnitudes for b in binning]
+        ref, _ = np.histogramdd(sample=sample, bins=bin_edges)
+        counts = histogram_counts(sample, binning)
+        assert np.array_equal(counts, ref.ravel())
+        # averaged histogram is the same with precomputed counts
+        ref_w, _ = np.histogramdd(sample=sample, bins=bin_edges, weights=weights)
+        for flat_hist_counts in [None, counts]:
+            test_avg = histogram(sample, weights, binning, averaged=True,
+                                 flat_hist_counts=flat_hist_counts)
+            assert np.allclose(test_avg, ref_w.ravel() / ref.ravel(), **ALLCLOSE_KW)
+
+    # sample modified in place in between: must not reuse the earlier counts
+    binning = MultiDimBinning([
+        OneDimBinning(name='x', num_bins=4, is_lin=True, domain=[0, 4]),
+    ])
+    x = np.array([0.5, 0.6, 2.5], dtype=FTYPE)
+    w = np.array([1, 2, 0], dtype=FTYPE)
+    histogram([x], w, binning, averaged=True)
+    x[:] = [0.5, 2.5, 2.6]
+    test_avg = histogram([x], w, binning, averaged=True)
+    assert np.allclose(test_avg, [1, 0, 1, 0], **ALLCLOSE_KW), test_avg
+
+    logging.info('<< PASS : test_histogram_counts >>')
+
+
+def test_histogram_nb():
+    """Unit tests for `histogram_nb` function.
+
+    Correctness is defined as matching the histogram produced by
+    numpy.histogramdd, including the treatment of bin edges.
+    """
+    n_evts = 10000
+    rand = np.random.RandomState(seed=0)
+    weights = rand.rand(n_evts)
+    weights_2d = rand.rand(n_evts, 3)
+
+    lin = OneDimBinning(name='x', num_bins=7, is_lin=True, domain=[-1, 1])
+    log = OneDimBinning(name='y', num_bins=9, is_log=True, domain=[1, 100])
+    irregular = OneDimBinning(name='z', bin_edges=[0, 0.1, 0.5, 0.6, 1])
+    # points within and outside of the binnings, incl. on all edges and nan
+    lin_x = np.concatenate([rand.rand(n_evts - 10) * 2.2 - 1.1,
+                            lin.edge_magnitudes, [np.nan, 3]])
+    log_x = np.concatenate([10**(rand.rand(n_evts - 12) * 2.2 - 0.1),
+                            log.edge_magnitudes, [np.nan, -1]])
+    irregular_x = np.concatenate([rand.rand(n_evts - 5) * 1.2 - 0.1,
+                                  irregular.edge_magnitudes])
+    all_samples = {'x': lin_x, 'y': log_x, 'z': irregular_x}
+
+    for dims in [[lin], [log], [irregular], [lin, log, irregular], [irregular, lin]]:
+        binning = MultiDimBinning(dims)
+        bin_edges = [b.edge_magnitudes for b in binning]
+        sample = [rand.permutation(all_samples[d.name]) for d in dims]
+        for w in [None, weights, weights_2d]:
+            test = histogram_nb(sample, w, binning)
+            ref = histogram_np(sample, w, binning)
+            assert test.shape == ref.shape
+            assert np.allclose(test, ref, rtol=1e-12, atol=0), \
+                    f'\ntest:\n{test}\n\nref:\n{ref}'
+            test = histogram_nb(sample, w, binning, apply_weights=False)
+            ref = histogram_np(sample, w, binning, apply_weights=False)
+            assert np.array_equal(test, ref), f'\ntest:\n{test}\n\nref:\n{ref}'
+
+    # half-open bins as in fast_histogram, all weight columns in one pass
+    binning = MultiDimBinning([
+        lin, OneDimBinning(name='y', num_bins=5, is_lin=True, domain=[1, 100])
+    ])
+    sample = [rand.permutation(lin_x[:-2]), rand.permutation(log_x[:-2])]
+    test = histogram_nb(sample, weights_2d[:-2], binning, half_open=True)
+    for i in range(weights_2d.shape[1]):
+        ref = histogram_fh(sample, weights_2d[:-2, i], binning)
+        assert np.allclose(test[:, i], ref, rtol=1e-12, atol=0), \
+                f'\ntest:\n{test[:, i]}\n\nref:\n{ref}'
+    assert np.array_equal(
+        histogram(sample, weights_2d[:-2], binning, averaged=False), test
+    )
+
+    # (N, D) array sample as accepted by numpy.histogramdd
+    binning = MultiDimBinning([lin, irregular])
+    sample = np.stack([lin_x, irregular_x], axis=1)
+    assert np.allclose(
+        histogram_nb(sample, weights, binning),
+        histogram_np(sample, weights, binning), rtol=1e-12, atol=0
+    )
+
+    logging.info('<< PASS : test_histogram_nb >>')
+
+
+def test_bin_indices():
+    """Unit tests for `find_bin_indices`, `histogram_indices` and
+    `lookup_indices`.
+
+    Correctness is defined as matching `histogram` and `lookup`.
+    """
+    n_evts = 10000
+    rand = np.random.RandomState(seed=0)
+    weights = rand.rand(n_evts).astype(FTYPE)
+    weights_2d = rand.rand(n_evts, 3).astype(FTYPE)
+
+    regular = MultiDimBinning([
+        OneDimBinning(name='x', num_bins=5, is_lin=True, domain=[0, 1]),
+        OneDimBinning(name='y', num_bins=3, is_lin=True, domain=[-1, 1]),
+    ])
+    irregular = MultiDimBinning([
+        OneDimBinning(name='x', bin_edges=[0, 0.1, 0.5, 0.6, 1]),
+        OneDimBinning(name='y', bin_edges=[-1, 0, 0.2, 1]),
+    ])
+    # points within and outside of the binnings, incl. on the edges
+    sample = [
+        (rand.rand(n_evts) * 1.2 - 0.1).astype(FTYPE),
+        (rand.rand(n_evts) * 2.2 - 1.1).astype(FTYPE),
+    ]
+    sample[0][:4] = [0, 1, 0.5, 0.2]
+    sample[1][:4] = [-1, 1, 0.2, 0.]
+
+    for binning in [regular, irregular]:
+        indices = find_bin_indices(sample, binning)
+        for averaged in [False, True]:
+            for w in [weights, weights_2d]:
+                test = histogram_indices(indices, w, binning.size, averaged)
+                ref = histogram(sample, w, binning, averaged=averaged)
+                assert np.allclose(test, ref, rtol=1e-12, atol=0), \
+                        f'\ntest:\n{test}\n\nref:\n{ref}'
+        for flat_hist in [ref, rand.rand(binning.size).astype(FTYPE)]:
+            test = lookup_indices(indices, flat_hist)
+            ref_vals = lookup(sample, flat_hist, binning)
+            assert np.array_equal(test, ref_vals), \
+                    f'\ntest:\n{test}\n\nref:\n{ref_vals}'
+
+        # nan is outside of any binning
+        assert find_bin_indices([[np.nan], [0.]], binning)[0] == -1
+
+    logging.info('<< PASS : test_bin_indices >>')
+
+
 def test_find_index():
     """Unit tests for `find_index` function.
 
@@ -933,3 +1432,6 @@ if __name__ == '__main__':
     set_verbosity(1)
     test_find_index()
     test_histogram()
+    test_histogram_counts()
+    test_histogram_nb()
+    test_bin_indices()
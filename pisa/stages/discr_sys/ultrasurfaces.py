@@ -213,91 +213,106 @@ class ultrasurfaces(Stage):  # pylint: disable=invalid-name
             for gradient_name in self.gradient_names:
                 container[gradient_name] = np.empty(container.size, dtype=FTYPE)
 
-        # convert the variable columns as well as the event groupings to an array
-        X_pandas = df[self.varnames].to_numpy()
-        if self.event_grouping_key is not None:
-            groupings_array = df[self.event_grouping_key].to_numpy()
-            groupings_set = set(groupings_array) # unique groupings
-            logging.debug(
-                "Event grouping information for ultrasurfaces evaluation taken"
-                " from data frame entry '%s'. Found groupings '%s'.",
-                self.event_grouping_key, groupings_set
-            )
-        else:
-            # without groupings, create one tree containing all events
-            logging.debug("Events will not be grouped for ultrasurfaces evaluation")
-            tree = KDTree(X_pandas)
-        # We will use a nearest-neighbor tree to search for matching events in the
-        # DataFrame. Ideally, these should actually be the exact same events with a
-        # distance of zero. We will raise a warning if we had to approximate an
-        # event by its nearest neighbor with a distance > tolerance.
-        for container in self.data:
-            n_container = len(container["true_energy"])
-            # It's important to match the datatype of the loaded DataFrame (single prec.)
-            # so that matches will be exact (TODO: but matches aren't necessarily exact)
-            X_pisa = np.zeros((n_container, len(self.varnames)), dtype=X_pandas.dtype)
-            for i, vname in enumerate(self.varnames):
-                X_pisa[:, i] = container[vname]
-
-            if self.event_grouping_key is None:
+        def match_gradients():
+            """Take the gradients of each event from its nearest neighbour in
+            the data frame"""
+            # convert the variable columns as well as the event groupings to an array
+            X_pandas = df[self.varnames].to_numpy()
+            if self.event_grouping_key is not None:
+                groupings_array = df[self.event_grouping_key].to_numpy()
+                groupings_set = set(groupings_array) # unique groupings
                 logging.debug(
-                    "Looking for nearest neighbors of %d '%s' events among all"
-                    " %d events in data frame.",
-                    container.size, container.name, len(X_pandas)
+                    "Event grouping information for ultrasurfaces evaluation taken"
+                    " from data frame entry '%s'. Found groupings '%s'.",
+                    self.event_grouping_key, groupings_set
                 )
             else:
-                # produce a dedicated KDTree in case of associated event grouping
-                assoc_grouping = get_us_grouping_from_container_name(
-                    name=container.name,
-                    groupings_set=groupings_set
-                )
-                where = np.where(groupings_array == assoc_grouping)
-                tree = KDTree(X_pandas[where])
-                logging.debug(
-                    "Looking for nearest neighbors of %d '%s' events among all"
-                    " %d '%s' events in data frame.",
-                    container.size, container.name, len(X_pandas[where]), assoc_grouping
-                )
-            # Query the tree for the single nearest neighbor
-            dists, ind = tree.query( # pylint: disable=possibly-used-before-assignment
-                X_pisa, k=1, return_distance=True, dualtree=False,
-                breadth_first=False
-            )
-            n_outside_tol = np.sum(dists > self.distance_tol)
-            if n_outside_tol:
-                max_dist = np.max(dists)
-                frac = float(n_outside_tol) * 100 / n_container
-                logging.warning(
-                    f"For {n_outside_tol} {container.name} events ({frac:.2g}%),"
-                    " the nearest neighbor, from which each gradient will be "
-                    "taken, is at a distance beyond the pre-set tolerance of "
-                    f"{self.distance_tol:.2g}. The maximum distance to a "
-                    f"nearest neighbor is {max_dist:.2g}."
-                )
-
-            if self.debug_mode:
-                outfile = os.path.join(
-                    CACHE_DIR, f"ultrasurfaces_{container.name}_debug_data.npz"
+                # without groupings, create one tree containing all events
+                logging.debug("Events will not be grouped for ultrasurfaces evaluation")
+                tree = KDTree(X_pandas)
+            # We will use a nearest-neighbor tree to search for matching events in the
+            # DataFrame. Ideally, these should actually be the exact same events with a
+            # distance of zero. We will raise a warning if we had to approximate an
+            # event by its nearest neighbor with a distance > tolerance.
+            for container in self.data:
+                n_container = len(container["true_energy"])
+                # It's important to match the datatype of the loaded DataFrame (single prec.)
+                # so that matches will be exact (TODO: but matches aren't necessarily exact)
+                X_pisa = np.zeros((n_container, len(self.varnames)), dtype=X_pandas.dtype)
+                for i, vname in enumerate(self.varnames):
+                    X_pisa[:, i] = container[vname]
+
+                if self.event_grouping_key is None:
+                    logging.debug(
+                        "Looking for nearest neighbors of %d '%s' events among all"
+                        " %d events in data frame.",
+                        container.size, container.name, len(X_pandas)
+                    )
+                else:
+                    # produce a dedicated KDTree in case of associated event grouping
+                    assoc_grouping = get_us_grouping_from_container_name(
+                        name=container.name,
+                        groupings_set=groupings_set
+                    )
+                    where = np.where(groupings_array == assoc_grouping)
+                    tree = KDTree(X_pandas[where])
+                    logging.debug(
+                        "Looking for nearest neighbors of %d '%s' events among all"
+                        " %d '%s' events in data frame.",
+                        container.size, container.name, len(X_pandas[where]), assoc_grouping
+                    )
+                # Query the tree for the single nearest neighbor
+                dists, ind = tree.query( # pylint: disable=possibly-used-before-assignment
+                    X_pisa, k=1, return_distance=True, dualtree=False,
+                    breadth_first=False
                 )
-                grads_list = []
+                n_outside_tol = np.sum(dists > self.distance_tol)
+                if n_outside_tol:
+                    max_dist = np.max(dists)
+                    frac = float(n_outside_tol) * 100 / n_container
+                    logging.warning(
+                        f"For {n_outside_tol} {container.name} events ({frac:.2g}%),"
+                        " the nearest neighbor, from which each gradient will be "
+                        "taken, is at a distance beyond the pre-set tolerance of "
+                        f"{self.distance_tol:.2g}. The maximum distance to a "
+                        f"nearest neighbor is {max_dist:.2g}."
+                    )
 
-            for gradient_name in self.gradient_names:
-                grads = df[gradient_name].to_numpy()
-                if self.event_grouping_key is not None:
-                    # indices apply to the array of events of the grouping
-                    grads = grads[where]
-                container[gradient_name] = grads[ind.ravel()]
                 if self.debug_mode:
-                    grads_list.append(container[gradient_name])
+                    outfile = os.path.join(
+                        CACHE_DIR, f"ultrasurfaces_{container.name}_debug_data.npz"
+                    )
+                    grads_list = []
+
+                for gradient_name in self.gradient_names:
+                    grads = df[gradient_name].to_numpy()
+                    if self.event_grouping_key is not None:
+                        # indices apply to the array of events of the grouping
+                        grads = grads[where]
+                    container[gradient_name] = grads[ind.ravel()]
+                    if self.debug_mode:
+                        grads_list.append(container[gradient_name])
 
-            if self.debug_mode:
-                np.savez_compressed(
-                    file=outfile, dists=dists.ravel(), inds=ind.ravel(),
-                    grads=grads_list, fit_results_file=self.fit_results_file,
-                    gradient_names=self.gradient_names
-                )
-                logging.debug("Stored '%s' ultrasurfaces debug data in %s.",
-                              container.name, CACHE_DIR)
+                if self.debug_mode:
+                    np.savez_compressed(
+                        file=outfile, dists=dists.ravel(), inds=ind.ravel(),
+                        grads=grads_list, fit_results_file=self.fit_results_file,
+                        gradient_names=self.gradient_names
+                    )
+                    logging.debug("Stored '%s' ultrasurfaces debug data in %s.",
+                                  container.name, CACHE_DIR)
+
+        if self.debug_mode:
+            # always match, such that the debug data gets written
+            match_gradients()
+        else:
+            self.setup_cached(
+                match_gradients,
+                output_keys=self.gradient_names,
+                input_keys=self.varnames,
+                files=(self.fit_results_file,),
+                attrs=('varnames', 'event_grouping_key', 'distance_tol'),
+            )
 
     @profile
     def compute_function(self):
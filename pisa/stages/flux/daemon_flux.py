@@ -19,7 +19,8 @@ from numba import jit
 from scipy import interpolate
 from packaging.version import Version
 
-__all__ = ['daemon_flux', 'make_2d_flux_map', 'evaluate_flux_map', 'init_test']
+__all__ = ['daemon_flux', 'make_2d_flux_map', 'evaluate_flux_map', 'init_test',
+           'test_daemon_flux_surrogate', 'test_daemon_flux_surrogate_validation']
 
 
 class daemon_flux(Stage):  # pylint: disable=invalid-name
@@ -31,7 +32,22 @@ class daemon_flux(Stage):  # pylint: disable=invalid-name
 
     calibration_file: str
         Path to the calibration file to be used
-    
+
+    surrogate : None or str
+        If None (default), the flux maps are rebuilt from daemonflux for every
+        new set of parameter values. If "linear" or "quadratic", the nominal
+        flux of every event and its first (and, for "quadratic", diagonal
+        second) derivatives w.r.t. each daemonflux parameter are computed once
+        during setup, and the flux is afterwards evaluated as a Taylor
+        expansion around the central values (all parameters at zero), clipped
+        at zero. Cross terms between parameters are neglected. Use
+        `validate_surrogate` to check the accuracy of the expansion over the
+        parameter ranges.
+
+    surrogate_step : float
+        Step (in units of sigma) of the central finite differences used to
+        compute the derivatives for the surrogate
+
     params: ParamSet
         Must have parameters: .. ::
 
@@ -71,6 +87,8 @@ class daemon_flux(Stage):  # pylint: disable=invalid-name
     def __init__(
         self,
         calibration_file = None,
+        surrogate = None,
+        surrogate_step = 1.,
         **std_kwargs,
     ):
 
@@ -118,6 +136,18 @@ class daemon_flux(Stage):  # pylint: disable=invalid-name
             **std_kwargs,
         )
 
+        if surrogate not in (None, 'linear', 'quadratic'):
+            raise ValueError(
+                '`surrogate` must be None, "linear" or "quadratic", got "%s"'
+                % surrogate
+            )
+        self.surrogate = surrogate
+        self.surrogate_step = float(surrogate_step)
+        if self.surrogate_step <= 0:
+            raise ValueError(
+                '`surrogate_step` must be positive, got %s' % self.surrogate_step
+            )
+
     def setup_function(self):
 
         self.data.representation = self.calc_mode
@@ -125,19 +155,36 @@ class daemon_flux(Stage):  # pylint: disable=invalid-name
         for container in self.data:
             container['nu_flux'] = np.empty((container.size, 2), dtype=FTYPE)
 
-    @profile
-    def compute_function(self):
-
-        self.data.representation = self.calc_mode
-
-        # get modified parameters (in units of sigma)
+        if self.surrogate is not None:
+            output_keys = ['daemon_flux_nominal', 'daemon_flux_grad']
+            if self.surrogate == 'quadratic':
+                output_keys.append('daemon_flux_curv')
+            self.setup_cached(
+                self.calc_surrogate,
+                output_keys=output_keys,
+                input_keys=('true_energy', 'true_coszen', 'nubar'),
+                files=() if self.cal_file is None else (self.cal_file,),
+                attrs=('surrogate', 'surrogate_step'),
+            )
+
+    def daemon_param_values(self):
+        """Current values of the daemonflux parameters (in units of sigma) by
+        their daemonflux names"""
         modif_param_dict = {}
         for i,k in enumerate(self.daemon_params):
             modif_param_dict[self.daemon_names[i]] = getattr(self.params, k).value.m_as("dimensionless")
+        return modif_param_dict
 
-        # update chi2 parameter
-        self.params['daemon_chi2'].value = self.flux_obj.chi2(modif_param_dict)
+    def eval_flux(self, modif_param_dict):
+        """Evaluate the nue and numu flux of all events (or bins) for the
+        given daemonflux parameter values, without any surrogate.
 
+        Returns
+        -------
+        fluxes : dict
+            Arrays of shape (container size, 2) by container name
+
+        """
         # compute flux maps
         flux_map_numu    = make_2d_flux_map(self.flux_obj,
                                             particle = 'numu',
@@ -152,22 +199,143 @@ class daemon_flux(Stage):  # pylint: disable=invalid-name
                                             particle = 'antinue',
                                             params = modif_param_dict)
 
-
-        # calc modified flux using provided parameters
+        fluxes = {}
         for container in self.data:
             nubar = container['nubar']
+            flux = np.empty((container.size, 2))
+
+            flux[:,0] = evaluate_flux_map(flux_map_nuebar if nubar<0 else flux_map_nue,
+                                          container['true_energy'],
+                                          container['true_coszen'])
+
+            flux[:,1] = evaluate_flux_map(flux_map_numubar if nubar<0 else flux_map_numu,
+                                          container['true_energy'],
+                                          container['true_coszen'])
+            fluxes[container.name] = flux
+        return fluxes
+
+    def calc_surrogate(self):
+        """Compute the nominal flux and its derivatives w.r.t. all daemonflux
+        parameters via central finite differences"""
+        nominal_dict = {name: 0. for name in self.daemon_names}
+        nominal = self.eval_flux(nominal_dict)
+        step = self.surrogate_step
+        grads = {name: [] for name in nominal}
+        curvs = {name: [] for name in nominal}
+        for daemon_name in self.daemon_names:
+            logging.debug('Computing flux derivatives w.r.t. %s', daemon_name)
+            up = self.eval_flux(dict(nominal_dict, **{daemon_name: step}))
+            down = self.eval_flux(dict(nominal_dict, **{daemon_name: -step}))
+            for name in nominal:
+                grads[name].append((up[name] - down[name]) / (2 * step))
+                curvs[name].append(
+                    (up[name] - 2 * nominal[name] + down[name]) / step**2
+                )
+        for container in self.data:
+            # derivatives are stored flattened as (size, 2 * n_params), with
+            # the parameters running fastest
+            container['daemon_flux_nominal'] = nominal[container.name].astype(FTYPE)
+            container['daemon_flux_grad'] = np.stack(
+                grads[container.name], axis=-1
+            ).reshape(container.size, -1).astype(FTYPE)
+            if self.surrogate == 'quadratic':
+                container['daemon_flux_curv'] = np.stack(
+                    curvs[container.name], axis=-1
+                ).reshape(container.size, -1).astype(FTYPE)
+
+    def eval_surrogate(self, modif_param_dict):
+        """Evaluate the surrogate flux of all events (or bins) for the given
+        daemonflux parameter values, clipped at zero; same output as
+        `eval_flux`"""
+        x = np.array([modif_param_dict[name] for name in self.daemon_names])
+        fluxes = {}
+        for container in self.data:
+            shape = (container.size, 2, len(x))
+            flux = container['daemon_flux_nominal'] + (
+                container['daemon_flux_grad'].reshape(shape) @ x
+            )
+            if self.surrogate == 'quadratic':
+                flux += container['daemon_flux_curv'].reshape(shape) @ (0.5 * x**2)
+            # a linear expansion in particular can turn negative far from the
+            # central values
+            fluxes[container.name] = np.clip(flux, 0, None, out=flux)
+        return fluxes
+
+    def validate_surrogate(self, n_samples=10, random_state=None):
+        """Compare the surrogate against the full flux calculation.
+
+        Each parameter is set to the lower and upper end of its range alone,
+        and in addition `n_samples` points are drawn uniformly from the ranges
+        of all parameters jointly. Parameters without a range are varied
+        within +/- 3 sigma.
+
+        Parameters
+        ----------
+        n_samples : int
+        random_state : None or type accepted by `get_random_state`
+
+        Returns
+        -------
+        max_rel_deviation : float
+            Maximum relative deviation of the surrogate flux from the full
+            calculation over all events, flavours and tested parameter points
+
+        """
+        if self.surrogate is None:
+            raise ValueError('No surrogate is in use')
+        self.data.representation = self.calc_mode
+        bounds = []
+        for k in self.daemon_params:
+            param = getattr(self.params, k)
+            if param.range is None:
+                bounds.append((-3., 3.))
+            else:
+                bounds.append(tuple(r.m_as('dimensionless') for r in param.range))
+        bounds = np.array(bounds)
+        points = []
+        for i in range(len(self.daemon_names)):
+            for bound in bounds[i]:
+                point = np.zeros(len(self.daemon_names))
+                point[i] = bound
+                points.append(point)
+        random_state = get_random_state(random_state)
+        for _ in range(n_samples):
+            points.append(random_state.uniform(bounds[:, 0], bounds[:, 1]))
+
+        max_rel_deviation = 0.
+        for point in points:
+            modif_param_dict = dict(zip(self.daemon_names, point))
+            exact = self.eval_flux(modif_param_dict)
+            approx = self.eval_surrogate(modif_param_dict)
+            for name, flux in exact.items():
+                rel_deviation = np.abs(approx[name] / flux - 1)
+                max_rel_deviation = max(max_rel_deviation, np.max(rel_deviation))
+        logging.info(
+            'Max. relative deviation of the %s daemonflux surrogate: %.3e',
+            self.surrogate, max_rel_deviation
+        )
+        return max_rel_deviation
+
+    @profile
+    def compute_function(self):
 
-            nue_flux   = evaluate_flux_map(flux_map_nuebar if nubar<0 else flux_map_nue,
-                                           container['true_energy'],
-                                           container['true_coszen'])
+        self.data.representation = self.calc_mode
+
+        # get modified parameters (in units of sigma)
+        modif_param_dict = self.daemon_param_values()
 
-            numu_flux  = evaluate_flux_map(flux_map_numubar if nubar<0 else flux_map_numu,
-                                           container['true_energy'],
-                                           container['true_coszen'])
+        # update chi2 parameter
+        self.params['daemon_chi2'].value = self.flux_obj.chi2(modif_param_dict)
 
+        # calc modified flux using provided parameters
+        if self.surrogate is None:
+            fluxes = self.eval_flux(modif_param_dict)
+        else:
+            fluxes = self.eval_surrogate(modif_param_dict)
 
-            container['nu_flux'][:,0] = nue_flux
-            container['nu_flux'][:,1] = numu_flux
+        for container in self.data:
+            container['nu_flux'][:,0] = fluxes[container.name][:,0]
+            container['nu_flux'][:,1] = fluxes[container.name][:,1]
 
             container.mark_changed("nu_flux")
 
@@ -215,3 +383,144 @@ def init_test(**param_kwargs):
         param_set.append(param)
     param_set = ParamSet(*param_set)
     return daemon_flux(params=param_set)
+
+
+class _AnalyticFlux:
+    """Stand-in for `daemonflux.Flux` in `test_daemon_flux_surrogate`, with a
+    flux quadratic in each parameter and without cross terms"""
+    zenith_angles = [str(angle) for angle in np.linspace(0, 180, 19)]
+    # (linear, quadratic) coefficient of each parameter by flavour
+    coefficients = {
+        'pi+_20T': {'numu': (0.4, 0.1), 'antinumu': (0.2, 0.05),
+                    'nue': (0.1, 0.02), 'antinue': (0.3, 0.)},
+        'K-_158G': {'numu': (-0.1, 0.03), 'antinumu': (0.05, 0.),
+                    'nue': (0.2, 0.01), 'antinue': (-0.2, 0.04)},
+    }
+
+    def flux(self, energy, zenith_angle, particle, params):
+        scale = 1.
+        for name, value in params.items():
+            lin, quad = self.coefficients[name][particle]
+            scale += lin * value + quad * value**2
+        coszen = np.cos(np.deg2rad(float(zenith_angle)))
+        return scale * (1 + coszen**2) * energy**0.3
+
+    def chi2(self, params):
+        return sum(value**2 for value in params.values())
+
+
+def _make_test_data(rng, n_evts, max_log10_energy):
+    """Events of a neutrino and an antineutrino container with energies up to
+    10**`max_log10_energy` GeV"""
+    from pisa.core.container import Container, ContainerSet
+
+    containers = []
+    for name, nubar in [('numu_cc', 1), ('nuebar_cc', -1)]:
+        container = Container(name)
+        container['true_energy'] = np.power(
+            10, rng.uniform(0, max_log10_energy, n_evts)
+        )
+        container['true_coszen'] = rng.uniform(-1, 1, n_evts)
+        container.set_aux_data('nubar', nubar)
+        containers.append(container)
+    return ContainerSet('data', containers)
+
+
+def test_daemon_flux_surrogate():
+    """Unit test for the linear and quadratic flux surrogates, using a flux
+    with known parameter dependence instead of daemonflux"""
+    from pisa.utils.comparisons import ALLCLOSE_KW
+
+    daemon_names = list(_AnalyticFlux.coefficients)
+    daemon_params = ['daemon_pi_20T', 'daemon_antiK_158G']
+    rng = np.random.default_rng(0)
+    n_evts = 100
+    for surrogate in ('linear', 'quadratic'):
+        params = ParamSet(
+            [Param(name=name, value=0., range=(-3, 3), prior=None,
+                   is_fixed=False) for name in daemon_params]
+            + [Param(name='daemon_chi2', value=0., prior=None, range=None,
+                     is_fixed=True)]
+        )
+        # bypass `daemon_flux.__init__`, which loads daemonflux
+        stage = object.__new__(daemon_flux)
+        Stage.__init__(
+            stage,
+            params=params,
+            expected_params=daemon_params + ['daemon_chi2'],
+            expected_container_keys=('true_energy', 'true_coszen', 'nubar'),
+            calc_mode='events',
+            apply_mode='events',
+        )
+        stage.cal_file = None
+        stage.flux_obj = _AnalyticFlux()
+        stage.daemon_names = daemon_names
+        stage.daemon_params = daemon_params
+        stage.surrogate = surrogate
+        stage.surrogate_step = 1.
+        stage.data = _make_test_data(rng, n_evts, max_log10_energy=2)
+        stage.setup()
+
+        # the expansion is exact for a flux quadratic in each parameter (the
+        # flux maps are linear in the tabulated values), while the linear one
+        # misses the quadratic terms; both are clipped at zero
+        nominal = stage.eval_flux({name: 0. for name in daemon_names})
+        for x in rng.uniform(-3, 3, (10, 2)):
+            modif_param_dict = dict(zip(daemon_names, x))
+            exact = stage.eval_flux(modif_param_dict)
+            approx = stage.eval_surrogate(modif_param_dict)
+            for container in stage.data:
+                expected = exact[container.name]
+                if surrogate == 'linear':
+                    prefix = 'anti' if container['nubar'] < 0 else ''
+                    quad = [
+                        sum(_AnalyticFlux.coefficients[name][prefix + flav][1]
+                            * value**2 for name, value in modif_param_dict.items())
+                        for flav in ('nue', 'numu')
+                    ]
+                    expected = np.clip(
+                        expected - nominal[container.name] * quad, 0, None
+                    )
+                assert np.allclose(
+                    approx[container.name], expected, rtol=1e-5,
+                    atol=1e-5 * np.max(nominal[container.name])
+                ), (surrogate, x, container.name)
+
+        max_rel_deviation = stage.validate_surrogate(n_samples=5, random_state=0)
+        if surrogate == 'quadratic':
+            assert max_rel_deviation < 1e-5, max_rel_deviation
+        else:
+            # the linear numu flux at pi+_20T = -3 is clipped at zero
+            point = {'pi+_20T': -3., 'K-_158G': 0.}
+            assert np.all(stage.eval_surrogate(point)['numu_cc'][:, 1] == 0)
+            assert np.isclose(max_rel_deviation, 1)
+
+        # the stage's output is the surrogate flux
+        stage.params.daemon_pi_20T.value = 1.5
+        stage.compute()
+        for container in stage.data:
+            assert np.allclose(
+                container['nu_flux'],
+                stage.eval_surrogate(stage.daemon_param_values())[container.name],
+                **ALLCLOSE_KW
+            )
+
+    logging.info('<< PASS : test_daemon_flux_surrogate >>')
+
+
+def test_daemon_flux_surrogate_validation():
+    """Unit test for the linear and quadratic flux surrogates of daemonflux
+    itself, whose flux is linear in each parameter"""
+    rng = np.random.default_rng(0)
+    # values of `init_test` are drawn within +/- 1 sigma
+    params = init_test(prior=None, range=(-1, 1), is_fixed=False).params
+    for surrogate in ('linear', 'quadratic'):
+        stage = daemon_flux(params=params, surrogate=surrogate,
+                            calc_mode='events', apply_mode='events')
+        stage.data = _make_test_data(rng, n_evts=100, max_log10_energy=3)
+        stage.setup()
+        # both expansions are exact up to rounding of the stored derivatives
+        max_rel_deviation = stage.validate_surrogate(n_samples=5, random_state=0)
+        assert max_rel_deviation < 1e-4, (surrogate, max_rel_deviation)
+
+    logging.info('<< PASS : test_daemon_flux_surrogate_validation >>')
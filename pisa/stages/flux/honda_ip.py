@@ -10,9 +10,13 @@ import numpy as np
 from pisa import FTYPE
 from pisa.core.param import Param, ParamSet
 from pisa.core.stage import Stage
+from pisa.utils.hash import hash_file, hash_obj
 from pisa.utils.log import logging
 from pisa.utils.profiler import profile
-from pisa.utils.flux_weights import load_2d_table, calculate_2d_flux_weights
+from pisa.utils.flux_weights import (
+    load_2d_table, calculate_2d_flux_weights, make_2d_flux_grid,
+    lookup_2d_flux_grid, flux_grid_max_deviation
+)
 
 __all__ = ['honda_ip', 'init_test']
 
@@ -23,6 +27,27 @@ class honda_ip(Stage):  # pylint: disable=invalid-name
 
     Parameters
     ----------
+    lookup_grid : None, sequence of two int, or str
+        If None (default), the integral-preserving splines are evaluated for
+        every event. Otherwise, the flux of each primary is tabulated once on a
+        regular grid of (number of log10(energy) points, number of coszen
+        points), e.g. "1001, 201" in a config file, and events are evaluated
+        by interpolating that grid. Events outside of the tabulated energy
+        range are still evaluated with the splines.
+
+    lookup_interp : str
+        "bicubic" (default) or "bilinear" interpolation of the grid. The
+        maximum relative deviation from the splines, probed at the centres of
+        all grid cells, is logged and stored in `lookup_max_deviation`. For the
+        Honda 2015 tables and a (1001, 201) grid it is below 1e-3 (bicubic) and
+        3e-3 (bilinear), and it scales roughly with the inverse square of the
+        grid resolution.
+
+    setup_cache : bool
+        See `Stage`; if True, the parsed flux table is also loaded from (and
+        stored in) the binary cache of `pisa.utils.flux_weights.load_2d_table`,
+        and the grids of `lookup_grid` from (and in) the setup cache.
+
     params
         Expected params .. ::
             flux_table : str
@@ -36,6 +61,8 @@ class honda_ip(Stage):  # pylint: disable=invalid-name
 
     def __init__(
         self,
+        lookup_grid=None,
+        lookup_interp='bicubic',
         **std_kwargs
     ):
 
@@ -55,9 +82,40 @@ class honda_ip(Stage):  # pylint: disable=invalid-name
             **std_kwargs,
         )
 
+        if lookup_grid is not None:
+            if isinstance(lookup_grid, str):
+                lookup_grid = lookup_grid.split(',')
+            lookup_grid = tuple(int(n) for n in lookup_grid)
+            if len(lookup_grid) != 2 or min(lookup_grid) < 2:
+                raise ValueError(
+                    '`lookup_grid` must consist of two numbers of grid points'
+                    ' (at least 2 each), got %s' % (lookup_grid,)
+                )
+        if lookup_interp not in ('bicubic', 'bilinear'):
+            raise ValueError(
+                '`lookup_interp` must be "bicubic" or "bilinear", got "%s"'
+                % lookup_interp
+            )
+        self.lookup_grid = lookup_grid
+        self.lookup_interp = lookup_interp
+
+        self.flux_grids = None
+        """Tabulated flux of each primary (see `make_2d_flux_grid`) if
+        `lookup_grid` is set"""
+
+        self.lookup_max_deviation = None
+        """Maximum relative deviation of the looked up from the spline flux of
+        each primary"""
+
     def setup_function(self):
 
-        self.flux_table = load_2d_table(self.params.flux_table.value)
+        # parsed tables are cached along with the other setup products
+        self.flux_table = load_2d_table(
+            self.params.flux_table.value,
+            use_cache=self._setup_cache is not None,
+        )
+        if self.lookup_grid is not None:
+            self.setup_flux_grids()
 
         self.data.representation = self.calc_mode
         if self.data.is_map:
@@ -75,11 +133,116 @@ class honda_ip(Stage):  # pylint: disable=invalid-name
         # don't forget to un-link everything again
         self.data.unlink_containers()
 
+    def setup_flux_grids(self):
+        """Tabulate the flux of every primary on the lookup grid, or load the
+        grids from the setup cache (if any) if they have been made before"""
+        tables = ['nue', 'numu', 'nuebar', 'numubar']
+        bicubic = self.lookup_interp == 'bicubic'
+        arrays = None
+        if self._setup_cache is not None:
+            cache_key = hash_obj(
+                [self.source_code_hash, 'setup_flux_grids',
+                 hash_file(self.params.flux_table.value), self.lookup_grid,
+                 self.lookup_interp],
+                hash_to='hex'
+            )
+            arrays = self._setup_cache.load(cache_key)
+            if arrays is not None:
+                self.setup_cache_hits += 1
+        if arrays is None:
+            arrays = {}
+            for table in tables:
+                logging.info(
+                    'Tabulating %s flux on a %s grid', table, self.lookup_grid
+                )
+                grid = make_2d_flux_grid(self.flux_table[table], *self.lookup_grid)
+                for name, vals in grid.items():
+                    arrays[f'{table}__{name}'] = vals
+                arrays[f'{table}__max_deviation'] = np.array(
+                    flux_grid_max_deviation(
+                        grid, self.flux_table[table], bicubic=bicubic
+                    )
+                )
+            if self._setup_cache is not None:
+                self._setup_cache.store(cache_key, arrays)
+
+        self.flux_grids = {}
+        self.lookup_max_deviation = {}
+        for table in tables:
+            self.flux_grids[table] = {
+                name: arrays[f'{table}__{name}']
+                for name in ('logenergy', 'coszen', 'log_flux')
+            }
+            self.lookup_max_deviation[table] = float(
+                arrays[f'{table}__max_deviation']
+            )
+            logging.info(
+                'Max. relative deviation of %s %s flux lookup from splines: %.2e',
+                self.lookup_interp, table, self.lookup_max_deviation[table]
+            )
+
+    def calc_flux(self, true_energies, true_coszens, table, out):
+        """Evaluate the nominal flux of primary `table`, either from the splines
+        or from the lookup grid"""
+        if self.flux_grids is None:
+            calculate_2d_flux_weights(true_energies=true_energies,
+                                      true_coszens=true_coszens,
+                                      en_splines=self.flux_table[table],
+                                      out=out
+                                     )
+            return
+        lookup_2d_flux_grid(true_energies=true_energies,
+                            true_coszens=true_coszens,
+                            grid=self.flux_grids[table],
+                            bicubic=self.lookup_interp == 'bicubic',
+                            out=out
+                           )
+        outside = np.isnan(out)
+        if np.any(outside):
+            out[outside] = calculate_2d_flux_weights(
+                true_energies=true_energies[outside],
+                true_coszens=true_coszens[outside],
+                en_splines=self.flux_table[table],
+            )
+
     @profile
     def compute_function(self):
 
         self.data.representation = self.calc_mode
 
+        self.setup_cached(
+            self.calc_nominal_flux,
+            output_keys=('nu_flux_nominal', 'nubar_flux_nominal'),
+            input_keys=('true_energy', 'true_coszen'),
+            files=(self.params.flux_table.value,),
+            params=('flux_table',),
+            attrs=('lookup_grid', 'lookup_interp'),
+        )
+
+    def calc_nominal_flux(self):
+        """Calculate the nominal fluxes for all containers"""
+
+        # create lists for iteration
+        out_names = ['nu_flux_nominal']*2 + ['nubar_flux_nominal']*2
+        indices = [0, 1, 0, 1]
+        tables = ['nue', 'numu', 'nuebar', 'numubar']
+
+        if self.data.fused and not self.data.is_map:
+            # evaluate the splines once for the events of all containers
+            true_energies = self.data.get_fused('true_energy')
+            true_coszens = self.data.get_fused('true_coszen')
+            for out_name, index, table in zip(out_names, indices, tables):
+                logging.info('Calculating nominal %s flux for all containers', table)
+                self.calc_flux(true_energies=true_energies,
+                               true_coszens=true_coszens,
+                               table=table,
+                               out=self.data.get_fused(out_name)[:, index]
+                              )
+            for container in self.data:
+                container.mark_changed('nu_flux_nominal')
+                container.mark_changed('nubar_flux_nominal')
+            return
+
         if self.data.is_map:
             # speed up calculation by adding links
             # as nominal flux doesn't depend on the (outgoing) flavour
@@ -88,18 +251,14 @@ class honda_ip(Stage):  # pylint: disable=invalid-name
                                              'nuebar_cc', 'numubar_cc', 'nutaubar_cc',
                                              'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
 
-        # create lists for iteration
-        out_names = ['nu_flux_nominal']*2 + ['nubar_flux_nominal']*2
-        indices = [0, 1, 0, 1]
-        tables = ['nue', 'numu', 'nuebar', 'numubar']
         for container in self.data:
             for out_name, index, table in zip(out_names, indices, tables):
                 logging.info('Calculating nominal %s flux for %s', table, container.name)
-                calculate_2d_flux_weights(true_energies=container['true_energy'],
-                                           true_coszens=container['true_coszen'],
-                                           en_splines=self.flux_table[table],
-                                           out=container[out_name][:, index]
-                                          )
+                self.calc_flux(true_energies=container['true_energy'],
+                               true_coszens=container['true_coszen'],
+                               table=table,
+                               out=container[out_name][:, index]
+                              )
             container.mark_changed('nu_flux_nominal')
             container.mark_changed('nubar_flux_nominal')
 
@@ -13,6 +13,7 @@ because GLoBES has to be imported while in the wrapper directory.
 
 from __future__ import absolute_import, print_function, division
 
+from concurrent.futures import ProcessPoolExecutor
 import os
 import sys
 
@@ -27,7 +28,128 @@ from pisa.stages.osc.osc_params import OscParams
 from pisa.utils.profiler import profile
 from pisa.utils.resources import find_resource
 
-__all__ = ['globes', 'init_test']
+__all__ = ['globes', 'group_by_layers', 'init_test', 'test_group_by_layers']
+
+
+def make_globes_calculator(globes_wrapper):
+    """Import GLoBES from the wrapper directory and instantiate a calculator
+    with two sterile neutrinos initialised"""
+    sys.path.append(globes_wrapper)
+    import GLoBES
+    ### you need to start GLoBES from the folder containing a dummy experiment
+    # therefore we go to the folder, load GLoBES and then go back
+    curdir = os.getcwd()
+    os.chdir(globes_wrapper)
+    globes_calc = GLoBES.GLoBESCalculator("calc")
+    os.chdir(curdir)
+    globes_calc.InitSteriles(2)
+    return globes_calc
+
+
+def group_by_layers(densities, distances):
+    """Group events (or bins) by identical layer profiles, such that the layers
+    only have to be passed to GLoBES once per group.
+
+    Parameters
+    ----------
+    densities, distances : 2d arrays
+        Layer densities and distances of every event, shape (n_events, n_layers)
+
+    Returns
+    -------
+    groups : list of tuples
+        One tuple `(indices, densities, distances)` per distinct layer profile,
+        where `indices` are the indices of all events sharing that profile
+
+    """
+    profiles = np.concatenate([densities, distances], axis=1)
+    _, first, inverse = np.unique(
+        profiles, axis=0, return_index=True, return_inverse=True
+    )
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    splits = np.cumsum(np.bincount(inverse))[:-1]
+    return [
+        (indices, densities[i], distances[i])
+        for indices, i in zip(np.split(order, splits), first)
+    ]
+
+
+def calc_group_probs(globes_calc, cc, flav, nubar, groups):
+    """Calculate oscillation probabilities for groups of events sharing the
+    same layer profile.
+
+    The flavour convention in GLoBES is that
+     e = 1, mu = 2, tau = 3
+    while in PISA it's
+     e = 0, mu = 1, tau = 2
+    which is why we add +1 to the flavour.
+    Nubar follows the same convention in PISA and GLoBES:
+     +1 = particle, -1 = antiparticle
+
+    Parameters
+    ----------
+    globes_calc : GLoBESCalculator
+        Calculator with the oscillation parameters already set
+    cc : bool
+        If True, calculate the probabilities for an electron and a muon neutrino
+        to oscillate into `flav`. Otherwise, calculate the probability for
+        `flav` to oscillate into any non-sterile flavour.
+    flav : int
+    nubar : int
+    groups : sequence of tuples
+        `(energies, densities, distances)` for every group
+
+    Returns
+    -------
+    probs : list of arrays
+        Per group, an array of shape (2, n_energies) with nue -> nux and
+        numu -> nux probabilities if `cc`, else an array of shape
+        (1, n_energies) with nux -> non-sterile probabilities
+
+    """
+    probs = []
+    for energies, rho_array, len_array in groups:
+        # The output must be converted into a regular python list.
+        globes_calc.SetManualDensities(list(len_array), list(rho_array))
+        group_probs = np.empty((2 if cc else 1, len(energies)))
+        # this calls the calculator without the calculation of layers
+        for i, energy in enumerate(energies):
+            if cc:
+                group_probs[0, i] = globes_calc.MatterProbabilityPrevBaseline(
+                    1, flav+1, nubar, energy
+                )
+                group_probs[1, i] = globes_calc.MatterProbabilityPrevBaseline(
+                    2, flav+1, nubar, energy
+                )
+            else:
+                nux_to_nue = globes_calc.MatterProbabilityPrevBaseline(
+                    flav+1, 1, nubar, energy
+                )
+                nux_to_numu = globes_calc.MatterProbabilityPrevBaseline(
+                    flav+1, 2, nubar, energy
+                )
+                nux_to_nutau = globes_calc.MatterProbabilityPrevBaseline(
+                    flav+1, 3, nubar, energy
+                )
+                group_probs[0, i] = nux_to_nue + nux_to_numu + nux_to_nutau
+        probs.append(group_probs)
+    return probs
+
+
+_WORKER_GLOBES_CALC = None
+"""GLoBES calculator of a worker process"""
+
+
+def _init_worker(globes_wrapper):
+    global _WORKER_GLOBES_CALC # pylint: disable=global-statement
+    _WORKER_GLOBES_CALC = make_globes_calculator(globes_wrapper)
+
+
+def _calc_group_probs_task(task):
+    params, cc, flav, nubar, groups = task
+    _WORKER_GLOBES_CALC.SetParametersArr(params)
+    return calc_group_probs(_WORKER_GLOBES_CALC, cc, flav, nubar, groups)
 
 
 class globes(Stage):  # pylint: disable=invalid-name
@@ -40,6 +162,13 @@ class globes(Stage):  # pylint: disable=invalid-name
     globes_wrapper : path to globes wrapper
     detector_depth : float
     prop_height : quantity (dimensionless)
+    num_workers : int or None
+        If larger than one, groups of events with identical layer profiles are
+        distributed across this many worker processes, each with its own GLoBES
+        calculator. The worker processes are started in `setup_function` (anew
+        whenever it is called again) and kept until `shutdown_pool` is called
+        or the stage is deleted. By default, all groups are evaluated in the
+        main process.
     params : ParamSet or sequence with which to instantiate a ParamSet.
         Expected params .. ::
 
@@ -69,6 +198,7 @@ class globes(Stage):  # pylint: disable=invalid-name
         globes_wrapper,
         detector_depth=2.*ureg.km,
         prop_height=20.*ureg.km,
+        num_workers=None,
         **std_kwargs,
     ):
 
@@ -106,20 +236,40 @@ class globes(Stage):  # pylint: disable=invalid-name
         self.globes_wrapper = globes_wrapper
         self.detector_depth = detector_depth
         self.prop_height = prop_height
+        self.num_workers = 1 if num_workers is None else int(num_workers)
+        if self.num_workers < 1:
+            raise ValueError(
+                '`num_workers` must be at least 1, got %d' % self.num_workers
+            )
 
         self.globes_calc = None
+        self.pool = None
+        self.layer_groups = None
+        """Events grouped by layer profile for every container (see
+        `group_by_layers`)"""
+
+    def shutdown_pool(self):
+        """Shut down the worker processes, if any"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __del__(self):
+        # also called if `__init__` failed early on
+        if hasattr(self, 'pool'):
+            self.shutdown_pool()
 
     @profile
     def setup_function(self):
-        sys.path.append(self.globes_wrapper)
-        import GLoBES
-        ### you need to start GLoBES from the folder containing a dummy experiment
-        # therefore we go to the folder, load GLoBES and then go back
-        curdir = os.getcwd()
-        os.chdir(self.globes_wrapper)
-        self.globes_calc = GLoBES.GLoBESCalculator("calc")
-        os.chdir(curdir)
-        self.globes_calc.InitSteriles(2)
+        self.globes_calc = make_globes_calculator(self.globes_wrapper)
+        # the workers' calculators are built from the current settings
+        self.shutdown_pool()
+        if self.num_workers > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_init_worker,
+                initargs=(self.globes_wrapper,),
+            )
         # object for oscillation parameters
         self.osc_params = OscParams()
         earth_model = find_resource(self.earth_model)
@@ -153,7 +303,11 @@ class globes(Stage):  # pylint: disable=invalid-name
         self.data.unlink_containers()
 
         # setup probability containers
+        self.layer_groups = {}
         for container in self.data:
+            self.layer_groups[container.name] = group_by_layers(
+                np.array(container['densities']), np.array(container['distances'])
+            )
             container['prob_e'] = np.empty((container.size), dtype=FTYPE)
             container['prob_mu'] = np.empty((container.size), dtype=FTYPE)
             container['prob_nonsterile'] = np.empty((container.size), dtype=FTYPE)
@@ -176,41 +330,19 @@ class globes(Stage):  # pylint: disable=invalid-name
         '''Calculates probability for an electron/muon neutrino to oscillate into
         the flavour of a given event, including effects from sterile neutrinos.
         '''
-        # We use the layers module to calculate lengths and densities.
-        # The output must be converted into a regular python list.
-        self.globes_calc.SetManualDensities(list(len_array), list(rho_array))
-        # this calls the calculator without the calculation of layers
-        # The flavour convention in GLoBES is that
-        #  e = 1, mu = 2, tau = 3
-        # while in PISA it's
-        #  e = 0, mu = 1, tau = 2
-        # which is why we add +1 to the flavour.
-        # Nubar follows the same convention in PISA and GLoBES:
-        #  +1 = particle, -1 = antiparticle
-        nue_to_nux = self.globes_calc.MatterProbabilityPrevBaseline(1, flav+1, nubar, energy)
-        numu_to_nux = self.globes_calc.MatterProbabilityPrevBaseline(2, flav+1, nubar, energy)
-        return (nue_to_nux, numu_to_nux)
+        probs = calc_group_probs(
+            self.globes_calc, True, flav, nubar, [([energy], rho_array, len_array)]
+        )[0]
+        return (probs[0, 0], probs[1, 0])
 
     def calc_prob_nonsterile(self, flav, nubar, energy, rho_array, len_array):
         '''Calculates the probability of a given neutrino to oscillate into
         another non-sterile flavour.
         '''
-        # We use the layers module to calculate lengths and densities.
-        # The output must be converted into a regular python list.
-        self.globes_calc.SetManualDensities(list(len_array), list(rho_array))
-        # this calls the calculator without the calculation of layers
-        # The flavour convention in GLoBES is that
-        #  e = 1, mu = 2, tau = 3
-        # while in PISA it's
-        #  e = 0, mu = 1, tau = 2
-        # which is why we add +1 to the flavour.
-        # Nubar follows the same convention in PISA and GLoBES:
-        #  +1 = particle, -1 = antiparticle
-        nux_to_nue = self.globes_calc.MatterProbabilityPrevBaseline(flav+1, 1, nubar, energy)
-        nux_to_numu = self.globes_calc.MatterProbabilityPrevBaseline(flav+1, 2, nubar, energy)
-        nux_to_nutau = self.globes_calc.MatterProbabilityPrevBaseline(flav+1, 3, nubar, energy)
-        nux_to_nonsterile = nux_to_nue + nux_to_numu + nux_to_nutau
-        return nux_to_nonsterile
+        probs = calc_group_probs(
+            self.globes_calc, False, flav, nubar, [([energy], rho_array, len_array)]
+        )[0]
+        return probs[0, 0]
 
     @profile
     def compute_function(self):
@@ -232,42 +364,56 @@ class globes(Stage):  # pylint: disable=invalid-name
         # set the correct data mode
         self.data.representation = self.calc_mode
 
+        tasks = []
+        task_containers = []
+        container_probs = {}
         for container in self.data:
             # standard oscillations are only applied to charged current events,
             # while the loss due to oscillation into sterile neutrinos is only
             # applied to neutral current events.
+            if '_cc' in container.name:
+                cc = True
+            elif '_nc' in container.name:
+                cc = False
+            else:
+                raise Exception('unknown container name: %s' % container.name)
             # Accessing single entries from containers is very slow.
             # For this reason, we make a copy of the content we need that is
             # a simple numpy array.
-            flav = container['flav']
-            nubar = container['nubar']
             energies = np.array(container['true_energy'])
-            densities = np.array(container['densities'])
-            distances = np.array(container['distances'])
-            prob_e = np.zeros(container.size)
-            prob_mu = np.zeros(container.size)
-            prob_nonsterile = np.zeros(container.size)
+            container_probs[container.name] = np.zeros((2 if cc else 1, container.size))
+            groups = [
+                (energies[indices], rho_array, len_array)
+                for indices, rho_array, len_array in self.layer_groups[container.name]
+            ]
+            # split into (at most) one chunk of groups per worker
+            for chunk in np.array_split(np.arange(len(groups)), self.num_workers):
+                if len(chunk) == 0:
+                    continue
+                tasks.append(
+                    (params, cc, container['flav'], container['nubar'],
+                     [groups[i] for i in chunk])
+                )
+                task_containers.append((container, chunk))
+
+        if self.pool is None:
+            results = [calc_group_probs(self.globes_calc, *task[1:]) for task in tasks]
+        else:
+            results = self.pool.map(_calc_group_probs_task, tasks)
+
+        for (container, chunk), probs in zip(task_containers, results):
+            out = container_probs[container.name]
+            for i, group_probs in zip(chunk, probs):
+                indices = self.layer_groups[container.name][i][0]
+                out[:, indices] = group_probs
+
+        for container in self.data:
+            out = container_probs[container.name]
             if '_cc' in container.name:
-                for i in range(container.size):
-                    prob_e[i], prob_mu[i] = self.calc_prob_e_mu(flav,
-                                                                nubar,
-                                                                energies[i],
-                                                                densities[i],
-                                                                distances[i]
-                                                               )
-                container['prob_e'] = prob_e
-                container['prob_mu'] = prob_mu
-            elif '_nc' in container.name:
-                for i in range(container.size):
-                    prob_nonsterile[i] = self.calc_prob_nonsterile(flav,
-                                                                   nubar,
-                                                                   energies[i],
-                                                                   densities[i],
-                                                                   distances[i]
-                                                                  )
-                container['prob_nonsterile'] = prob_nonsterile
+                container['prob_e'] = out[0]
+                container['prob_mu'] = out[1]
             else:
-                raise Exception('unknown container name: %s' % container.name)
+                container['prob_nonsterile'] = out[0]
             container.mark_changed('prob_e')
             container.mark_changed('prob_mu')
             container.mark_changed('prob_nonsterile')
@@ -313,3 +459,19 @@ def init_test(**param_kwargs):
         globes_wrapper='GLoBES_wrapper', #FIXME
         params=param_set
     )
+
+
+def test_group_by_layers():
+    """Unit test for `group_by_layers`"""
+    rng = np.random.default_rng(0)
+    profiles = rng.uniform(0, 10, size=(4, 6))
+    inverse = rng.integers(0, 4, size=50)
+    densities = profiles[inverse, :3]
+    distances = profiles[inverse, 3:]
+    groups = group_by_layers(densities, distances)
+    assert len(groups) == len(np.unique(inverse))
+    indices = np.concatenate([group[0] for group in groups])
+    assert np.array_equal(np.sort(indices), np.arange(len(inverse)))
+    for indices, rho_array, len_array in groups:
+        assert np.all(densities[indices] == rho_array)
+        assert np.all(distances[indices] == len_array)
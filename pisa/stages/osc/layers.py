@@ -15,7 +15,8 @@ from pisa import FTYPE
 from pisa.utils.fileio import from_file
 from pisa.utils.log import logging, set_verbosity
 
-__all__ = ['extCalcLayers', 'Layers']
+__all__ = ['extCalcLayerGeometry', 'extGatherDensities', 'extCalcLayers',
+           'Layers']
 
 __author__ = 'P. Eller','E. Bourbeau'
 
@@ -48,16 +49,15 @@ else:
 
 
 @jit(nopython=True, nogil=True, cache=True)
-def extCalcLayers(cz,
+def extCalcLayerGeometry(cz,
         r_detector,
         prop_height,
         detector_depth,
-        rhos,
-        rhos_neutron_weighted,
         coszen_limit,
         radii,
         max_layers):
-    """Layer density/distance calculator for each coszen specified.
+    """Layer index/distance calculator for each coszen specified, i.e. the
+    part of the path calculation that does not depend on the densities.
 
     Accelerated with Numba if present.
 
@@ -67,117 +67,189 @@ def extCalcLayers(cz,
     r_detector     : radial position of the detector (float)
     prop_height    : height at which neutrinos are assumed to be produced (float)
     detector_depth : depth at which the detector is buried (float)
-    rhos           : densities (already weighted by electron fractions) (ndarray)
-    rhos_neutron_weighted  : densities (already weighted by neutron fractions) (ndarray)
+    coszen_limit   : coszen values for which a path is tangent to the radii below (ndarray)
     radii          : radii defining the Earth's layer (ndarray)
-    coszen         : coszen values corresponding to the radii above (ndarray)
     max_layers     : maximum number of layers it is possible to cross (int)
 
     Returns
     -------
     n_layers : int number of layers
-    density : array of electron-weighted densities, flattened from (cz, max_layers)
-    density_neutron_weighted : array of neutron-weighted densities, flattened from (cz, max_layers)
-    distance : array of distances per layer, flattened from (cz, max_layers)
-    
-    """
-
-    # The densities, distances and number of layers are appended to one long list
-    # which is later reshaped into containers of size (# of cz values, max_layers)
-    # in the pi_prob3 module
+    layer_index : array of indices into the layer densities, -1 where no
+        layer is crossed, of shape (cz, max_layers)
+    distance : array of distances per layer, of shape (cz, max_layers)
 
-    densities = np.zeros((len(cz), max_layers), dtype=FTYPE)
-    densities_neutron_weighted = np.zeros((len(cz), max_layers), dtype=FTYPE)
+    """
+    n_radii = radii.shape[0]
+    layer_indices = np.full((len(cz), max_layers), -1, dtype=np.int64)
     distances = np.zeros((len(cz), max_layers), dtype=FTYPE)
     number_of_layers = np.zeros(len(cz))
 
-    # Loop over all CZ values
-    for i, coszen in enumerate(cz):
+    # Determine if there will be a crossing of layer
+    # idx is the index of the first inner layer
+    idx = 0
+    while radii[idx] >= r_detector:
+        idx += 1
 
-        r_prop = r_detector+detector_depth+prop_height
-        # Compute the full path length
-        # path_len = -r_detector * coszen + np.sqrt(r_detector**2. * coszen**2 - (r_detector**2. - r_prop**2.))
+    # scratch space for the cumulative distances along a path and for the
+    # layers crossed on the way in
+    full_distances = np.zeros(2 * n_radii + 1)
+    crossed_layers = np.zeros(n_radii, dtype=np.int64)
 
-        # Determine if there will be a crossing of layer
-        # idx is the index of the first inner layer
-        idx = np.where(radii<r_detector)[0][0]
+    # Loop over all CZ values
+    for i in range(len(cz)):
+        coszen = cz[i]
+        n_segments = 0
 
         # Deal with paths that do not have tangeants
-        if coszen >= coszen_limit[idx]: 
-            cumulative_distances = -r_detector * coszen + np.sqrt(r_detector**2. * coszen**2. - r_detector**2. + radii[:idx]**2.)
-            # a bit of flippy business is done here to order terms
-            # such that numpy diff can work
-            segments_lengths = np.diff(np.concatenate((np.array([0.]), cumulative_distances[::-1])))
-            segments_lengths = segments_lengths[::-1]
-            segments_lengths = np.concatenate((segments_lengths, np.zeros(radii.shape[0] - idx)))
-
-            density = rhos*(segments_lengths > 0.)
-            density_neutron_weighted = rhos_neutron_weighted * (segments_lengths > 0.)
+        if coszen >= coszen_limit[idx]:
+            # the segment in a layer above the detector is the difference of
+            # the distances to its outer boundary and the one of the layer
+            # below, walking outward from the detector
+            previous_distance = 0.
+            for k in range(idx - 1, -1, -1):
+                cumulative_distance = -r_detector * coszen + np.sqrt(r_detector**2. * coszen**2. - r_detector**2. + radii[k]**2.)
+                segment_length = cumulative_distance - previous_distance
+                previous_distance = cumulative_distance
+                distances[i, k] = segment_length
+                if segment_length > 0.:
+                    layer_indices[i, k] = k
+                    n_segments += 1
 
         else:
             #
             # Figure out how many layers are crossed twice
             # (meaning we calculate the negative and positive roots for these layers)
             #
-            
-            calculate_small_root = (coszen < coszen_limit) * (coszen_limit <= coszen_limit[idx])
-            calculate_large_root = (coszen_limit>coszen)
+            # The cumulative distances from the detector outward are given
+            # by the positive small roots (from the outermost layer inward)
+            # followed by the positive large roots (from the innermost layer
+            # outward)
+            #
+            full_distances[0] = 0.
+            n_distances = 1
+            for k in range(n_radii):
+                calculate_small_root = (coszen < coszen_limit[k]) * (coszen_limit[k] <= coszen_limit[idx])
+                small_root = - r_detector * coszen * calculate_small_root - np.sqrt(r_detector**2 * coszen**2 - r_detector**2 + radii[k]**2)
+                if small_root > 0:
+                    full_distances[n_distances] = small_root
+                    n_distances += 1
+            for k in range(n_radii - 1, -1, -1):
+                calculate_large_root = (coszen_limit[k]>coszen)
+                large_root = - r_detector * coszen * calculate_large_root + np.sqrt(r_detector**2 * coszen**2 - r_detector**2 + radii[k]**2)
+                if large_root > 0:
+                    full_distances[n_distances] = large_root
+                    n_distances += 1
+
+            # The last problem is to match back the layers
+            # to the proper path segments.
+            # Layers coming out of the earth core are inverted w.r.t the
+            # layers of the ones coming in, with the following exception:
+            #
+            # - the middle layer and the atmosphere must be counted only once
+            #
+            # - layers that are not crossed must be removed
+            #
+            # NOTE: this assumes that the detector is not positioned in the atmosphere
+            #
+            n_crossed = 0
+            for k in range(n_radii):
+                if coszen_limit[k] > coszen:
+                    crossed_layers[n_crossed] = k
+                    n_crossed += 1
+            n_path = n_crossed + max(n_crossed - 2, 0)
+
+            # the path starts away from the detector, i.e. segments are the
+            # differences of the cumulative distances in reverse order
+            for j in range(n_distances - 1):
+                segment_length = full_distances[n_distances - 1 - j] - full_distances[n_distances - 2 - j]
+                if segment_length > 0.:
+                    n_segments += 1
+                if j >= n_path:
+                    continue
+                distances[i, j] = segment_length
+                if segment_length > 0.:
+                    if j < n_crossed:
+                        layer_indices[i, j] = crossed_layers[j]
+                    else:
+                        layer_indices[i, j] = crossed_layers[2 * n_crossed - 2 - j]
+
+        number_of_layers[i] = n_segments
+
+    return number_of_layers, layer_indices, distances
 
-            small_roots = - r_detector * coszen * calculate_small_root - np.sqrt(r_detector**2 * coszen**2 - r_detector**2 + radii**2) #, where=calculate_small_root, out=np.zeros_like(radii))
-            large_roots = - r_detector * coszen * calculate_large_root + np.sqrt(r_detector**2 * coszen**2 - r_detector**2 + radii**2) #, where=calculate_large_root, out=np.zeros_like(radii))
 
-            # Remove the negative root numbers, and the initial zeros distances
-            small_roots = small_roots[small_roots>0]
-            small_roots = np.concatenate((np.array([0.]), small_roots))
+@jit(nopython=True, nogil=True, cache=True)
+def extGatherDensities(layer_index, rhos):
+    """Look up the densities of the layers along precomputed paths.
 
-            # Reverse the order of the large roots
-            # That should give the segment distances from the furthest layer to
-            # the middle layer
-            large_roots = large_roots[::-1]
+    Accelerated with Numba if present.
 
-            # concatenate large and small roots together
-            #  this gives the cumulative distance from the detector outward
-            full_distances = np.concatenate((np.zeros(1),small_roots[small_roots>0], large_roots[large_roots>0]))
+    Parameters
+    ----------
+    layer_index : indices into `rhos` as returned by `extCalcLayerGeometry`,
+        -1 where no layer is crossed (2d int array)
+    rhos        : (weighted) densities of the layers (ndarray)
 
-            # Diff the distances and reverse the order 
-            # such that the path starts away from the detector
-            segments_lengths = np.diff(full_distances)
-            segments_lengths = segments_lengths[::-1]
+    Returns
+    -------
+    density : array of densities of the same shape as `layer_index`, 0 where
+        no layer is crossed
 
+    """
+    densities = np.zeros(layer_index.shape, dtype=FTYPE)
+    for i in range(layer_index.shape[0]):
+        for j in range(layer_index.shape[1]):
+            if layer_index[i, j] >= 0:
+                densities[i, j] = rhos[layer_index[i, j]]
+    return densities
 
-            # The last problem is to match back the densities
-            # to the proper array elements. 
-            # Densities coming out of the earth core are inverted w.r.t the
-            # densities of the ones coming in, with the following exception:
-            #
-            # - the middle layer and the atmosphere must be counted only once
-            #
-            # - densities corresponding to layers that are not crossed must be removed
-            #
-            # NOTE: this assumes that the detector is not positioned in the atmosphere
-            #
-            # start by removing the layers not crossed from rhos
-            inner_layer_mask = coszen_limit>coszen
-            density = np.concatenate((rhos[inner_layer_mask],rhos[inner_layer_mask][1:-1][::-1]))
-            density_neutron_weighted = np.concatenate(
-                (
-                    rhos_neutron_weighted[inner_layer_mask],
-                    rhos_neutron_weighted[inner_layer_mask][1:-1][::-1],
-                )
-            )
 
-            # As an extra precaution, set all densities that are not crossed to zero
-            density*=(segments_lengths>0)
-            density_neutron_weighted *= segments_lengths > 0
+def extCalcLayers(cz,
+        r_detector,
+        prop_height,
+        detector_depth,
+        rhos,
+        rhos_neutron_weighted,
+        coszen_limit,
+        radii,
+        max_layers):
+    """Layer density/distance calculator for each coszen specified.
+
+    Accelerated with Numba if present.
 
-        number_of_layers[i] = np.sum(segments_lengths > 0.)
-        # append to the large list
-        for j in range(len(density)):
-            # index j may not run all the way to max_layers, unreached indices stay zero
-            densities[i, j] = density[j]
-            densities_neutron_weighted[i, j] = density_neutron_weighted[j]
-            distances[i, j] = segments_lengths[j]
+    Parameters
+    ----------
+    cz             : coszen values (array of float)
+    r_detector     : radial position of the detector (float)
+    prop_height    : height at which neutrinos are assumed to be produced (float)
+    detector_depth : depth at which the detector is buried (float)
+    rhos           : densities (already weighted by electron fractions) (ndarray)
+    rhos_neutron_weighted  : densities (already weighted by neutron fractions) (ndarray)
+    radii          : radii defining the Earth's layer (ndarray)
+    coszen         : coszen values corresponding to the radii above (ndarray)
+    max_layers     : maximum number of layers it is possible to cross (int)
 
+    Returns
+    -------
+    n_layers : int number of layers
+    density : array of electron-weighted densities, of shape (cz, max_layers)
+    density_neutron_weighted : array of neutron-weighted densities, of shape (cz, max_layers)
+    distance : array of distances per layer, of shape (cz, max_layers)
+    
+    """
+    number_of_layers, layer_indices, distances = extCalcLayerGeometry(
+        cz=cz,
+        r_detector=r_detector,
+        prop_height=prop_height,
+        detector_depth=detector_depth,
+        coszen_limit=coszen_limit,
+        radii=radii,
+        max_layers=max_layers,
+    )
+    densities = extGatherDensities(layer_indices, rhos)
+    densities_neutron_weighted = extGatherDensities(
+        layer_indices, rhos_neutron_weighted
+    )
     return number_of_layers, densities, densities_neutron_weighted, distances
 
 
@@ -198,6 +270,11 @@ class Layers(object):
     prop_height : float
         the production height of the neutrinos in the atmosphere in km (?)
 
+    coszen_tolerance : float or None
+        if set, paths are calculated for coszen values rounded to multiples
+        of this (see `calcLayers`), which reduces the number of distinct
+        paths for large samples at the cost of a small approximation
+
     Attributes
     ----------
     max_layers : int
@@ -208,14 +285,20 @@ class Layers(object):
     n_layers : 1d int array of length len(cz)
             number of layers crossed for every CZ value
 
-    density : 1d float array of length (max_layers * len(cz))
+    layer_index : 2d int array of shape (len(cz), max_layers)
+            containing the indices of the layers crossed (into the layer
+            densities) and filled up with -1s otherwise
+
+    density : 2d float array of shape (len(cz), max_layers)
             containing electron-weighted density values and filled up with 0s otherwise
 
-    density_neutron_weighted : 1d float array of length (max_layers * len(cz))
+    density_neutron_weighted : 2d float array of shape (len(cz), max_layers)
             containing neutron-weighted density values and filled up with 0s otherwise
 
-    distance : 1d float array of length (max_layers * len(cz))
-            containing distance values and filled up with 0s otherwise
+    distance : 2d float array of shape (len(cz), max_layers)
+            containing distance values and filled up with 0s otherwise (1d
+            array of length len(cz) if not using an Earth model, see
+            `calcPathLength`)
 
     References
     ----------
@@ -225,7 +308,14 @@ class Layers(object):
         http://www.sciencedirect.com/science/article/pii/300031920181900467
 
     """
-    def __init__(self, prem_file, detector_depth=1., prop_height=2.):
+    def __init__(self, prem_file, detector_depth=1., prop_height=2.,
+                 coszen_tolerance=None):
+        if coszen_tolerance is not None and coszen_tolerance <= 0:
+            raise ValueError(
+                '`coszen_tolerance` must be positive, got %s' % coszen_tolerance
+            )
+        self.coszen_tolerance = coszen_tolerance
+
         # Load earth model
         if prem_file is not None :
             self.using_earth_model = True
@@ -251,6 +341,9 @@ class Layers(object):
             self.rhos_neutron_weighted = np.concatenate(
                 (np.ones(1, dtype=FTYPE), self.rhos_neutron_weighted)
             )
+            # unweighted densities including any scaling, from which the
+            # electron-weighted densities are derived
+            self.rhos_scaled = self.rhos.copy()
 
 
             self.max_layers = 2 * (len(self.radii))
@@ -313,7 +406,8 @@ class Layers(object):
             self.rhos = self.prem[..., 1][::-1].astype(FTYPE)
             if scaling_array is not None:
                 self.rhos = self.rhos * scaling_array
-            self.rhos = np.concatenate((np.ones(1, dtype=FTYPE), self.rhos))      
+            self.rhos = np.concatenate((np.ones(1, dtype=FTYPE), self.rhos))
+            self.rhos_scaled = self.rhos.copy()
         else:
             raise ValueError("Cannot scale densities when not using an Earth model")
 
@@ -348,31 +442,88 @@ class Layers(object):
 
 
 
-    def calcLayers(self, cz):
+    def calcLayers(self, cz, coszen_tolerance=None):
         """
+        Paths are only calculated once per distinct coszen value and
+        broadcast to all occurrences of that value.
 
         Parameters
         ----------
         cz : 1d float array
             Array of coszen values
 
+        coszen_tolerance : float or None
+            If set, coszen values are rounded to multiples of this before
+            calculating the paths (i.e. values closer than this may share a
+            path); if None, `coszen_tolerance` of the instance is used
+
         """
 
         if not self.using_earth_model:
             raise ValueError("Cannot calculate layers when not using an Earth model")
 
+        if coszen_tolerance is None:
+            coszen_tolerance = self.coszen_tolerance
+        cz = np.asarray(cz)
+        if coszen_tolerance is not None:
+            cz = np.clip(
+                np.round(cz / coszen_tolerance) * coszen_tolerance, -1, 1
+            ).astype(cz.dtype)
+
+        unique_cz, inverse = np.unique(cz, return_inverse=True)
+        if len(unique_cz) == len(cz):
+            unique_cz, inverse = cz, None
+
         # run external function
-        self._n_layers, self._density, self._density_neutron_weighted, self._distance = extCalcLayers(
-            cz=cz,
+        n_layers, layer_index, distance = extCalcLayerGeometry(
+            cz=unique_cz,
             r_detector=self.r_detector,
             prop_height=self.prop_height,
             detector_depth=self.detector_depth,
-            rhos=self.rhos,
-            rhos_neutron_weighted=self.rhos_neutron_weighted,
             coszen_limit=self.coszen_limit,
             radii=self.radii,
             max_layers=self.max_layers,
         )
+        if inverse is not None:
+            n_layers = n_layers[inverse]
+            layer_index = layer_index[inverse]
+            distance = distance[inverse]
+        self._n_layers, self._layer_index, self._distance = n_layers, layer_index, distance
+        self.calcDensities()
+
+    def calcDensities(self):
+        """Update the densities along the paths of the last `calcLayers` call
+        from the current layer densities, e.g. after `setElecFrac` or
+        `scaling`, without recalculating the paths."""
+        self._density = self.getDensities(self._layer_index)
+        self._density_neutron_weighted = self.getDensities(
+            self._layer_index, neutron_weighted=True
+        )
+
+    def getDensities(self, layer_index, neutron_weighted=False):
+        """Look up the current layer densities along precomputed paths.
+
+        Parameters
+        ----------
+        layer_index : int array
+            Layer indices as given by `layer_index` (possibly reshaped)
+
+        neutron_weighted : bool
+            Whether to return neutron- instead of electron-weighted densities
+
+        Returns
+        -------
+        density : float array of the same shape as `layer_index`
+
+        """
+        if not self.using_earth_model:
+            raise ValueError("Cannot get density when not using an Earth model")
+        rhos = self.rhos_neutron_weighted if neutron_weighted else self.rhos
+        shape = np.shape(layer_index)
+        density = extGatherDensities(
+            np.reshape(layer_index, (-1, shape[-1])), rhos
+        )
+        return density.reshape(shape)
 
     @property
     def n_layers(self):
@@ -380,6 +531,12 @@ class Layers(object):
             raise ValueError("Cannot get layers when not using an Earth model")
         return self._n_layers
 
+    @property
+    def layer_index(self):
+        if not self.using_earth_model:
+            raise ValueError("Cannot get layers when not using an Earth model")
+        return self._layer_index
+
     @property
     def density(self):
         if not self.using_earth_model:
@@ -440,9 +597,11 @@ class Layers(object):
         #
         # Weight the density properly
         #
-        density_inner = self.rhos * self.YeFrac[0] * (self.radii <= R_INNER)
-        density_outer = self.rhos * self.YeFrac[1] * (self.radii <= R_OUTER) * (self.radii > R_INNER)
-        density_mantle = self.rhos * self.YeFrac[2] * (self.radii <= R_MANTLE) * (self.radii > R_OUTER)
+        # (start from the unweighted densities, such that repeated calls do
+        # not compound the weights)
+        density_inner = self.rhos_scaled * self.YeFrac[0] * (self.radii <= R_INNER)
+        density_outer = self.rhos_scaled * self.YeFrac[1] * (self.radii <= R_OUTER) * (self.radii > R_INNER)
+        density_mantle = self.rhos_scaled * self.YeFrac[2] * (self.radii <= R_MANTLE) * (self.radii > R_OUTER)
 
         weighted_densities = density_inner + density_outer + density_mantle
         
@@ -673,7 +832,86 @@ def test_layers_3():
     assert np.allclose(np.sum(distance_segments, axis=1), vacuum_distances, **ALLCLOSE_KW), 'ERROR: distance mismatch: {0} vs {1}'.format(np.sum(distance_segments, axis=1), vacuum_distances)
 
     logging.info('<< PASS : test_Layers 3 >>')
-    
+
+
+def test_layers_4():
+    """Densities updated along precomputed paths after changing the electron
+    fractions or scaling the densities must match a full recalculation."""
+    layer = Layers('osc/PREM_12layer.dat', detector_depth=2., prop_height=20.)
+    layer.setElecFrac(0.4656, 0.4656, 0.4957)
+    cz = np.linspace(-1, 1, 1001, dtype=FTYPE)
+    layer.calcLayers(cz)
+    layer_index = layer.layer_index.copy()
+    assert np.all((layer_index >= 0) == (layer.distance > 0))
+
+    # the scaling stays in place until the next call to `scaling`, while
+    # repeated calls to `setElecFrac` must not compound
+    scaling_array = np.linspace(0.9, 1.1, len(layer.radii) - 1)
+    scaling = None
+    for ye_fracs, new_scaling in [((0.47, 0.46, 0.49), None),
+                                  ((0.47, 0.46, 0.49), scaling_array),
+                                  ((0.4656, 0.4656, 0.4957), None)]:
+        if new_scaling is not None:
+            scaling = new_scaling
+            layer.scaling(scaling)
+        layer.setElecFrac(*ye_fracs)
+        density = layer.getDensities(layer_index)
+        density_nw = layer.getDensities(layer_index, neutron_weighted=True)
+
+        ref_layer = Layers('osc/PREM_12layer.dat', detector_depth=2., prop_height=20.)
+        if scaling is not None:
+            ref_layer.scaling(scaling)
+        ref_layer.setElecFrac(*ye_fracs)
+        ref_layer.calcLayers(cz)
+        assert np.array_equal(density, ref_layer.density)
+        assert np.array_equal(density_nw, ref_layer.density_neutron_weighted)
+        assert np.array_equal(layer_index, ref_layer.layer_index)
+
+    # updating the layers' own densities works the same
+    layer.setElecFrac(0.47, 0.46, 0.49)
+    layer.calcDensities()
+    assert np.array_equal(layer.density, layer.getDensities(layer_index))
+    assert not np.array_equal(layer.density, ref_layer.density)
+
+    logging.info('<< PASS : test_Layers 4 >>')
+
+
+def test_layers_5():
+    """Paths broadcast from distinct (or rounded) coszen values must match
+    paths calculated for every value."""
+    layer = Layers('osc/PREM_12layer.dat', detector_depth=2., prop_height=20.)
+    layer.setElecFrac(0.4656, 0.4656, 0.4957)
+    rand = np.random.RandomState(0)
+    cz = rand.uniform(-1, 1, 500).astype(FTYPE)
+    cz = np.concatenate((cz, cz[::-1], layer.coszen_limit[1:], [-1., 0., 1.]))
+    cz = cz.astype(FTYPE)
+    layer.calcLayers(cz)
+
+    n_layers, layer_index, distance = extCalcLayerGeometry(
+        cz=cz,
+        r_detector=layer.r_detector,
+        prop_height=layer.prop_height,
+        detector_depth=layer.detector_depth,
+        coszen_limit=layer.coszen_limit,
+        radii=layer.radii,
+        max_layers=layer.max_layers,
+    )
+    assert np.array_equal(layer.n_layers, n_layers)
+    assert np.array_equal(layer.layer_index, layer_index)
+    assert np.array_equal(layer.distance, distance)
+
+    # rounding to a fine grid only changes the paths slightly
+    layer.calcLayers(cz, coszen_tolerance=1e-7)
+    assert np.allclose(
+        layer.distance.sum(axis=1), distance.sum(axis=1), rtol=1e-4
+    )
+    layer = Layers('osc/PREM_12layer.dat', detector_depth=2., prop_height=20.,
+                   coszen_tolerance=0.5)
+    layer.calcLayers(cz)
+    assert len(np.unique(layer.distance.sum(axis=1))) == 5
+
+    logging.info('<< PASS : test_Layers 5 >>')
+
 
 
 
@@ -682,3 +920,5 @@ if __name__ == '__main__':
     test_layers_1()
     test_layers_2()
     test_layers_3()
+    test_layers_4()
+    test_layers_5()
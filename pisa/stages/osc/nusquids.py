@@ -14,14 +14,23 @@ recommended:
   nuSQuIDS : https://github.com/ts4051/nuSQuIDS/tree/pisa
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import os
+
 import numpy as np
 from scipy.interpolate import RectBivariateSpline
 
-from pisa import FTYPE, TARGET, PISA_NUM_THREADS
+from pisa import FTYPE, TARGET, PISA_NUM_THREADS, CACHE_DIR
 from pisa.core.stage import Stage
+from pisa.utils.cache import DiskCache
+from pisa.utils.hash import hash_file
 from pisa.utils.log import logging
+from pisa.utils.parallel import map_chunks
 from pisa.utils.profiler import profile
 from pisa.stages.osc.layers import Layers
+from pisa.stages.osc.nusquids_state_cache import (
+    input_flavours, state_cache_key, load_states, store_states
+)
 from pisa.core.binning import MultiDimBinning
 from pisa.utils.resources import find_resource
 from pisa import ureg
@@ -33,6 +42,100 @@ __all__ = ["nusquids"]
 __author__ = "T. Stuttard, T. Ehrhardt, A. Trettin"
 
 
+def _set_osc_parameter_values(nus_layer, osc_values):
+    """Set oscillation parameters given as plain numbers (see
+    `nusquids.osc_param_values`) on a nuSQuIDS object."""
+    # nuSQuIDS uses zero-index for mixing angles
+    nus_layer.Set_MixingAngle(0, 1, osc_values["theta12"])
+    nus_layer.Set_MixingAngle(0, 2, osc_values["theta13"])
+    nus_layer.Set_MixingAngle(1, 2, osc_values["theta23"])
+
+    # mass differences in nuSQuIDS are always w.r.t. m_1
+    nus_layer.Set_SquareMassDifference(1, osc_values["deltam21"])
+    nus_layer.Set_SquareMassDifference(2, osc_values["deltam31"])
+
+    nus_layer.Set_CPPhase(0, 2, osc_values["deltacp"])
+
+    # set decoherence parameters
+    if "gamma0" in osc_values:
+        nsq_units = nsq.Const()
+        gamma0 = osc_values["gamma0"] * nsq_units.eV
+        gamma0_matrix_diagonal = np.array(
+            [0.0, gamma0, gamma0, gamma0, gamma0, gamma0, gamma0, gamma0, gamma0]
+        )  # "State selection" case (see arXiv:2007.00068 eqn 11) #TODO implement other models
+        nus_layer.Set_DecoherenceGammaMatrixDiagonal(gamma0_matrix_diagonal)
+        nus_layer.Set_DecoherenceGammaEnergyDependence(osc_values["n"])
+        nus_layer.Set_DecoherenceGammaEnergyScale(osc_values["E0"] * nsq_units.eV)
+
+    if "theta14" not in osc_values:
+        return
+
+    nus_layer.Set_MixingAngle(0, 3, osc_values["theta14"])
+    nus_layer.Set_MixingAngle(1, 3, osc_values["theta24"])
+    nus_layer.Set_MixingAngle(2, 3, osc_values["theta34"])
+    nus_layer.Set_SquareMassDifference(3, osc_values["deltam41"])
+    nus_layer.Set_CPPhase(0, 3, osc_values["deltacp14"])
+    nus_layer.Set_CPPhase(1, 3, osc_values["deltacp24"])
+    # TODO: Implement NSI, decoherence
+
+
+def _apply_prop_setting_values(nus_layer, prop_settings):
+    """Apply propagation settings given as plain numbers (see
+    `nusquids.prop_settings`) to a nuSQuIDS object."""
+    nus_layer.Set_rel_error(prop_settings["rel_err"])
+    nus_layer.Set_abs_error(prop_settings["abs_err"])
+    nus_layer.Set_EvolLowPassCutoff(prop_settings["lowpass_cutoff"])
+    nus_layer.Set_EvolLowPassScale(prop_settings["lowpass_scale"])
+    nus_layer.Set_AllowConstantDensityOscillationOnlyEvolution(
+        prop_settings["exact_mode"]
+    )
+    nus_layer.Set_EvalThreads(prop_settings["eval_threads"])
+
+
+def _build_nus_layer(task):
+    """Construct a fully configured nuSQuIDS layers object in a worker process.
+
+    nuSQuIDS objects cannot be pickled, so worker processes receive the layer
+    profiles, settings and parameters as plain numbers and arrays (in nuSQuIDS
+    units) and build their own calculator from these.
+    """
+    if task["use_decoherence"]:
+        import nuSQUIDSDecohPy
+        layers_class = nuSQUIDSDecohPy.nuSQUIDSDecohLayers
+    else:
+        layers_class = nsq.nuSQUIDSLayers
+    nus_layer = layers_class(
+        task["distances"],
+        task["densities"],
+        task["ye"],
+        task["energies"],
+        task["num_neutrinos"],
+        getattr(nsq.NeutrinoType, task["neutrino_type"]),
+    )
+    _apply_prop_setting_values(nus_layer, task["prop_settings"])
+    _set_osc_parameter_values(nus_layer, task["osc_values"])
+    ini_state = np.array([0] * task["num_neutrinos"])
+    ini_state[task["flav_in"]] = 1
+    nus_layer.Set_initial_state(ini_state, nsq.Basis.flavor)
+    if not task["vacuum"]:
+        nus_layer.EvolveState()
+    return nus_layer
+
+
+def _evolve_states_task(task):
+    """Evolve a subset of nodes for one initial flavour and return the neutrino
+    and antineutrino interaction picture states."""
+    nus_layer = _build_nus_layer(task)
+    return nus_layer.GetStates(0), nus_layer.GetStates(1)
+
+
+def _node_probs_task(task):
+    """Evolve a subset of nodes for one initial flavour and return the
+    probabilities to oscillate into flavour `flav_out` at the nodes."""
+    nus_layer = _build_nus_layer(task)
+    return nus_layer.EvalFlavorAtNodes(task["flav_out"])
+
+
 class nusquids(Stage):  # pylint: disable=invalid-name
     """
     PISA Pi stage for weighting events due to the effect of neutrino oscillations, using
@@ -156,6 +259,29 @@ class nusquids(Stage):  # pylint: disable=invalid-name
     vacuum : bool
         Do not include matter effects. Greatly increases evaluation speed.
 
+    num_workers : int or None
+        Number of local worker processes across which the numerical evolution of
+        the interaction picture states is distributed. Nodes (or events in exact or
+        event-wise node mode) are split into `num_workers` subsets, and every subset
+        is evolved for every initial flavour in a separate task. Since all nodes
+        are evolved independently, the merged states are identical to those of a
+        serial evolution. The worker processes are started in `setup_function` and
+        kept until `shutdown_pool` is called or the stage is deleted. If None or 1
+        (default), everything is evolved serially in the main process.
+
+    state_cache : bool
+        If True, the interaction picture states evolved at the nodes are stored on
+        disk under `CACHE_DIR` and loaded from there whenever the same oscillation
+        parameters are requested again with identical nodes, Earth model and
+        propagation settings, also by other instances and processes. Only
+        effective when interpolating between nodes (i.e., not in exact mode or
+        with event-wise nodes).
+
+    state_cache_max_size : float or None
+        Size limit in MB of the state cache directory; least recently used entries
+        are evicted when it is exceeded. If None, the default of
+        `pisa.utils.cache.DiskCache` applies.
+
     params : ParamSet or sequence with which to instantiate a ParamSet.
         Expected params .. ::
             theta12 : quantity (angle)
@@ -217,6 +343,9 @@ class nusquids(Stage):  # pylint: disable=invalid-name
         use_taus=False,
         exact_mode=False,
         vacuum=False,
+        num_workers=None,
+        state_cache=False,
+        state_cache_max_size=None,
         **std_kwargs,
     ):
 
@@ -239,7 +368,20 @@ class nusquids(Stage):  # pylint: disable=invalid-name
         self.num_decoherence_gamma = num_decoherence_gamma
         self.node_mode = node_mode
         self.vacuum = vacuum
+        self.num_workers = 1 if num_workers is None else int(num_workers)
+        if self.num_workers < 1:
+            raise ValueError(
+                f"`num_workers` must be at least 1, got {self.num_workers}"
+            )
+        # worker processes, started in `setup_function`
+        self.pool = None
         self.use_taus = use_taus
+        self.state_cache = None
+        if state_cache:
+            self.state_cache = DiskCache(
+                path=os.path.join(CACHE_DIR, "nusquids_state_cache"),
+                max_size=state_cache_max_size,
+            )
         self.earth_model = earth_model
         self.YeI = YeI.m_as("dimensionless")
         self.YeO = YeO.m_as("dimensionless")
@@ -285,6 +427,10 @@ class nusquids(Stage):  # pylint: disable=invalid-name
 
         self.nus_layer = None
         self.nus_layerbar = None
+        # layer profiles of the nodes in nuSQuIDS units, needed to rebuild the
+        # calculator in worker processes
+        self.node_layer_args = None
+        self.earth_model_hash = None
 
         # Define the layers class
         self.nusquids_layers_class = nsq.nuSQUIDSLayers
@@ -385,58 +531,119 @@ class nusquids(Stage):  # pylint: disable=invalid-name
         # We don't want to spam the user with repeated warnings about the same issue.
         self.interpolation_warning_issued = suppress_interpolation_warning
 
+    def osc_param_values(self):
+        """Current oscillation parameters as plain numbers in the units expected
+        by nuSQuIDS (angles in rad, mass splittings in eV^2, energies in eV)."""
+        names = ["theta12", "theta13", "theta23", "deltacp"]
+        if self.num_neutrinos == 4:
+            names.extend(["theta14", "theta24", "theta34", "deltacp14", "deltacp24"])
+        osc_values = {name: self.params[name].value.m_as("rad") for name in names}
+        osc_values["deltam21"] = self.params.deltam21.value.m_as("eV**2")
+        osc_values["deltam31"] = self.params.deltam31.value.m_as("eV**2")
+        if self.num_neutrinos == 4:
+            osc_values["deltam41"] = self.params.deltam41.value.m_as("eV**2")
+        if self.use_decoherence:
+            osc_values["gamma0"] = self.params.gamma0.value.m_as("eV")
+            osc_values["n"] = self.params.n.value.m_as("dimensionless")
+            osc_values["E0"] = self.params.E0.value.m_as("eV")
+        return osc_values
+
     def set_osc_parameters(self, nus_layer):
-        # nuSQuIDS uses zero-index for mixing angles
-        nus_layer.Set_MixingAngle(0, 1, self.params.theta12.value.m_as("rad"))
-        nus_layer.Set_MixingAngle(0, 2, self.params.theta13.value.m_as("rad"))
-        nus_layer.Set_MixingAngle(1, 2, self.params.theta23.value.m_as("rad"))
+        _set_osc_parameter_values(nus_layer, self.osc_param_values())
 
-        # mass differences in nuSQuIDS are always w.r.t. m_1
-        nus_layer.Set_SquareMassDifference(1, self.params.deltam21.value.m_as("eV**2"))
-        nus_layer.Set_SquareMassDifference(2, self.params.deltam31.value.m_as("eV**2"))
+    @property
+    def prop_settings(self):
+        """Settings of the numerical propagation in nuSQuIDS units"""
+        nsq_units = nsq.Const()
+        return dict(
+            rel_err=self.rel_err,
+            abs_err=self.abs_err,
+            lowpass_cutoff=self.prop_lowpass_cutoff / nsq_units.km,
+            # The ramp of the low-pass filter starts to drop at (cutoff - scale)
+            lowpass_scale=(
+                self.prop_lowpass_frac * self.prop_lowpass_cutoff / nsq_units.km
+            ),
+            exact_mode=self.exact_mode,
+            eval_threads=self.concurrent_threads,
+        )
 
-        nus_layer.Set_CPPhase(0, 2, self.params.deltacp.value.m_as("rad"))
+    def apply_prop_settings(self, nus_layer):
+        _apply_prop_setting_values(nus_layer, self.prop_settings)
 
-        # set decoherence parameters
-        if self.use_decoherence:
-            nsq_units = nsq.Const()  # TODO Once only (make into a member)
-            gamma0 = self.params.gamma0.value.m_as("eV") * nsq_units.eV
-            gamma0_matrix_diagonal = np.array(
-                [0.0, gamma0, gamma0, gamma0, gamma0, gamma0, gamma0, gamma0, gamma0]
-            )  # "State selection" case (see arXiv:2007.00068 eqn 11) #TODO implement other models
-            nus_layer.Set_DecoherenceGammaMatrixDiagonal(gamma0_matrix_diagonal)
-            nus_layer.Set_DecoherenceGammaEnergyDependence(
-                self.params.n.value.m_as("dimensionless")
-            )
-            nus_layer.Set_DecoherenceGammaEnergyScale(
-                self.params.E0.value.m_as("eV") * nsq_units.eV
+    def map_nodes(self, func, distances, densities, ye, energies, neutrino_type,
+                  flavs_in, merge=np.concatenate, **task_kwargs):
+        """
+        Split nodes into `num_workers` subsets and evaluate `func` for every subset
+        and initial flavour in the worker processes, see
+        `pisa.utils.parallel.map_chunks`.
+
+        Parameters
+        ----------
+        func : callable
+            Module-level function called with a single task (a dict from which
+            `_build_nus_layer` builds the calculator)
+        distances, densities, ye : 2d arrays
+            Layer profiles of the nodes (distances in nuSQuIDS units)
+        energies : 1d array
+            Node energies in nuSQuIDS units
+        neutrino_type : str
+            Name of the `nuSQUIDSpy.NeutrinoType` to evolve
+        flavs_in : sequence of int
+            Initial flavours
+        merge : callable
+            Merges the results of all subsets of nodes of an initial flavour
+        **task_kwargs
+            Added to every task
+
+        Returns
+        -------
+        merged : dict
+            Merged results by initial flavour
+        """
+        osc_values = self.osc_param_values()
+        prop_settings = self.prop_settings
+
+        def make_task(flav_in, chunk):
+            return dict(
+                distances=distances[chunk],
+                densities=densities[chunk],
+                ye=ye[chunk],
+                energies=energies[chunk],
+                num_neutrinos=self.num_neutrinos,
+                neutrino_type=neutrino_type,
+                prop_settings=prop_settings,
+                osc_values=osc_values,
+                flav_in=flav_in,
+                vacuum=self.vacuum,
+                use_decoherence=self.use_decoherence,
+                **task_kwargs,
             )
 
-        if self.num_neutrinos == 3:
-            return
+        return map_chunks(
+            func, make_task, flavs_in, len(energies), self.num_workers,
+            pool=self.pool, merge=merge,
+        )
 
-        nus_layer.Set_MixingAngle(0, 3, self.params.theta14.value.m_as("rad"))
-        nus_layer.Set_MixingAngle(1, 3, self.params.theta24.value.m_as("rad"))
-        nus_layer.Set_MixingAngle(2, 3, self.params.theta34.value.m_as("rad"))
-        nus_layer.Set_SquareMassDifference(3, self.params.deltam41.value.m_as("eV**2"))
-        nus_layer.Set_CPPhase(0, 3, self.params.deltacp14.value.m_as("rad"))
-        nus_layer.Set_CPPhase(1, 3, self.params.deltacp24.value.m_as("rad"))
-        # TODO: Implement NSI, decoherence
+    def shutdown_pool(self):
+        """Shut down the worker processes, if any"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
-    def apply_prop_settings(self, nus_layer):
-        nsq_units = nsq.Const()
-        nus_layer.Set_rel_error(self.rel_err)
-        nus_layer.Set_abs_error(self.abs_err)
-        nus_layer.Set_EvolLowPassCutoff(self.prop_lowpass_cutoff / nsq_units.km)
-        # The ramp of the low-pass filter starts to drop at (cutoff - scale)
-        scale = self.prop_lowpass_frac * self.prop_lowpass_cutoff / nsq_units.km
-        nus_layer.Set_EvolLowPassScale(scale)
-        nus_layer.Set_AllowConstantDensityOscillationOnlyEvolution(self.exact_mode)
-        nus_layer.Set_EvalThreads(self.concurrent_threads)
+    def __del__(self):
+        # also called if `__init__` failed early on
+        if hasattr(self, "pool"):
+            self.shutdown_pool()
 
     def setup_function(self):
 
+        # the workers hold no state, so they can be kept across setups
+        if self.num_workers > 1 and self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.num_workers)
+
         earth_model = find_resource(self.earth_model)
+        if self.state_cache is not None:
+            self.earth_model_hash = hash_file(earth_model)
         prop_height = self.prop_height
         detector_depth = self.detector_depth
         self.layers = Layers(earth_model, detector_depth, prop_height)
@@ -539,6 +746,12 @@ class nusquids(Stage):  # pylint: disable=invalid-name
                 nsq.NeutrinoType.both,
             )
             self.apply_prop_settings(self.nus_layer)
+            self.node_layer_args = (
+                distances * nsq_units.km,
+                densities,
+                ye,
+                e_nodes * nsq_units.GeV,
+            )
 
         # Now that we have our nusquids calculator set up on the node grid, we make
         # container output space for the probability output which may be on a finer grid
@@ -780,6 +993,22 @@ class nusquids(Stage):  # pylint: disable=invalid-name
                 (container["densities"] >= 10) & (container["densities"] < 13)
             ] = self.YeO
             ye[container["densities"] >= 13] = self.YeI
+            if self.num_workers > 1:
+                flavs_in = [0, 1, 2] if self.use_taus else [0, 1]
+                probs = self.map_nodes(
+                    _node_probs_task,
+                    container["distances"] * nsq_units.km,
+                    container["densities"],
+                    ye,
+                    container["true_energy"] * nsq_units.GeV,
+                    "antineutrino" if nubar else "neutrino",
+                    flavs_in,
+                    flav_out=flav,
+                )
+                for flav_in, flav_name in enumerate(["e", "mu", "tau"][:len(flavs_in)]):
+                    container["prob_" + flav_name] = probs[flav_in]
+                    container.mark_changed("prob_" + flav_name)
+                continue
             nus_layer = self.nusquids_layers_class(
                 container["distances"] * nsq_units.km,
                 container["densities"],
@@ -805,40 +1034,80 @@ class nusquids(Stage):  # pylint: disable=invalid-name
                 container.mark_changed("prob_tau")
         self.data.unlink_containers()
 
-    # @line_profile
-    def compute_function_interpolated(self):
+    def evolve_states(self):
         """
-        Version of the compute function that does use interpolation between nodes.
+        Evolve the interaction picture states at all nodes serially.
+
+        Returns
+        -------
+        evolved_states : dict
+            Tuples of neutrino and antineutrino states by initial flavour ("e",
+            "mu" and, if `use_taus` is set, "tau")
         """
-        nsq_units = nsq.Const()
         # We need to make two evolutions, one for numu and the other for nue.
         # These produce neutrino and antineutrino states at the same time thanks to
         # the "both" neutrino mode of nuSQuIDS.
         self.apply_prop_settings(self.nus_layer)
         self.set_osc_parameters(self.nus_layer)
 
-        ini_state_nue = np.array([1, 0, 0] + [0] * (self.num_neutrinos - 3))
-        ini_state_numu = np.array([0, 1, 0] + [0] * (self.num_neutrinos - 3))
-        ini_state_nutau = np.array([0, 0, 1] + [0] * (self.num_neutrinos - 3))
-
-        self.nus_layer.Set_initial_state(ini_state_nue, nsq.Basis.flavor)
-        if not self.vacuum:
-            self.nus_layer.EvolveState()
-        evolved_states_nue = self.nus_layer.GetStates(0)
-        evolved_states_nuebar = self.nus_layer.GetStates(1)
-
-        self.nus_layer.Set_initial_state(ini_state_numu, nsq.Basis.flavor)
-        if not self.vacuum:
-            self.nus_layer.EvolveState()
-        evolved_states_numu = self.nus_layer.GetStates(0)
-        evolved_states_numubar = self.nus_layer.GetStates(1)
-
-        if self.use_taus:
-            self.nus_layer.Set_initial_state(ini_state_nutau, nsq.Basis.flavor)
+        input_flavs = input_flavours(self.use_taus)
+        evolved_states = {}
+        for flav_in, flav in enumerate(input_flavs):
+            ini_state = np.array([0] * self.num_neutrinos)
+            ini_state[flav_in] = 1
+            self.nus_layer.Set_initial_state(ini_state, nsq.Basis.flavor)
             if not self.vacuum:
                 self.nus_layer.EvolveState()
-            evolved_states_nutau = self.nus_layer.GetStates(0)
-            evolved_states_nutaubar = self.nus_layer.GetStates(1)
+            evolved_states[flav] = (
+                self.nus_layer.GetStates(0),
+                self.nus_layer.GetStates(1),
+            )
+        return evolved_states
+
+    def evolve_states_parallel(self):
+        """
+        Same as `evolve_states`, but distributing subsets of nodes and initial
+        flavours across `num_workers` processes. The states of all subsets are
+        merged in the original node order.
+        """
+        input_flavs = input_flavours(self.use_taus)
+        states = self.map_nodes(
+            _evolve_states_task,
+            *self.node_layer_args,
+            neutrino_type="both",
+            flavs_in=range(len(input_flavs)),
+            merge=lambda results: tuple(
+                np.concatenate([res[rho] for res in results]) for rho in (0, 1)
+            ),
+        )
+        return {flav: states[flav_in] for flav_in, flav in enumerate(input_flavs)}
+
+    # @line_profile
+    def compute_function_interpolated(self):
+        """
+        Version of the compute function that does use interpolation between nodes.
+        """
+        nsq_units = nsq.Const()
+        evolved_states = None
+        if self.state_cache is not None:
+            cache_key = state_cache_key(
+                osc_values=self.osc_param_values(),
+                node_layer_args=self.node_layer_args,
+                earth_model_hash=self.earth_model_hash,
+                prop_settings=self.prop_settings,
+                num_neutrinos=self.num_neutrinos,
+                vacuum=self.vacuum,
+                use_taus=self.use_taus,
+                use_decoherence=self.use_decoherence,
+            )
+            evolved_states = load_states(self.state_cache, cache_key, self.use_taus)
+        if evolved_states is None:
+            if self.num_workers > 1:
+                evolved_states = self.evolve_states_parallel()
+            else:
+                evolved_states = self.evolve_states()
+            if self.state_cache is not None:
+                store_states(self.state_cache, cache_key, evolved_states)
 
         # Now comes the step where we interpolate the interaction picture states
         # and project out oscillation probabilities. This can be done in either events
@@ -860,19 +1129,9 @@ class nusquids(Stage):  # pylint: disable=invalid-name
             )
         for container in self.data:
             nubar = container["nubar"] < 0
-            container["interp_states_e"] = self.calc_interpolated_states(
-                evolved_states_nuebar if nubar else evolved_states_nue,
-                container["true_energy"] * nsq_units.GeV,
-                container["true_coszen"],
-            )
-            container["interp_states_mu"] = self.calc_interpolated_states(
-                evolved_states_numubar if nubar else evolved_states_numu,
-                container["true_energy"] * nsq_units.GeV,
-                container["true_coszen"],
-            )
-            if self.use_taus:
-                container["interp_states_tau"] = self.calc_interpolated_states(
-                    evolved_states_nutaubar if nubar else evolved_states_nutau,
+            for flav_in, states in evolved_states.items():
+                container["interp_states_" + flav_in] = self.calc_interpolated_states(
+                    states[1] if nubar else states[0],
                     container["true_energy"] * nsq_units.GeV,
                     container["true_coszen"],
                 )
@@ -890,7 +1149,7 @@ class nusquids(Stage):  # pylint: disable=invalid-name
 
             nubar = container["nubar"] < 0
             flav_out = container["flav"]
-            input_flavs = ["e", "mu", "tau"] if self.use_taus else ["e", "mu"]
+            input_flavs = input_flavours(self.use_taus)
 
             for flav_in in input_flavs:
                 container["prob_" + flav_in] = self.calc_probs_interp(
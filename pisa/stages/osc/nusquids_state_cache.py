@@ -0,0 +1,223 @@
+"""
+Keys and storage of the interaction picture states evolved by the `nusquids`
+stage in its on-disk state cache. Kept separate from the stage itself so that
+it does not require nuSQuIDS.
+"""
+
+
+from __future__ import division
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pisa.utils.cache import DiskCache
+from pisa.utils.hash import hash_obj
+from pisa.utils.log import logging, set_verbosity
+
+__all__ = ['input_flavours', 'state_cache_key', 'load_states', 'store_states',
+           'test_state_cache']
+
+__license__ = '''Copyright (c) 2014-2025, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+def input_flavours(use_taus):
+    """Initial flavours for which states are evolved"""
+    return ["e", "mu", "tau"] if use_taus else ["e", "mu"]
+
+
+def state_cache_key(osc_values, node_layer_args, earth_model_hash,
+                    prop_settings, num_neutrinos, vacuum, use_taus,
+                    use_decoherence):
+    """
+    Key of evolved states in the state cache.
+
+    Parameters
+    ----------
+    osc_values : dict
+        Oscillation parameters as plain numbers (see
+        `nusquids.osc_param_values`)
+
+    node_layer_args : sequence of np.ndarray
+        Layer distances, densities, electron fractions and energies of the
+        nodes
+
+    earth_model_hash : str
+        Hash of the Earth model file
+
+    prop_settings : dict
+        Propagation settings (see `nusquids.prop_settings`); "eval_threads"
+        only affects the evaluation of the states and is ignored
+
+    num_neutrinos : int
+
+    vacuum : bool
+
+    use_taus : bool
+
+    use_decoherence : bool
+
+    Returns
+    -------
+    cache_key : str
+
+    """
+    prop_settings = {
+        name: val for name, val in prop_settings.items() if name != "eval_threads"
+    }
+    key_parts = [
+        sorted(osc_values.items()),
+        [hash_obj(arr) for arr in node_layer_args],
+        earth_model_hash,
+        sorted(prop_settings.items()),
+        num_neutrinos,
+        vacuum,
+        use_taus,
+        use_decoherence,
+    ]
+    return hash_obj(key_parts, hash_to="hex")
+
+
+def load_states(cache, cache_key, use_taus):
+    """
+    Load evolved states from `cache`.
+
+    Parameters
+    ----------
+    cache : pisa.utils.cache.DiskCache
+
+    cache_key : str
+        See `state_cache_key`
+
+    use_taus : bool
+        Whether states evolved from taus are expected as well
+
+    Returns
+    -------
+    evolved_states : dict or None
+        Tuples of neutrino and antineutrino states by initial flavour (see
+        `nusquids.evolve_states`), or None if they are not available
+
+    """
+    arrays = cache.load(cache_key)
+    if arrays is None:
+        return None
+    try:
+        evolved_states = {
+            flav: (arrays[f"{flav}_nu"], arrays[f"{flav}_nubar"])
+            for flav in input_flavours(use_taus)
+        }
+    except KeyError:
+        logging.warning(
+            "Incomplete nuSQuIDS state cache entry %s, evolving again", cache_key
+        )
+        return None
+    logging.debug("Loaded evolved nuSQuIDS states from state cache")
+    return evolved_states
+
+
+def store_states(cache, cache_key, evolved_states):
+    """
+    Store evolved states (see `load_states`) in `cache`.
+
+    Parameters
+    ----------
+    cache : pisa.utils.cache.DiskCache
+
+    cache_key : str
+
+    evolved_states : dict
+
+    """
+    arrays = {}
+    for flav, (states, states_bar) in evolved_states.items():
+        arrays[f"{flav}_nu"] = states
+        arrays[f"{flav}_nubar"] = states_bar
+    cache.store(cache_key, arrays)
+
+
+def test_state_cache():
+    """Unit tests for `state_cache_key`, `load_states` and `store_states`"""
+    rand = np.random.RandomState(0)
+    kwargs = dict(
+        osc_values={"theta12": 0.59, "theta13": 0.15, "theta23": 0.78,
+                    "deltacp": 0., "deltam21": 7.5e-5, "deltam31": 2.5e-3},
+        node_layer_args=tuple(rand.rand(4, 10)),
+        earth_model_hash="0123abcd",
+        prop_settings=dict(rel_err=1e-5, abs_err=1e-5, lowpass_cutoff=0.1,
+                           lowpass_scale=0.01, exact_mode=False,
+                           eval_threads=1),
+        num_neutrinos=3,
+        vacuum=False,
+        use_taus=False,
+        use_decoherence=False,
+    )
+    key = state_cache_key(**kwargs)
+    assert state_cache_key(**kwargs) == key
+
+    def changed_key(**changes):
+        return state_cache_key(**dict(kwargs, **changes))
+
+    # only affects evaluation
+    assert changed_key(
+        prop_settings=dict(kwargs["prop_settings"], eval_threads=4)
+    ) == key
+    # everything else determines the evolved states
+    for name in kwargs["osc_values"]:
+        osc_values = dict(kwargs["osc_values"])
+        osc_values[name] += 0.01
+        assert changed_key(osc_values=osc_values) != key, name
+    for i in range(len(kwargs["node_layer_args"])):
+        node_layer_args = list(kwargs["node_layer_args"])
+        node_layer_args[i] = node_layer_args[i].copy()
+        node_layer_args[i][3] *= 1.01
+        assert changed_key(node_layer_args=node_layer_args) != key, i
+    for name, val in kwargs["prop_settings"].items():
+        if name == "eval_threads":
+            continue
+        new_val = not val if isinstance(val, bool) else 2 * val
+        prop_settings = dict(kwargs["prop_settings"], **{name: new_val})
+        assert changed_key(prop_settings=prop_settings) != key, name
+    assert changed_key(earth_model_hash="4567cdef") != key
+    assert changed_key(num_neutrinos=4) != key
+    for name in ["vacuum", "use_taus", "use_decoherence"]:
+        assert changed_key(**{name: not kwargs[name]}) != key, name
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cache = DiskCache(temp_dir)
+        assert load_states(cache, key, use_taus=False) is None
+        evolved_states = {
+            flav: (rand.rand(10, 9), rand.rand(10, 9))
+            for flav in input_flavours(use_taus=False)
+        }
+        store_states(cache, key, evolved_states)
+        loaded = load_states(cache, key, use_taus=False)
+        assert set(loaded) == set(evolved_states)
+        for flav, states in evolved_states.items():
+            for test, ref in zip(loaded[flav], states):
+                assert np.array_equal(test, ref), flav
+        # entry without tau states is incomplete if they are expected
+        assert load_states(cache, key, use_taus=True) is None
+    finally:
+        shutil.rmtree(temp_dir)
+
+    logging.info('<< PASS : test_state_cache >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_state_cache()
@@ -10,7 +10,9 @@ from __future__ import absolute_import, print_function, division
 
 import numpy as np
 
-from pisa import FTYPE, ureg
+from pisa import FTYPE, ITYPE, ureg
+from pisa.core.binning import MultiDimBinning
+from pisa.core.container import Container, ContainerSet
 from pisa.core.param import Param, ParamSet
 from pisa.core.stage import Stage
 from pisa.utils.log import logging
@@ -20,10 +22,26 @@ from pisa.stages.osc.decay_params import DecayParams
 from pisa.stages.osc.lri_params import LRIParams
 from pisa.stages.osc.scaling_params import Mass_scaling, Core_scaling_w_constrain, Core_scaling_wo_constrain
 from pisa.stages.osc.layers import Layers
-from pisa.stages.osc.prob3numba.numba_osc_hostfuncs import propagate_array, fill_probs
+from pisa.stages.osc.prob3numba.numba_osc_hostfuncs import (
+    propagate_array, propagate_array_vacuum, propagate_array_constant_density,
+    propagate_array_batched, fill_probs, interpolate_probs
+)
 from pisa.utils.resources import find_resource
 
-__all__ = ['prob3', 'init_test']
+__all__ = ['BATCHED_PARAMS', 'prob3', 'init_test', 'test_prob3',
+           'test_prob3_compute_cache', 'test_prob3_fast_paths']
+
+
+BATCHED_PARAMS = {
+    'theta12': ('theta12', 'rad'),
+    'theta13': ('theta13', 'rad'),
+    'theta23': ('theta23', 'rad'),
+    'deltam21': ('dm21', 'eV**2'),
+    'deltam31': ('dm31', 'eV**2'),
+    'deltacp': ('deltacp', 'rad'),
+}
+"""Params that can be varied in `prob3.calc_probs_batched`, with the name of
+the corresponding `OscParams` attribute and its unit"""
 
 
 class prob3(Stage):  # pylint: disable=invalid-name
@@ -80,6 +98,21 @@ class prob3(Stage):  # pylint: disable=invalid-name
             "nu_flux"
             "weights"
 
+    node_mode : MultiDimBinning or None
+        If given, oscillation probabilities are only calculated on a grid of
+        nodes in `true_energy` and `true_coszen` placed at the bin edges of
+        this binning, and are bilinearly interpolated (in log10 of the energy
+        for a logarithmic energy binning) to the points requested by
+        `calc_mode`, which have to lie within the node grid. The cost of a
+        calculation then hardly depends on the number of events.
+
+    node_lowpass_samples : int
+        Only used with `node_mode`: number of energies per node (spread evenly
+        over the interval halfway to the neighbouring nodes) whose
+        probabilities are averaged. This acts as a low-pass filter on
+        oscillations too fast to be resolved by the node grid. Default of 1
+        means no averaging.
+
     **kwargs
         Other kwargs are handled by Stage
     -----
@@ -93,6 +126,8 @@ class prob3(Stage):  # pylint: disable=invalid-name
       neutrino_decay=False,
       tomography_type=None,
       lri_type=None,
+      node_mode=None,
+      node_lowpass_samples=1,
       **std_kwargs,
     ):
 
@@ -217,6 +252,21 @@ class prob3(Stage):  # pylint: disable=invalid-name
         )
 
 
+        if node_mode is not None:
+            if not (isinstance(node_mode, MultiDimBinning)
+                    and sorted(node_mode.names) == ['true_coszen', 'true_energy']):
+                raise ValueError(
+                    '`node_mode` must be a binning in true_energy and true_coszen,'
+                    ' got %s' % node_mode
+                )
+        if int(node_lowpass_samples) < 1:
+            raise ValueError(
+                '`node_lowpass_samples` must be at least 1, got %s'
+                % node_lowpass_samples
+            )
+        self.node_mode = node_mode
+        self.node_lowpass_samples = int(node_lowpass_samples)
+
         self.layers = None
         self.osc_params = None
         self.nsi_params = None
@@ -235,6 +285,20 @@ class prob3(Stage):  # pylint: disable=invalid-name
         self.YeO = None
         self.YeM = None
 
+        # node grid and the (averaging) points propagated for it
+        self.coszen_nodes = None
+        self.energy_nodes = None
+        self.node_nubar = None
+        self.node_energies = None
+        self.node_densities = None
+        self.node_distances = None
+        self.node_probs = None
+
+        # unique (true_energy, true_coszen, nubar) points in events mode
+        self.unique_index = None
+        self.unique_inverse = None
+        self.unique_sources = None
+
     def setup_function(self):
 
         # object for oscillation parameters
@@ -275,34 +339,38 @@ class prob3(Stage):  # pylint: disable=invalid-name
             self.tomography_params = Core_scaling_wo_constrain()
 
 
-        # setup the layers
-        #if self.params.earth_model.value is not None:
-        earth_model = find_resource(self.params.earth_model.value)
+        # setup the layers (without an earth model, propagate in vacuum)
+        earth_model = self.params.earth_model.value
+        if earth_model is not None:
+            earth_model = find_resource(earth_model)
+        elif self.tomography_type is not None:
+            raise ValueError('Tomography requires an earth model')
         self.YeI = self.params.YeI.value.m_as('dimensionless')
         self.YeO = self.params.YeO.value.m_as('dimensionless')
         self.YeM = self.params.YeM.value.m_as('dimensionless')
         prop_height = self.params.prop_height.value.m_as('km')
         detector_depth = self.params.detector_depth.value.m_as('km')
         self.layers = Layers(earth_model, detector_depth, prop_height)
-        self.layers.setElecFrac(self.YeI, self.YeO, self.YeM)
+        if self.layers.using_earth_model:
+            self.layers.setElecFrac(self.YeI, self.YeO, self.YeM)
 
 
         # --- calculate the layers ---
-        if self.is_map:
-            # speed up calculation by adding links
-            # as layers don't care about flavour
-            self.data.link_containers('nu', ['nue_cc', 'numu_cc', 'nutau_cc',
-                                             'nue_nc', 'numu_nc', 'nutau_nc',
-                                             'nuebar_cc', 'numubar_cc', 'nutaubar_cc',
-                                             'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
-
-        for container in self.data:
-            self.layers.calcLayers(container['true_coszen'])
-            container['densities'] = self.layers.density.reshape((container.size, self.layers.max_layers))
-            container['distances'] = self.layers.distance.reshape((container.size, self.layers.max_layers))
+        if self.node_mode is not None:
+            # only needed at the nodes
+            self.setup_nodes()
+            self.calc_node_layers()
+        else:
+            self.setup_cached(
+                self.calc_layers,
+                output_keys=('densities', 'distances', 'layer_indices'),
+                input_keys=('true_coszen',),
+                files=() if earth_model is None else (earth_model,),
+                params=('earth_model', 'YeI', 'YeO', 'YeM', 'prop_height',
+                        'detector_depth'),
+            )
 
-        # don't forget to un-link everything again
-        self.data.unlink_containers()
+        self.setup_unique_points()
 
         # --- setup empty arrays ---
         if self.is_map:
@@ -319,6 +387,254 @@ class prob3(Stage):  # pylint: disable=invalid-name
             container['prob_e'] = np.empty((container.size), dtype=FTYPE)
             container['prob_mu'] = np.empty((container.size), dtype=FTYPE)
 
+    def calc_layers(self):
+        ''' calculate densities and distances of the layers traversed by
+        the neutrinos of all containers, keeping the indices of the layers
+        such that densities can be updated without recalculating the paths '''
+        if self.is_map:
+            # speed up calculation by adding links
+            # as layers don't care about flavour
+            self.data.link_containers('nu', ['nue_cc', 'numu_cc', 'nutau_cc',
+                                             'nue_nc', 'numu_nc', 'nutau_nc',
+                                             'nuebar_cc', 'numubar_cc', 'nutaubar_cc',
+                                             'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
+
+        keys = ('densities', 'distances', 'layer_indices')
+        for container in self.data:
+            for key, values in zip(keys, self.calc_paths(container['true_coszen'])):
+                container[key] = values
+
+        # if no path crosses more than one layer (e.g. in vacuum), faster
+        # kernels are used, see `calc_probs`
+        if all(self.crosses_single_layer(container['distances'])
+               for container in self.data):
+            for container in self.data:
+                single_layer = self.select_single_layer(
+                    *[container[key] for key in keys]
+                )
+                for key, values in zip(keys, single_layer):
+                    container[key] = values
+
+        # don't forget to un-link everything again
+        self.data.unlink_containers()
+
+    def calc_paths(self, coszen):
+        ''' densities, distances and layer indices of the layers traversed
+        for the given coszen values, each of shape (len(coszen), max_layers),
+        or of shape (len(coszen), 1) for the full path without earth model '''
+        n_points = len(coszen)
+        if not self.layers.using_earth_model:
+            self.layers.calcPathLength(coszen)
+            distances = self.layers.distance.astype(FTYPE).reshape((n_points, 1))
+            return (np.zeros((n_points, 1), dtype=FTYPE), distances,
+                    np.full((n_points, 1), -1, dtype=np.int64))
+        self.layers.calcLayers(coszen)
+        shape = (n_points, self.layers.max_layers)
+        return (self.layers.density.reshape(shape),
+                self.layers.distance.reshape(shape),
+                self.layers.layer_index.reshape(shape))
+
+    @staticmethod
+    def crosses_single_layer(distances):
+        ''' whether none of the paths has more than one segment of non-zero
+        length '''
+        return bool(np.all(np.count_nonzero(distances > 0, axis=-1) <= 1))
+
+    @staticmethod
+    def select_single_layer(densities, distances, layer_indices):
+        ''' reduce paths crossing at most a single layer to that layer, i.e.
+        to arrays of shape (n_points, 1) '''
+        layer = np.argmax(distances > 0, axis=-1)[:, np.newaxis]
+        return tuple(
+            np.ascontiguousarray(np.take_along_axis(values, layer, axis=-1))
+            for values in (densities, distances, layer_indices)
+        )
+
+    @property
+    def vacuum(self):
+        ''' whether the propagation happens in vacuum, i.e. without an earth
+        model and without potentials that are independent of the density '''
+        return (not self.layers.using_earth_model and not self.neutrino_decay
+                and self.lri_type is None)
+
+    def update_densities(self):
+        ''' update the densities of the layers traversed by the neutrinos of
+        all containers after the layer densities have changed (e.g. due to the
+        electron fractions or a density scaling); the paths stay the same '''
+        for container in self.data:
+            container['densities'] = self.layers.getDensities(container['layer_indices'])
+            container.mark_changed('densities')
+
+    def setup_unique_points(self):
+        ''' find the unique (true_energy, true_coszen, nubar) points among
+        the events of all containers, e.g. shared by CC and NC events or
+        events on a grid, such that each is only propagated once '''
+        self.unique_index = None
+        self.unique_inverse = None
+        self.unique_sources = None
+        # in binned mode, containers are linked for the same purpose
+        if self.is_map or self.node_mode is not None:
+            return
+
+        self.data.representation = self.calc_mode
+        containers = self.data.containers
+        points = np.concatenate([
+            np.stack(np.broadcast_arrays(
+                container['true_energy'], container['true_coszen'], container['nubar']
+            ), axis=1)
+            for container in containers
+        ])
+        _, index, inverse = np.unique(
+            points, axis=0, return_index=True, return_inverse=True
+        )
+        logging.debug('Found %d unique points among %d events',
+                      len(index), len(points))
+        if len(index) == len(points):
+            return
+
+        self.unique_index = index
+        self.unique_inverse = inverse.ravel()
+        # where to take the values of the unique points from, per container
+        offsets = np.cumsum([0] + [container.size for container in containers])
+        source = np.searchsorted(offsets, index, side='right') - 1
+        self.unique_sources = []
+        for i in range(len(containers)):
+            positions = np.nonzero(source == i)[0]
+            self.unique_sources.append((positions, index[positions] - offsets[i]))
+
+    def gather_unique(self, key):
+        ''' values of `key` at the unique points '''
+        values = None
+        for container, (positions, local_index) in zip(
+            self.data.containers, self.unique_sources
+        ):
+            container_values = np.asarray(container[key])
+            if container_values.ndim == 0:
+                # scalar aux data
+                container_values = np.full(container.size, container_values)
+            if values is None:
+                values = np.empty(
+                    (len(self.unique_index),) + container_values.shape[1:],
+                    dtype=container_values.dtype
+                )
+            values[positions] = container_values[local_index]
+        return values
+
+    def calc_probs_unique(self, probability=None):
+        ''' propagate the unique points only and distribute the results to
+        all events, either to the fused `probability` or per container '''
+        if probability is not None:
+            nubar = self.data.get_fused('nubar')[self.unique_index]
+            energy = self.data.get_fused('true_energy')[self.unique_index]
+            densities = self.data.get_fused('densities')[self.unique_index]
+            distances = self.data.get_fused('distances')[self.unique_index]
+        else:
+            nubar = self.gather_unique('nubar')
+            energy = self.gather_unique('true_energy')
+            densities = self.gather_unique('densities')
+            distances = self.gather_unique('distances')
+        unique_probability = np.empty((len(self.unique_index), 3, 3), dtype=FTYPE)
+        self.calc_probs(nubar.astype(ITYPE, copy=False),
+                        energy,
+                        densities,
+                        distances,
+                        out=unique_probability,
+                       )
+        if probability is not None:
+            np.take(unique_probability, self.unique_inverse, axis=0, out=probability)
+            return
+        start = 0
+        for container in self.data.containers:
+            stop = start + container.size
+            np.take(unique_probability, self.unique_inverse[start:stop], axis=0,
+                    out=container['probability'])
+            container.mark_changed('probability')
+            start = stop
+
+    def setup_nodes(self):
+        ''' set up the node grid, including the energies averaged over per
+        node, for all combinations of nubar, coszen and energy '''
+        self.coszen_nodes = self.node_mode['true_coszen'].bin_edges.m_as('dimensionless')
+        energy_nodes = self.node_mode['true_energy'].bin_edges.m_as('GeV')
+        log_energy = self.node_mode['true_energy'].is_log
+
+        # no extrapolation beyond the node grid
+        self.data.representation = self.calc_mode
+        for container in self.data:
+            for var, nodes in [('true_coszen', self.coszen_nodes),
+                               ('true_energy', energy_nodes)]:
+                if (np.min(container[var]) < np.min(nodes)
+                        or np.max(container[var]) > np.max(nodes)):
+                    raise ValueError(
+                        'The outer edges of the node_mode must encompass the'
+                        f' entire range of {var} in calc_mode to avoid'
+                        f' extrapolation (container "{container.name}")'
+                    )
+
+        # energies of the samples per node, evenly spread over the interval
+        # halfway to the neighbouring nodes (in the interpolation space)
+        nodes = np.log10(energy_nodes) if log_energy else energy_nodes
+        self.energy_nodes = nodes
+        spacing = np.diff(nodes)
+        lower = nodes - 0.5 * np.concatenate([spacing[:1], spacing])
+        upper = nodes + 0.5 * np.concatenate([spacing, spacing[-1:]])
+        n_samples = self.node_lowpass_samples
+        frac = (np.arange(n_samples) + 0.5) / n_samples
+        if n_samples == 1:
+            samples = nodes[:, np.newaxis]
+        else:
+            samples = lower[:, np.newaxis] + np.outer(upper - lower, frac)
+        if log_energy:
+            samples = 10**samples
+        samples = samples.ravel()
+
+        n_cz = len(self.coszen_nodes)
+        self.node_nubar = np.repeat(
+            np.array([1, -1], dtype=ITYPE), n_cz * len(samples)
+        )
+        self.node_energies = np.tile(samples, 2 * n_cz).astype(FTYPE)
+        self.node_probs = None
+
+    def calc_node_layers(self):
+        ''' calculate densities and distances of the layers traversed at the
+        coszen nodes, repeated for all propagated points '''
+        paths = self.calc_paths(self.coszen_nodes.astype(FTYPE))
+        if self.crosses_single_layer(paths[1]):
+            paths = self.select_single_layer(*paths)
+        n_repeat = len(self.node_energies) // (2 * len(self.coszen_nodes))
+        for key, values in zip(['densities', 'distances'], paths):
+            values = np.tile(np.repeat(values, n_repeat, axis=0), (2, 1))
+            setattr(self, f'node_{key}', values)
+
+    def calc_node_probs(self):
+        ''' calculate the (averaged) probabilities at the nodes '''
+        probability = np.empty((len(self.node_energies), 3, 3), dtype=FTYPE)
+        self.calc_probs(self.node_nubar,
+                        self.node_energies,
+                        self.node_densities,
+                        self.node_distances,
+                        out=probability,
+                       )
+        self.node_probs = probability.reshape(
+            (2, len(self.coszen_nodes), len(self.energy_nodes),
+             self.node_lowpass_samples, 3, 3)
+        ).mean(axis=3)
+
+    def interpolate_probs(self, nubar, e_array, cz_array, out):
+        ''' interpolate the node probabilities to the given points '''
+        nubar = np.asarray(nubar, dtype=ITYPE)
+        if nubar.ndim == 0:
+            nubar = np.full(len(e_array), nubar, dtype=ITYPE)
+        interpolate_probs(self.node_probs,
+                          self.coszen_nodes,
+                          self.energy_nodes,
+                          self.node_mode['true_energy'].is_log,
+                          nubar,
+                          cz_array,
+                          e_array,
+                          out,
+                         )
+
     def calc_probs(self, nubar, e_array, rho_array, len_array, out):
         ''' wrapper to execute osc. calc '''
         if self.reparam_mix_matrix:
@@ -331,6 +647,31 @@ class prob3(Stage):  # pylint: disable=invalid-name
         logging.debug('decay matrix:\n%s'
                           % self.decay_matix)
 
+        if rho_array.shape[-1] == 1:
+            # single layer per path, skip the bookkeeping of layers
+            if self.vacuum:
+                propagate_array_vacuum(self.osc_params.dm_matrix, # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
+                                       mix_matrix,
+                                       nubar,
+                                       e_array,
+                                       len_array[:, 0],
+                                       out=out
+                                      )
+            else:
+                propagate_array_constant_density(self.osc_params.dm_matrix, # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
+                                                 mix_matrix,
+                                                 self.gen_mat_pot_matrix_complex,
+                                                 self.decay_flag,
+                                                 self.decay_matix,
+                                                 self.lri_pot,
+                                                 nubar,
+                                                 e_array,
+                                                 rho_array[:, 0],
+                                                 len_array[:, 0],
+                                                 out=out
+                                                )
+            return
+
         propagate_array(self.osc_params.dm_matrix, # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
                         mix_matrix,
                         self.gen_mat_pot_matrix_complex,
@@ -344,6 +685,129 @@ class prob3(Stage):  # pylint: disable=invalid-name
                         out=out
                        )
 
+    def calc_probs_batched(self, param_sets):
+        ''' calculate the probabilities of all containers for several sets
+        of oscillation parameters at once, in a single kernel call that
+        reuses the layers of all points (e.g. for grid scans)
+
+        Parameters
+        ----------
+        param_sets : sequence of mappings
+            K mappings from names in `BATCHED_PARAMS` to values (quantities);
+            params not given, as well as all other params, take their current
+            values
+
+        Returns
+        -------
+        probabilities : dict
+            Probability matrices of shape (K, container.size, 3, 3) in
+            `calc_mode` by container name
+
+        '''
+        # bring everything else (matter potential, densities, ...) up to date
+        self.data.representation = self.calc_mode
+        self.update_params()
+
+        osc_params = OscParams()
+        dm = np.empty((len(param_sets), 3, 3), dtype=FTYPE)
+        mix = np.empty((len(param_sets), 3, 3), dtype=np.result_type(FTYPE, 1j))
+        for k, param_set in enumerate(param_sets):
+            unknown = set(param_set) - set(BATCHED_PARAMS)
+            if unknown:
+                raise ValueError(
+                    'Cannot vary params %s in batch, only %s'
+                    % (sorted(unknown), sorted(BATCHED_PARAMS))
+                )
+            for name, (attr, unit) in BATCHED_PARAMS.items():
+                value = param_set.get(name, self.params[name].value)
+                if unit == 'rad':
+                    assert value.units != ureg.dimensionless, "Param %s is dimensionless, but should have angle units [rad, degree]" % name
+                value = value.m_as(unit)
+                if attr == 'deltacp':
+                    # e.g. for steps across 0 or 2 pi
+                    value %= 2 * np.pi
+                setattr(osc_params, attr, value)
+            dm[k] = osc_params.dm_matrix
+            if self.reparam_mix_matrix:
+                mix[k] = osc_params.mix_matrix_reparam_complex
+            else:
+                mix[k] = osc_params.mix_matrix_complex
+
+        def propagate(nubar, energy, densities, distances):
+            return propagate_array_batched(dm,
+                                           mix,
+                                           self.gen_mat_pot_matrix_complex,
+                                           self.decay_flag,
+                                           self.decay_matix,
+                                           self.lri_pot,
+                                           nubar.astype(ITYPE, copy=False),
+                                           energy,
+                                           densities,
+                                           distances,
+                                          )
+
+        containers = self.data.containers
+        probabilities = {}
+
+        if self.node_mode is not None:
+            node_probs = propagate(self.node_nubar,
+                                   self.node_energies,
+                                   self.node_densities,
+                                   self.node_distances,
+                                  ).reshape(
+                                      (len(param_sets), 2, len(self.coszen_nodes),
+                                       len(self.energy_nodes),
+                                       self.node_lowpass_samples, 3, 3)
+                                  ).mean(axis=4)
+            current_node_probs = self.node_probs
+            try:
+                for container in containers:
+                    out = np.empty((len(param_sets), container.size, 3, 3), dtype=FTYPE)
+                    for k in range(len(param_sets)):
+                        self.node_probs = node_probs[k]
+                        self.interpolate_probs(container['nubar'],
+                                               container['true_energy'],
+                                               container['true_coszen'],
+                                               out=out[k],
+                                              )
+                    probabilities[container.name] = out
+            finally:
+                self.node_probs = current_node_probs
+            return probabilities
+
+        # propagate every distinct point only once
+        if self.unique_index is not None:
+            index, inverse = self.unique_index, self.unique_inverse
+        else:
+            points = np.concatenate([
+                np.stack(np.broadcast_arrays(
+                    container['true_energy'], container['true_coszen'], container['nubar']
+                ), axis=1)
+                for container in containers
+            ])
+            _, index, inverse = np.unique(
+                points, axis=0, return_index=True, return_inverse=True
+            )
+            inverse = inverse.ravel()
+
+        def fused(key):
+            return np.concatenate([
+                np.broadcast_to(container[key], (container.size,) + np.shape(container[key])[1:])
+                for container in containers
+            ])[index]
+
+        unique_probabilities = propagate(fused('nubar'),
+                                         fused('true_energy'),
+                                         fused('densities'),
+                                         fused('distances'),
+                                        )
+        start = 0
+        for container in containers:
+            stop = start + container.size
+            probabilities[container.name] = unique_probabilities[:, inverse[start:stop]]
+            start = stop
+        return probabilities
+
     def compute_function(self):
 
         if self.is_map:
@@ -353,19 +817,101 @@ class prob3(Stage):  # pylint: disable=invalid-name
             self.data.link_containers('nubar', ['nuebar_cc', 'numubar_cc', 'nutaubar_cc',
                                                 'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
 
-        # this can be done in a more clever way (don't have to recalculate all paths)
+        self.update_params()
+
+        if self.node_mode is not None:
+            self.calc_node_probs()
+
+        if self.data.fused and not self.is_map:
+            # process the events of all containers in single kernel calls
+            self.calc_probs_fused()
+            return
+
+        if self.unique_index is not None:
+            self.calc_probs_unique()
+        else:
+            for container in self.data:
+                if self.node_mode is not None:
+                    self.interpolate_probs(container['nubar'],
+                                           container['true_energy'],
+                                           container['true_coszen'],
+                                           out=container['probability'],
+                                          )
+                else:
+                    self.calc_probs(container['nubar'],
+                                    container['true_energy'],
+                                    container['densities'],
+                                    container['distances'],
+                                    out=container['probability'],
+                                   )
+                container.mark_changed('probability')
+
+        # the following is flavour specific, hence unlink
+        self.data.unlink_containers()
+
+        for container in self.data:
+            # initial electrons (0)
+            fill_probs(container['probability'],
+                       0,
+                       container['flav'],
+                       out=container['prob_e'],
+                      )
+            # initial muons (1)
+            fill_probs(container['probability'],
+                       1,
+                       container['flav'],
+                       out=container['prob_mu'],
+                      )
+
+            container.mark_changed('prob_e')
+            container.mark_changed('prob_mu')
+
+    def update_layer_densities(self):
+        ''' set the electron fractions and density scalings of the layers from
+        the current param values and update the densities traversed by the
+        neutrinos accordingly '''
         YeI = self.params.YeI.value.m_as('dimensionless')
         YeO = self.params.YeO.value.m_as('dimensionless')
         YeM = self.params.YeM.value.m_as('dimensionless')
 
-        if YeI != self.YeI or YeO != self.YeO or YeM != self.YeM:
+        changed = False
+        if (YeI != self.YeI or YeO != self.YeO or YeM != self.YeM) and self.layers.using_earth_model:
             self.YeI = YeI; self.YeO = YeO; self.YeM = YeM
             self.layers.setElecFrac(self.YeI, self.YeO, self.YeM)
-            for container in self.data:
-                self.layers.calcLayers(container['true_coszen'])
-                container['densities'] = self.layers.density.reshape((container.size, self.layers.max_layers))
-                container['distances'] = self.layers.distance.reshape((container.size, self.layers.max_layers))
+            changed = True
+
+        if self.tomography_type is not None:
+            if self.tomography_type == "mass_of_earth":
+                self.tomography_params.density_scale = self.params.density_scale.value.m_as('dimensionless')
+                self.layers.scaling(scaling_array=self.tomography_params.density_scale)
+            elif self.tomography_type == "mass_of_core_w_constrain":
+                self.tomography_params.core_density_scale = self.params.core_density_scale.value.m_as('dimensionless')
+                self.layers.scaling(scaling_array=self.tomography_params.scaling_array)
+            elif self.tomography_type == "mass_of_core_wo_constrain":
+                self.tomography_params.core_density_scale = self.params.core_density_scale.value.m_as('dimensionless')
+                self.tomography_params.innermantle_density_scale = self.params.innermantle_density_scale.value.m_as('dimensionless')
+                self.tomography_params.middlemantle_density_scale = self.params.middlemantle_density_scale.value.m_as('dimensionless')
+                self.layers.scaling(scaling_array=self.tomography_params.scaling_factor_array)
+            self.layers.setElecFrac(self.YeI, self.YeO, self.YeM)
+            changed = True
 
+        if changed:
+            if self.node_mode is not None:
+                self.calc_node_layers()
+            else:
+                self.update_densities()
+
+    def _restore_compute_cache_entry(self, cache_entry):
+        super()._restore_compute_cache_entry(cache_entry)
+        # densities are only part of entries whose computation changed them
+        # (and node densities and the state of `layers` never are), so bring
+        # all of them in line with the restored param values
+        self.update_layer_densities()
+
+    def update_params(self):
+        ''' set the oscillation, matter, NSI, decay and LRI parameters as
+        well as the layer densities from the current param values '''
+        self.update_layer_densities()
 
         # some safety checks on units
         # trying to avoid issue of angles with no dimension being assumed to be radians
@@ -410,22 +956,6 @@ class prob3(Stage):  # pylint: disable=invalid-name
 
         if self.lri_type is not None:
             self.lri_params.v_lri = self.params.v_lri.value.m_as('eV')
-        if self.tomography_type is not None:
-            if self.tomography_type == "mass_of_earth":
-                self.tomography_params.density_scale = self.params.density_scale.value.m_as('dimensionless')
-                self.layers.scaling(scaling_array=self.tomography_params.density_scale)
-            elif self.tomography_type == "mass_of_core_w_constrain":
-                self.tomography_params.core_density_scale = self.params.core_density_scale.value.m_as('dimensionless')
-                self.layers.scaling(scaling_array=self.tomography_params.scaling_array)
-            elif self.tomography_type == "mass_of_core_wo_constrain":
-                self.tomography_params.core_density_scale = self.params.core_density_scale.value.m_as('dimensionless')
-                self.tomography_params.innermantle_density_scale = self.params.innermantle_density_scale.value.m_as('dimensionless')
-                self.tomography_params.middlemantle_density_scale = self.params.middlemantle_density_scale.value.m_as('dimensionless')
-                self.layers.scaling(scaling_array=self.tomography_params.scaling_factor_array)
-            self.layers.setElecFrac(self.YeI, self.YeO, self.YeM)
-            for container in self.data:
-                self.layers.calcLayers(container['true_coszen'])
-                container['densities'] = self.layers.density.reshape((container.size, self.layers.max_layers))
 
 
         # now we can proceed to calculate the generalised matter potential matrix
@@ -464,37 +994,33 @@ class prob3(Stage):  # pylint: disable=invalid-name
                 # TODO: this just repeats the logic from init with slightly different code!
                 raise ValueError("Implemented symmetries are %s" % types_lri)
 
-
-        for container in self.data:
-            self.calc_probs(container['nubar'],
-                            container['true_energy'],
-                            container['densities'],
-                            container['distances'],
-                            out=container['probability'],
+    def calc_probs_fused(self):
+        ''' calculate probabilities for the fused arrays of all containers '''
+        probability = self.data.get_fused('probability')
+        if self.unique_index is not None:
+            self.calc_probs_unique(probability=probability)
+        elif self.node_mode is not None:
+            self.interpolate_probs(self.data.get_fused('nubar'),
+                                   self.data.get_fused('true_energy'),
+                                   self.data.get_fused('true_coszen'),
+                                   out=probability,
+                                  )
+        else:
+            self.calc_probs(self.data.get_fused('nubar').astype(ITYPE, copy=False),
+                            self.data.get_fused('true_energy'),
+                            self.data.get_fused('densities'),
+                            self.data.get_fused('distances'),
+                            out=probability,
                            )
-            container.mark_changed('probability')
-
-        # the following is flavour specific, hence unlink
-        self.data.unlink_containers()
+        flav = self.data.get_fused('flav').astype(ITYPE, copy=False)
+        fill_probs(probability, 0, flav, out=self.data.get_fused('prob_e'))
+        fill_probs(probability, 1, flav, out=self.data.get_fused('prob_mu'))
 
         for container in self.data:
-            # initial electrons (0)
-            fill_probs(container['probability'],
-                       0,
-                       container['flav'],
-                       out=container['prob_e'],
-                      )
-            # initial muons (1)
-            fill_probs(container['probability'],
-                       1,
-                       container['flav'],
-                       out=container['prob_mu'],
-                      )
-
+            container.mark_changed('probability')
             container.mark_changed('prob_e')
             container.mark_changed('prob_mu')
 
-
     def apply_function(self):
 
         # maybe speed up like this?
@@ -526,3 +1052,243 @@ def init_test(**param_kwargs):
         Param(name='deltacp', value=180*ureg.degree, **param_kwargs),
     ])
     return prob3(params=param_set)
+
+
+def test_prob3():
+    """Unit tests for propagating points shared by several events only once,
+    for updating the densities after changing an electron fraction and for
+    calculating probabilities for several parameter sets at once"""
+    stage = init_test(prior=None, range=None, is_fixed=True)
+    stage.calc_mode = 'events'
+    stage.apply_mode = 'events'
+
+    # pairs of identical events, and identical events in CC and NC containers
+    rand = np.random.RandomState(0)
+    n_evts = 100
+    energy = np.repeat(rand.uniform(1, 100, n_evts // 2), 2).astype(FTYPE)
+    coszen = np.repeat(rand.uniform(-1, 1, n_evts // 2), 2).astype(FTYPE)
+    containers = []
+    for name, nubar, flav in [('numu_cc', 1, 1), ('numu_nc', 1, 1),
+                              ('numubar_cc', -1, 1)]:
+        container = Container(name)
+        container['true_energy'] = energy
+        container['true_coszen'] = coszen
+        container['nu_flux'] = np.ones((n_evts, 2), dtype=FTYPE)
+        container['weights'] = np.ones(n_evts, dtype=FTYPE)
+        container.set_aux_data('nubar', nubar)
+        container.set_aux_data('flav', flav)
+        containers.append(container)
+    stage.data = ContainerSet('data', containers)
+    stage.setup()
+    stage.compute()
+    assert len(stage.unique_index) == n_evts
+
+    for container in stage.data:
+        ref = np.empty((n_evts, 3, 3), dtype=FTYPE)
+        stage.calc_probs(container['nubar'],
+                         container['true_energy'],
+                         container['densities'],
+                         container['distances'],
+                         out=ref,
+                        )
+        assert np.array_equal(container['probability'], ref), container.name
+
+    # densities updated along the stored paths after changing an electron
+    # fraction must match a full recalculation of the layers
+    stage.params.YeM.value = 0.49 * ureg.dimensionless
+    stage.compute()
+    for container in stage.data:
+        stage.layers.calcLayers(container['true_coszen'])
+        assert np.array_equal(
+            container['densities'],
+            stage.layers.density.reshape((container.size, stage.layers.max_layers))
+        ), container.name
+
+    # probabilities for several parameter sets at once match computing
+    # them one after another
+    param_sets = [{'theta23': t23 * ureg.degree, 'deltam31': dm31 * ureg.eV**2}
+                  for t23 in (40, 45, 50) for dm31 in (2.4e-3, -2.5e-3)]
+    probabilities = stage.calc_probs_batched(param_sets)
+    for k, param_set in enumerate(param_sets):
+        for name, value in param_set.items():
+            stage.params[name].value = value
+        stage.compute()
+        for container in stage.data:
+            assert np.array_equal(
+                probabilities[container.name][k], container['probability']
+            ), (container.name, param_set)
+    try:
+        stage.calc_probs_batched([{'YeM': 0.5 * ureg.dimensionless}])
+    except ValueError:
+        pass
+    else:
+        raise Exception('varying YeM in batch should raise a ValueError')
+
+    logging.info('<< PASS : test_prob3 >>')
+
+
+def test_prob3_compute_cache():
+    """Unit test for restoring outputs from the compute cache in between
+    changes of the electron fractions, validated against a stage without
+    compute cache, for events as well as in node mode"""
+    from pisa.core.binning import OneDimBinning
+
+    rand = np.random.RandomState(2)
+    n_evts = 200
+    energy = (10**rand.uniform(0, 2, n_evts)).astype(FTYPE)
+    coszen = rand.uniform(-1, 1, n_evts).astype(FTYPE)
+    nodes = MultiDimBinning([
+        OneDimBinning(name='true_energy', num_bins=20, is_log=True,
+                      domain=[1, 100] * ureg.GeV),
+        OneDimBinning(name='true_coszen', num_bins=20, is_lin=True,
+                      domain=[-1, 1]),
+    ])
+
+    for node_mode in (None, nodes):
+        stages = {}
+        for cached in (True, False):
+            containers = []
+            for name, nubar, flav in [('numu_cc', 1, 1), ('nuebar_cc', -1, 0)]:
+                container = Container(name)
+                container['true_energy'] = energy
+                container['true_coszen'] = coszen
+                container['nu_flux'] = np.ones((n_evts, 2), dtype=FTYPE)
+                container['weights'] = np.ones(n_evts, dtype=FTYPE)
+                container.set_aux_data('nubar', nubar)
+                container.set_aux_data('flav', flav)
+                containers.append(container)
+            stages[cached] = prob3(
+                params=init_test(prior=None, range=None, is_fixed=True).params,
+                node_mode=node_mode,
+                compute_cache_size=4 if cached else None,
+                calc_mode='events',
+                apply_mode='events',
+            )
+            stages[cached].data = ContainerSet('data', containers)
+            stages[cached].setup()
+
+        # electron fraction a -> b -> a (restored from cache), followed by a
+        # change of another param at a (not cached)
+        steps = [('YeM', 0.5 * ureg.dimensionless),
+                 ('YeM', 0.45 * ureg.dimensionless),
+                 ('YeM', 0.5 * ureg.dimensionless),
+                 ('theta23', 45 * ureg.degree)]
+        for i, (name, value) in enumerate(steps):
+            for stage in stages.values():
+                stage.params[name].value = value
+                stage.compute()
+            info = (node_mode is not None, i, name)
+            if node_mode is None:
+                keys = ('densities', 'probability', 'prob_e', 'prob_mu')
+            else:
+                keys = ('probability', 'prob_e', 'prob_mu')
+                assert np.array_equal(stages[True].node_densities,
+                                      stages[False].node_densities), info
+            for cached_container, container in zip(stages[True].data,
+                                                   stages[False].data):
+                for key in keys:
+                    assert np.array_equal(cached_container[key], container[key]), \
+                        info + (container.name, key)
+        assert stages[True].compute_cache_hits == 1
+
+    # change tracking is stopped even if the computation fails
+    def failing_compute_function():
+        raise RuntimeError('failed')
+    stage = stages[True]
+    stage.compute_function = failing_compute_function
+    stage.params.theta23.value = 46 * ureg.degree
+    try:
+        stage.compute()
+    except RuntimeError:
+        pass
+    else:
+        raise Exception('compute should have raised a RuntimeError')
+    for container in stage.data:
+        assert container._changed_keys is None # pylint: disable=protected-access
+
+    logging.info('<< PASS : test_prob3_compute_cache >>')
+
+
+def test_prob3_fast_paths():
+    """Unit test for the vacuum and constant-density kernels, which are
+    validated against the general (layers) kernel"""
+    import os
+    import shutil
+    import tempfile
+    from pisa.utils.comparisons import FTYPE_PREC
+
+    rand = np.random.RandomState(1)
+    n_evts = 1000
+    containers = []
+    for name, nubar, flav in [('numu_cc', 1, 1), ('nuebar_cc', -1, 0)]:
+        container = Container(name)
+        container['true_energy'] = (10**rand.uniform(0, 2, n_evts)).astype(FTYPE)
+        container['true_coszen'] = rand.uniform(-1, 1, n_evts).astype(FTYPE)
+        container['nu_flux'] = np.ones((n_evts, 2), dtype=FTYPE)
+        container['weights'] = np.ones(n_evts, dtype=FTYPE)
+        container.set_aux_data('nubar', nubar)
+        container.set_aux_data('flav', flav)
+        containers.append(container)
+
+    def general_probs(stage, container, densities, distances):
+        out = np.empty((container.size, 3, 3), dtype=FTYPE)
+        propagate_array(stage.osc_params.dm_matrix, # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
+                        stage.osc_params.mix_matrix_complex,
+                        stage.gen_mat_pot_matrix_complex,
+                        stage.decay_flag,
+                        stage.decay_matix,
+                        stage.lri_pot,
+                        np.full(container.size, container['nubar'], dtype=ITYPE),
+                        container['true_energy'],
+                        densities,
+                        distances,
+                        out=out
+                       )
+        return out
+
+    # vacuum
+    stage = init_test(prior=None, range=None, is_fixed=True)
+    stage.params.earth_model.value = None
+    stage.calc_mode = 'events'
+    stage.apply_mode = 'events'
+    stage.data = ContainerSet('data', [c for c in containers])
+    stage.setup()
+    assert stage.vacuum
+    stage.compute()
+    for container in stage.data:
+        assert container['distances'].shape == (container.size, 1)
+        ref = general_probs(stage, container, container['densities'],
+                            container['distances'])
+        # the kernels round differently, which matters for the large
+        # oscillation phases in single precision
+        assert np.allclose(container['probability'], ref, rtol=0,
+                           atol=1e3 * FTYPE_PREC), container.name
+
+    # constant density: single-layer earth and neutrinos produced at its
+    # surface
+    temp_dir = tempfile.mkdtemp()
+    try:
+        earth_model = os.path.join(temp_dir, 'constant_density.dat')
+        with open(earth_model, 'w') as f:
+            f.write('0. 3.0\n6371. 3.0\n')
+        stage = init_test(prior=None, range=None, is_fixed=True)
+        stage.params.earth_model.value = earth_model
+        stage.params.prop_height.value = 0 * ureg.km
+        stage.calc_mode = 'events'
+        stage.apply_mode = 'events'
+        stage.data = ContainerSet('data', [c for c in containers])
+        stage.setup()
+        assert not stage.vacuum
+        stage.compute()
+        for container in stage.data:
+            assert container['densities'].shape == (container.size, 1)
+            stage.layers.calcLayers(container['true_coszen'])
+            shape = (container.size, stage.layers.max_layers)
+            ref = general_probs(stage, container,
+                                stage.layers.density.reshape(shape),
+                                stage.layers.distance.reshape(shape))
+            assert np.array_equal(container['probability'], ref)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    logging.info('<< PASS : test_prob3_fast_paths >>')
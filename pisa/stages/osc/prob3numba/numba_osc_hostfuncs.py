@@ -6,14 +6,25 @@ Host function wrappers for numba_osc_kernels.
 
 from __future__ import absolute_import, print_function, division
 
-__all__ = ["FX", "CX", "IX", "propagate_array", "fill_probs"]
+__all__ = [
+    "FX",
+    "CX",
+    "IX",
+    "propagate_array",
+    "propagate_array_vacuum",
+    "propagate_array_constant_density",
+    "propagate_array_batched",
+    "fill_probs",
+    "interpolate_probs",
+]
 
 import numpy as np
-from numba import guvectorize, njit
+from numba import guvectorize, njit, prange
 
 from pisa import FTYPE, ITYPE, TARGET
 from pisa.stages.osc.prob3numba.numba_osc_kernels import (
-    # osc_probs_vacuum_kernel,
+    osc_probs_vacuum_kernel,
+    osc_probs_constant_density_kernel,
     osc_probs_layers_kernel,
     get_transition_matrix,
     get_transition_matrix_massbasis,
@@ -39,22 +50,28 @@ IX = "i4" if ITYPE == np.int32 else "i8"
 """Signed integer string code to use, understood by both Numba and Numpy"""
 
 
-# @guvectorize(
-#    [f"({FX}[:,:], {CX}[:,:], {IX}, {FX}, {FX}[:], {FX}[:,:])"],
-#    "(a,a), (a,a), (), (), (i) -> (a,a)",
-#    target=TARGET,
-# )
-# def propagate_array_vacuum(dm, mix, nubar, energy, distances, probability):
-#    """wrapper to run `osc_probs_vacuum_kernel` from host (whether TARGET is
-#    "cuda" or "host")"""
-#    osc_probs_vacuum_kernel(dm, mix, nubar, energy, distances, probability)
-#
-#
-# @njit([f"({FX}[:,:], {CX}[:,:], {IX}, {FX}, {FX}[:], {FX}[:,:])"], target=TARGET)
-# def propagate_scalar_vacuum(dm, mix, nubar, energy, distances, probability):
-#    """wrapper to run `osc_probs_vacuum_kernel` from host (whether TARGET is
-#    "cuda" or "host")"""
-#    osc_probs_vacuum_kernel(dm, mix, nubar, energy, distances, probability)
+@guvectorize(
+    [f"({FX}[:,:], {CX}[:,:], {IX}, {FX}, {FX}, {FX}[:,:])"],
+    "(a,a), (a,a), (), (), () -> (a,a)",
+    target=TARGET,
+)
+def propagate_array_vacuum(dm, mix, nubar, energy, distance, probability):
+    """wrapper to run `osc_probs_vacuum_kernel` from host (whether TARGET is
+    "cuda" or "host")"""
+    osc_probs_vacuum_kernel(dm, mix, nubar, energy, distance, probability)
+
+
+@guvectorize(
+    [f"({FX}[:,:], {CX}[:,:], {CX}[:,:],  {IX}, {CX}[:,:], {FX}[:,:], {IX}, {FX}, {FX}, {FX}, {FX}[:,:])"],
+    "(a,a), (a,a), (b,c), (), (b,c), (b,c), (), (), (), () -> (a,a)",
+    target=TARGET,
+)
+def propagate_array_constant_density(dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, energy, density, distance, probability):
+    """wrapper to run `osc_probs_constant_density_kernel` from host (whether
+    TARGET is "cuda" or "host")"""
+    osc_probs_constant_density_kernel(
+        dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, energy, density, distance, probability
+    )
 
 
 @guvectorize(
@@ -70,6 +87,54 @@ def propagate_array(dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, ene
     )
 
 
+def propagate_array_batched(
+    dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, energy, densities, distances, out=None
+):
+    """Propagate N points for K sets of oscillation parameters in a single
+    call of `propagate_array`, i.e. one (parallel) kernel launch over all
+    K * N combinations, sharing the per-point layer data.
+
+    Parameters
+    ----------
+    dm : real array of shape (K, 3, 3) or (3, 3)
+    mix : complex array of shape (K, 3, 3) or (3, 3)
+    mat_pot : complex array of shape (K, 3, 3) or (3, 3)
+    decay_flag : int
+    mat_decay : complex array of shape (K, 3, 3) or (3, 3)
+    lri_pot : real array of shape (K, 3, 3) or (3, 3)
+        Matrices as expected by `propagate_array`, either one per parameter
+        set or shared by all sets
+    nubar : signed int 1d array of length N (or scalar)
+    energy : real 1d array of length N
+    densities : real 2d array of shape (N, max_layers)
+    distances : real 2d array of shape (N, max_layers)
+    out : real 4d array of shape (K, N, 3, 3), optional
+
+    Returns
+    -------
+    out : real 4d array of shape (K, N, 3, 3)
+
+    """
+    matrices = [np.asarray(m) for m in (dm, mix, mat_pot, mat_decay, lri_pot)]
+    n_sets = {m.shape[0] for m in matrices if m.ndim == 3}
+    if len(n_sets) != 1:
+        raise ValueError(
+            "At least one matrix, and all matrices with a leading parameter"
+            " set dimension, must have the same number of sets, got shapes"
+            f" {[m.shape for m in matrices]}"
+        )
+    n_sets = n_sets.pop()
+    # a new axis for the points lets the gufunc broadcast to (K, N)
+    matrices = [m[:, np.newaxis] if m.ndim == 3 else m for m in matrices]
+    dm, mix, mat_pot, mat_decay, lri_pot = matrices
+    if out is None:
+        out = np.empty((n_sets, len(energy), 3, 3), dtype=FTYPE)
+    propagate_array(  # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
+        dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, energy, densities, distances, out=out
+    )
+    return out
+
+
 @njit(
     [f"({FX}[:,:], {CX}[:,:], {CX}[:,:], {IX}, {CX}[:,:], {FX}[:,:], {IX}, {FX}, {FX}[:], {FX}[:], {FX}[:,:])"],
     parallel=TARGET == "parallel"
@@ -219,3 +284,49 @@ def fill_probs(probability, initial_flav, flav, out):
 
     """
     out[0] = probability[initial_flav, flav]
+
+
+@njit(parallel=TARGET == "parallel")
+def interpolate_probs(node_probs, coszen_nodes, energy_nodes, log_energy, nubar,
+                      coszen, energy, out):
+    """Bilinearly interpolate probability matrices given on a (coszen, energy)
+    node grid, separately for neutrinos and antineutrinos.
+
+    Parameters
+    ----------
+    node_probs : real 5d array
+        Probability matrices of shape (2, n_coszen, n_energy, a, a), for
+        neutrinos (index 0) and antineutrinos (index 1)
+    coszen_nodes : real 1d array
+    energy_nodes : real 1d array
+        Node energies, as log10 if `log_energy`
+    log_energy : bool
+        Whether to interpolate in log10 of the energy
+    nubar : signed int 1d array
+    coszen : real 1d array
+    energy : real 1d array
+    out : real 3d array
+        Interpolated matrices of shape (len(energy), a, a); points outside of
+        the node grid get the values at the nearest edge
+
+    """
+    n_cz = len(coszen_nodes)
+    n_e = len(energy_nodes)
+    for i in prange(len(energy)):
+        nb = 0 if nubar[i] > 0 else 1
+        x = coszen[i]
+        y = np.log10(energy[i]) if log_energy else energy[i]
+        ix = min(max(np.searchsorted(coszen_nodes, x, side="right") - 1, 0), n_cz - 2)
+        iy = min(max(np.searchsorted(energy_nodes, y, side="right") - 1, 0), n_e - 2)
+        tx = (x - coszen_nodes[ix]) / (coszen_nodes[ix + 1] - coszen_nodes[ix])
+        ty = (y - energy_nodes[iy]) / (energy_nodes[iy + 1] - energy_nodes[iy])
+        tx = min(max(tx, 0.), 1.)
+        ty = min(max(ty, 0.), 1.)
+        for a in range(out.shape[1]):
+            for b in range(out.shape[2]):
+                out[i, a, b] = (
+                    (1. - tx) * (1. - ty) * node_probs[nb, ix, iy, a, b]
+                    + tx * (1. - ty) * node_probs[nb, ix + 1, iy, a, b]
+                    + (1. - tx) * ty * node_probs[nb, ix, iy + 1, a, b]
+                    + tx * ty * node_probs[nb, ix + 1, iy + 1, a, b]
+                )
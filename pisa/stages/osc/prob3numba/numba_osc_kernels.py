@@ -13,7 +13,8 @@ See `numba_osc_tests.py` for unit tests of functions in this module.
 from __future__ import absolute_import, print_function, division
 
 __all__ = [
-    # "osc_probs_vacuum_kernel",
+    "osc_probs_vacuum_kernel",
+    "osc_probs_constant_density_kernel",
     "osc_probs_layers_kernel",
     "get_transition_matrix",
 ]
@@ -38,84 +39,154 @@ from pisa.utils.numba_tools import (
 )
 
 
-# TODO/FIXME: osc_probs_vacuum_kernel produces non-unitary results. No one
-# should use this until the issue is resolved.
-
-# @myjit
-# def osc_probs_vacuum_kernel(dm, mix, nubar, energy, distance_in_layer, osc_probs):
-#     """ Calculate vacumm mixing probabilities
-#
-#     Parameters
-#     ----------
-#     dm : real 2d array
-#         Mass splitting matrix, eV^2
-#
-#     mix : complex 2d array
-#         PMNS mixing matrix
-#
-#     nubar : int
-#         +1 for neutrinos, -1 for antineutrinos
-#
-#     energy : float
-#         Neutrino energy, GeV
-#
-#     distance_in_layer : real 1d-array
-#         Baselines (will be summed up), km
-#
-#     osc_probs : real 2d array (empty)
-#         Returned oscillation probabilities in the form:
-#         osc_prob[i,j] = probability of flavor i to oscillate into flavor j
-#         with 0 = electron, 1 = muon, 3 = tau
-#
-#
-#     Notes
-#     -----
-#     This is largely unvalidated so far
-#
-#     """
-#
-#     # no need to conjugate mix matrix, as we anyway only need real part
-#     # can this be right?
-#
-#     clear_matrix(osc_probs)
-#     osc_probs_local = cuda.local.array(shape=(3, 3), dtype=ftype)
-#
-#     # sum up length from all layers
-#     baseline = 0.0
-#     for i in range(distance_in_layer.shape[0]):
-#         baseline += distance_in_layer[i]
-#
-#     # make more precise 20081003 rvw
-#     l_over_e = 1.26693281 * baseline / energy
-#     s21 = math.sin(dm[1, 0] * l_over_e)
-#     s32 = math.sin(dm[2, 0] * l_over_e)
-#     s31 = math.sin((dm[2, 1] + dm[3, 2]) * l_over_e)
-#
-#     # does anybody understand this loop?
-#     # ista = abs(*nutype) - 1
-#     for ista in range(3):
-#         for iend in range(2):
-#             osc_probs_local[ista, iend] = (
-#                 (mix[ista, 0].real * mix[ista, 1].real * s21) ** 2
-#                 + (mix[ista, 1].real * mix[ista, 2].real * s32) ** 2
-#                 + (mix[ista, 2].real * mix[ista, 0].real * s31) ** 2
-#             )
-#             if iend == ista:
-#                 osc_probs_local[ista, iend] = 1.0 - 4.0 * osc_probs_local[ista, iend]
-#             else:
-#                 osc_probs_local[ista, iend] = -4.0 * osc_probs_local[ista, iend]
-#
-#         osc_probs_local[ista, 2] = (
-#             1.0 - osc_probs_local[ista, 0] - osc_probs_local[ista, 1]
-#         )
-#
-#     # is this necessary?
-#     if nubar > 0:
-#         copy_matrix(osc_probs_local, osc_probs)
-#     else:
-#         for i in range(3):
-#             for j in range(3):
-#                 osc_probs[i, j] = osc_probs_local[j, i]
+@myjit
+def osc_probs_vacuum_kernel(dm, mix, nubar, energy, distance, osc_probs):
+    """ Calculate oscillation probabilities in vacuum
+
+    Analytic three-flavour calculation, summing the amplitudes of the mass
+    eigenstates.
+
+    Parameters
+    ----------
+    dm : real 2d array
+        Mass splitting matrix, eV^2
+
+    mix : complex 2d array
+        PMNS mixing matrix
+
+    nubar : int
+        +1 for neutrinos, -1 for antineutrinos
+
+    energy : float
+        Neutrino energy, GeV
+
+    distance : float
+        Baseline, km
+
+    osc_probs : real 2d array (empty)
+        Returned oscillation probabilities in the form:
+        osc_prob[i,j] = probability of flavor i to oscillate into flavor j
+        with 0 = electron, 1 = muon, 3 = tau
+
+    """
+    # (1/2)*(1/(h_bar*c)) in units of GeV/(eV^2 km)
+    hbar_c_factor = 2.534
+
+    phases = cuda.local.array(shape=(3), dtype=ctype)
+    mix_nubar = cuda.local.array(shape=(3, 3), dtype=ctype)
+
+    # same phase convention as `get_transition_matrix_massbasis`, i.e. the
+    # mass of the first mass eigenstate is set to zero
+    for k in range(3):
+        arg = -dm[k, 0] * (distance / energy) * hbar_c_factor
+        phases[k] = cmath.exp(arg * 1.0j)
+
+    if nubar > 0:
+        copy_matrix(mix, mix_nubar)
+    else:
+        conjugate(mix, mix_nubar)
+
+    for i in range(3):
+        for j in range(3):
+            amplitude = mix_nubar[j, 0] * phases[0] * mix_nubar[i, 0].conjugate()
+            for k in range(1, 3):
+                amplitude += mix_nubar[j, k] * phases[k] * mix_nubar[i, k].conjugate()
+            osc_probs[i, j] = amplitude.real ** 2 + amplitude.imag ** 2
+
+
+@myjit
+def osc_probs_constant_density_kernel(
+    dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, energy, density, distance, osc_probs
+):
+    """ Calculate oscillation probabilities
+
+    given a single layer of constant density; equivalent to
+    `osc_probs_layers_kernel` with only one layer crossed, but without the
+    bookkeeping of the layers
+
+    Parameters
+    ----------
+    dm, mix, mat_pot, decay_flag, mat_decay, lri_pot, nubar, energy
+        See `osc_probs_layers_kernel`
+
+    density : real float
+        Density of the layer, moles of electrons / cm^2
+
+    distance : real float
+        Distance traversed, km
+
+    osc_probs : real 2d array (empty)
+        Returned oscillation probabilities in the form:
+        osc_prob[i,j] = probability of flavor i to oscillate into flavor j
+        with 0 = electron, 1 = muon, 3 = tau
+
+    """
+
+    # 3x3 complex
+    H_vac = cuda.local.array(shape=(3, 3), dtype=ctype)
+    H_decay = cuda.local.array(shape=(3, 3), dtype=ctype)
+    mix_nubar = cuda.local.array(shape=(3, 3), dtype=ctype)
+    mix_nubar_conj_transp = cuda.local.array(shape=(3, 3), dtype=ctype)
+    transition_product = cuda.local.array(shape=(3, 3), dtype=ctype)
+    tmp = cuda.local.array(shape=(3, 3), dtype=ctype)
+
+    clear_matrix(H_vac)
+    clear_matrix(H_decay)
+    clear_matrix(osc_probs)
+
+    # 3-vector complex
+    raw_input_psi = cuda.local.array(shape=(3), dtype=ctype)
+    output_psi = cuda.local.array(shape=(3), dtype=ctype)
+
+    if nubar > 0:
+        copy_matrix(mix, mix_nubar)
+    else:
+        conjugate(mix, mix_nubar)
+
+    conjugate_transpose(mix_nubar, mix_nubar_conj_transp)
+
+    if distance > 0.0:
+        get_H_vac(mix_nubar, mix_nubar_conj_transp, dm, H_vac)
+        get_H_decay(mix_nubar, mix_nubar_conj_transp, mat_decay, H_decay)
+        get_transition_matrix(
+            nubar,
+            energy,
+            density,
+            distance,
+            mix_nubar,
+            mix_nubar_conj_transp,
+            mat_pot,
+            H_vac,
+            decay_flag,
+            H_decay,
+            lri_pot,
+            dm,
+            transition_product,
+        )
+    else:
+        # nothing traversed
+        for j in range(3):
+            for k in range(3):
+                if j == k:
+                    transition_product[j, k] = 1.0
+                else:
+                    transition_product[j, k] = 0.0
+
+    # convrt to flavour eigenstate basis
+    matrix_dot_matrix(transition_product, mix_nubar_conj_transp, tmp)
+    matrix_dot_matrix(mix_nubar, tmp, transition_product)
+
+    # loop on neutrino types, and compute probability for neutrino i:
+    for i in range(3):
+        for j in range(3):
+            raw_input_psi[j] = 0.0
+        raw_input_psi[i] = 1.0
+
+        matrix_dot_vector(transition_product, raw_input_psi, output_psi)
+
+        osc_probs[i][0] += output_psi[0].real ** 2 + output_psi[0].imag ** 2
+        osc_probs[i][1] += output_psi[1].real ** 2 + output_psi[1].imag ** 2
+        osc_probs[i][2] += output_psi[2].real ** 2 + output_psi[2].imag ** 2
 
 
 @myjit
@@ -5,6 +5,7 @@ that represent event counts
 
 import numpy as np
 
+from pisa import FTYPE
 from pisa.core.stage import Stage
 from pisa.core.translation import histogram
 from pisa.core.binning import MultiDimBinning, OneDimBinning
@@ -157,6 +158,11 @@ class hist(Stage):  # pylint: disable=invalid-name
                     container["errors"] = np.sqrt(sumw2)
                     container["bin_unc2"] = bin_unc2
 
+        elif self.calc_mode == "events" and self.data.fused and (
+            len(set("astro_weights" in c.keys for c in self.data.containers)) == 1
+        ):
+            self.apply_fused()
+
         elif self.calc_mode == "events":
             for container in self.data:
                 container.representation = self.calc_mode
@@ -192,19 +198,10 @@ class hist(Stage):  # pylint: disable=invalid-name
 
                 # The hist is now computed using a binning that is completely linear
                 # and regular
-                hist = histogram(
-                    sample,
-                    unc_weights*weights,
-                    self.regularized_apply_mode,
-                    averaged=False
+                hist, sumw2, bin_unc2 = self.histogram_events(
+                    sample, weights, unc_weights, self.regularized_apply_mode
                 )
 
-                if self.error_method == "sumw2":
-                    sumw2 = histogram(sample, np.square(unc_weights*weights),
-                        self.regularized_apply_mode, averaged=False)
-                    bin_unc2 = histogram(sample, np.square(unc_weights)*weights,
-                        self.regularized_apply_mode, averaged=False)
-
                 container.representation = self.apply_mode
                 container["weights"] = hist
 
@@ -212,6 +209,77 @@ class hist(Stage):  # pylint: disable=invalid-name
                     container["errors"] = np.sqrt(sumw2)
                     container["bin_unc2"] = bin_unc2
 
+    def histogram_events(self, sample, weights, unc_weights, binning):
+        """Histogram the weighted events and, for `error_method` "sumw2",
+        also the squared weights and the uncertainty weights squared times
+        the weights; all of these are filled in a single pass over the events.
+
+        Returns
+        -------
+        hist, sumw2, bin_unc2 : np.ndarray
+            The latter two are None unless `error_method` is "sumw2"
+
+        """
+        if self.error_method != "sumw2":
+            return histogram(sample, unc_weights*weights, binning, averaged=False), None, None
+        columns = np.stack(
+            [unc_weights*weights, np.square(unc_weights*weights), np.square(unc_weights)*weights],
+            axis=1
+        )
+        hists = histogram(sample, columns, binning, averaged=False)
+        return tuple(np.ascontiguousarray(h) for h in hists.T)
+
+    def apply_fused(self):
+        """Histogram the events of all containers in one go, using the index
+        of the container as an additional (leading) dimension"""
+        containers = self.data.containers
+        n_containers = len(containers)
+        hist_binning = MultiDimBinning(
+            [OneDimBinning(
+                "container_idx", domain=[0, n_containers], num_bins=n_containers
+            )] + list(self.regularized_apply_mode)
+        )
+
+        self.data.representation = self.calc_mode
+        sizes = [slc.stop - slc.start for slc in self.data.fused_slices]
+        sample = [np.repeat(np.arange(n_containers, dtype=FTYPE), sizes)]
+        dims_log = [d.is_log for d in self.apply_mode]
+        dims_ire = [d.is_irregular for d in self.apply_mode]
+        for dim, is_log, is_ire in zip(
+            self.regularized_apply_mode, dims_log, dims_ire
+        ):
+            if is_log and not is_ire:
+                self.data.representation = "log_events"
+            else:
+                self.data.representation = "events"
+            sample.append(self.data.get_fused(dim.name))
+
+        self.data.representation = self.calc_mode
+        weights = self.data.get_fused("weights")
+        if "astro_weights" in containers[0].keys:
+            weights = weights + self.data.get_fused("astro_weights")
+        if self.unweighted:
+            weights = np.ones_like(weights)
+        if self.apply_unc_weights:
+            unc_weights = self.data.get_fused("unc_weights")
+        else:
+            unc_weights = np.ones(weights.shape)
+
+        hist, sumw2, bin_unc2 = self.histogram_events(
+            sample, weights, unc_weights, hist_binning
+        )
+        hist = hist.reshape(n_containers, -1)
+        if self.error_method == "sumw2":
+            sumw2 = sumw2.reshape(n_containers, -1)
+            bin_unc2 = bin_unc2.reshape(n_containers, -1)
+
+        for i, container in enumerate(containers):
+            container.representation = self.apply_mode
+            container["weights"] = hist[i]
+            if self.error_method == "sumw2":
+                container["errors"] = np.sqrt(sumw2[i])
+                container["bin_unc2"] = bin_unc2[i]
+
 
 def init_test(**param_kwargs):
     """Instantiation example"""
@@ -0,0 +1,404 @@
+"""
+Caching utilities for keeping expensive results around in memory or on disk.
+"""
+
+
+from __future__ import absolute_import, division
+
+from collections import OrderedDict
+from collections.abc import Mapping
+import os
+from shutil import rmtree
+import tempfile
+
+import numpy as np
+
+from pisa.utils.fileio import mkdir
+from pisa.utils.log import logging, set_verbosity
+
+
+__all__ = [
+    'DISK_CACHE_MAX_SIZE',
+    'LRUCache',
+    'DiskCache',
+    'nbytes',
+    'test_LRUCache',
+    'test_DiskCache',
+]
+
+__license__ = '''Copyright (c) 2014-2025, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+DISK_CACHE_MAX_SIZE = 10 * 1024
+"""Default size limit of a `DiskCache` in MB"""
+
+
+def nbytes(obj):
+    """Approximate memory footprint (in bytes) of `obj`, counting only numpy
+    arrays (possibly nested in mappings or sequences).
+
+    Parameters
+    ----------
+    obj : object
+
+    Returns
+    -------
+    size : int
+
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, Mapping):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(v) for v in obj)
+    return 0
+
+
+class LRUCache():
+    """
+    Least-recently-used cache bounded both in number of entries and in
+    (approximate) memory footprint.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries held at any time
+
+    max_mem : float or None
+        Memory budget in MB; only numpy arrays contained in the entries count
+        towards it (see `nbytes`). If None, only `max_entries` is enforced.
+
+    """
+    def __init__(self, max_entries, max_mem=None):
+        max_entries = int(max_entries)
+        if max_entries < 1:
+            raise ValueError(
+                '`max_entries` must be at least 1, got %d' % max_entries
+            )
+        if max_mem is not None and max_mem <= 0:
+            raise ValueError('`max_mem` must be positive, got %s' % max_mem)
+        self.max_entries = max_entries
+        self.max_mem = max_mem
+        self._max_bytes = None if max_mem is None else int(max_mem * 1024**2)
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.mem = 0
+        """Current memory footprint of all entries in bytes"""
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return (
+            f'LRUCache with {len(self)}/{self.max_entries} entries,'
+            f' {self.mem/1024**2:.1f} MB, {self.hits} hits, {self.misses} misses'
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        """Keys from least to most recently used"""
+        return tuple(self._entries.keys())
+
+    def get(self, key, default=None):
+        """Retrieve entry under `key` (and mark it as most recently used), or
+        return `default` if not present. Counts towards `hits` and `misses`."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, default=self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        size = nbytes(value)
+        if self._max_bytes is not None and size > self._max_bytes:
+            logging.debug(
+                'Not caching entry of %.1f MB, which exceeds the memory budget'
+                ' of %.1f MB', size/1024**2, self.max_mem
+            )
+            self.pop(key)
+            return
+        self.pop(key)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self.mem += size
+        self._evict()
+
+    def pop(self, key, default=None):
+        """Remove entry under `key` and return it (or `default`)"""
+        if key not in self._entries:
+            return default
+        self.mem -= self._sizes.pop(key)
+        return self._entries.pop(key)
+
+    def clear(self):
+        """Remove all entries; hit/miss counters are preserved"""
+        self._entries.clear()
+        self._sizes.clear()
+        self.mem = 0
+
+    def _evict(self):
+        """Drop least recently used entries until within all limits"""
+        while len(self._entries) > self.max_entries or (
+            self._max_bytes is not None and self.mem > self._max_bytes
+        ):
+            key = next(iter(self._entries))
+            logging.trace('Evicting cache entry %s', key)
+            self.pop(key)
+
+
+class DiskCache():
+    """
+    Directory of named numpy arrays grouped into entries, bounded in total
+    size by evicting the least recently used entries.
+
+    Each entry is a subdirectory holding one `.npy` file per array, such that
+    arrays can be memory-mapped when loaded. Entries are written to a
+    temporary directory first and then moved into place, so that several
+    processes can share a cache directory.
+
+    Parameters
+    ----------
+    path : str
+        Cache directory (created if it does not exist)
+
+    max_size : float or None
+        Size limit in MB; if None, `DISK_CACHE_MAX_SIZE` is used
+
+    """
+    def __init__(self, path, max_size=None):
+        self.path = os.path.expanduser(os.path.expandvars(path))
+        self.max_size = DISK_CACHE_MAX_SIZE if max_size is None else max_size
+        if self.max_size <= 0:
+            raise ValueError('`max_size` must be positive, got %s' % max_size)
+        mkdir(self.path, warn=False)
+
+    def __repr__(self):
+        return f'DiskCache at "{self.path}" with {len(self.keys())} entries'
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, str(key))
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry_path(key))
+
+    def keys(self):
+        """Keys of all entries, from least to most recently used"""
+        entries = []
+        for key in os.listdir(self.path):
+            entry_path = self._entry_path(key)
+            if key.startswith('.') or not os.path.isdir(entry_path):
+                continue
+            entries.append((os.path.getmtime(entry_path), key))
+        return tuple(key for _, key in sorted(entries))
+
+    def load(self, key, mmap_mode='c'):
+        """Load all arrays of the entry under `key`.
+
+        Parameters
+        ----------
+        key : str or int
+
+        mmap_mode : None or str
+            Passed to `numpy.load`; the default copy-on-write mode allows
+            modifying the arrays in memory without touching the files
+
+        Returns
+        -------
+        arrays : dict or None
+            Arrays by name, or None if there is no (complete) entry
+
+        """
+        entry_path = self._entry_path(key)
+        try:
+            fnames = os.listdir(entry_path)
+            arrays = {}
+            for fname in fnames:
+                if not fname.endswith('.npy'):
+                    continue
+                array = np.load(
+                    os.path.join(entry_path, fname), mmap_mode=mmap_mode,
+                    allow_pickle=False
+                )
+                arrays[fname[:-len('.npy')]] = array.view(np.ndarray)
+            # mark as recently used
+            os.utime(entry_path)
+        except (OSError, ValueError) as err:
+            logging.debug('Could not load cache entry %s: %s', key, err)
+            return None
+        logging.debug('Loaded cache entry %s from "%s"', key, self.path)
+        return arrays
+
+    def store(self, key, arrays):
+        """Store named arrays under `key` (replacing any existing entry) and
+        evict least recently used entries if the size limit is exceeded.
+
+        Parameters
+        ----------
+        key : str or int
+
+        arrays : mapping
+            Numpy arrays by name; names must be valid file names
+
+        """
+        size = nbytes(arrays)
+        if size > self.max_size * 1024**2:
+            logging.debug(
+                'Not caching entry of %.1f MB, which exceeds the size limit of'
+                ' %.1f MB', size/1024**2, self.max_size
+            )
+            return
+        tmp_path = tempfile.mkdtemp(prefix='.tmp_', dir=self.path)
+        try:
+            for name, array in arrays.items():
+                np.save(
+                    os.path.join(tmp_path, f'{name}.npy'), np.asarray(array),
+                    allow_pickle=False
+                )
+            self.pop(key)
+            os.rename(tmp_path, self._entry_path(key))
+        except OSError as err:
+            # e.g. another process has stored the same entry in the meantime
+            logging.debug('Could not store cache entry %s: %s', key, err)
+            rmtree(tmp_path, ignore_errors=True)
+            return
+        logging.debug('Stored cache entry %s to "%s"', key, self.path)
+        self._evict()
+
+    def pop(self, key):
+        """Remove the entry under `key` (if present)"""
+        rmtree(self._entry_path(key), ignore_errors=True)
+
+    def clear(self):
+        """Remove all entries"""
+        for key in self.keys():
+            self.pop(key)
+
+    @property
+    def size(self):
+        """Total size of all entries in MB"""
+        return sum(self._entry_size(key) for key in self.keys()) / 1024**2
+
+    def _entry_size(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            return sum(
+                os.path.getsize(os.path.join(entry_path, fname))
+                for fname in os.listdir(entry_path)
+            )
+        except OSError:
+            return 0
+
+    def _evict(self):
+        """Remove least recently used entries until within the size limit"""
+        keys = self.keys()
+        sizes = [self._entry_size(key) for key in keys]
+        total = sum(sizes)
+        for key, size in zip(keys, sizes):
+            if total <= self.max_size * 1024**2:
+                break
+            logging.trace('Evicting cache entry %s', key)
+            self.pop(key)
+            total -= size
+
+
+def test_LRUCache():
+    """Unit tests for LRUCache class"""
+    cache = LRUCache(max_entries=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    # 'b' is now least recently used and gets evicted
+    cache['c'] = 3
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b') is None
+    assert cache.hits == 1 and cache.misses == 1
+    try:
+        cache['b']
+    except KeyError:
+        pass
+    else:
+        raise Exception('missing key should raise a KeyError')
+
+    # memory budget of 1 MB fits two arrays of 0.4 MB, but not three
+    arr = np.zeros(int(0.4 * 1024**2), dtype=np.uint8)
+    cache = LRUCache(max_entries=10, max_mem=1)
+    for key in range(3):
+        cache[key] = {'x': arr.copy()}
+    assert cache.keys() == (1, 2), cache.keys()
+    assert cache.mem == 2 * arr.nbytes
+
+    # entry exceeding the budget on its own is never stored
+    cache[3] = [np.zeros(2 * 1024**2, dtype=np.uint8)]
+    assert 3 not in cache and len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0 and cache.mem == 0
+
+    logging.info('<< PASS : test_LRUCache >>')
+
+
+def test_DiskCache():
+    """Unit tests for DiskCache class"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # limit of 1 MB fits two entries of 0.4 MB, but not three
+        arr = np.arange(int(0.4 * 1024**2) // 8, dtype=np.float64)
+        cache = DiskCache(temp_dir, max_size=1)
+        assert cache.load('a') is None
+        cache.store('a', {'x': arr, 'y': arr[:10]})
+        assert 'a' in cache
+        loaded = cache.load('a')
+        assert set(loaded.keys()) == {'x', 'y'}
+        assert np.array_equal(loaded['x'], arr)
+        # copy-on-write: modifying the loaded array leaves the file intact
+        loaded['x'][:] = 0
+        assert np.array_equal(cache.load('a')['x'], arr)
+
+        cache.store('b', {'x': arr})
+        # make sure 'b' is older than 'a' when 'c' is stored
+        os.utime(cache._entry_path('b'), (0, 0)) # pylint: disable=protected-access
+        cache.store('c', {'x': arr})
+        assert set(cache.keys()) == {'a', 'c'}, cache.keys()
+        assert cache.size <= 1
+
+        # a second instance sees the same entries
+        assert np.array_equal(DiskCache(temp_dir).load('c')['x'], arr)
+
+        cache.clear()
+        assert len(cache.keys()) == 0
+    finally:
+        rmtree(temp_dir)
+
+    logging.info('<< PASS : test_DiskCache >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_LRUCache()
+    test_DiskCache()
@@ -81,6 +81,12 @@ required, in addition to a ``[binning]`` section:
   through the pipeline which contain histogram weights and (if desired) errors
   (note: the presence of these keys is in general not obvious from a given
   pipeline config file itself)
+  Setting ``partial_runs = True`` makes the pipeline re-run only the stages
+  starting from the first one whose params have changed since the previous
+  run (see :class:`pisa.core.pipeline.Pipeline`).
+  Setting ``fused_storage = True`` lets services that support it process the
+  events of all containers at once (see
+  :meth:`pisa.core.container.ContainerSet.get_fused`).
 * ``binning`` can contain different binning definitions, that are then later
   referred to from within the ``stage.service`` sections.
 * ``stage.service``: one such section per stage.service is necessary. It may
@@ -791,6 +797,20 @@ def parse_pipeline_config(config):
     else:
         stage_dicts[section]['detector_name'] = None
 
+    if config.has_option(section, 'partial_runs'):
+        stage_dicts[section]['partial_runs'] = config.getboolean(
+            section, 'partial_runs'
+        )
+    else:
+        stage_dicts[section]['partial_runs'] = False
+
+    if config.has_option(section, 'fused_storage'):
+        stage_dicts[section]['fused_storage'] = config.getboolean(
+            section, 'fused_storage'
+        )
+    else:
+        stage_dicts[section]['fused_storage'] = False
+
 
     # Parse [stage.<stage_name>] sections and store to stage_dicts
     for stage, service in order:  # pylint: disable=too-many-nested-blocks
@@ -8,21 +8,40 @@ this as a stage it makes sense to copy it in to here so somebody can't
 accidentally do the wrong thing with that script.
 """
 
+from functools import wraps
+import os
+from shutil import rmtree
+import tempfile
+
+from numba import njit, prange
 import numpy as np
 import scipy.interpolate as interpolate
 
+from pisa import CACHE_DIR, TARGET
+from pisa.utils.cache import DiskCache
+from pisa.utils.hash import hash_file, hash_obj
 from pisa.utils.log import logging
 from pisa.utils.resources import open_resource
 
 
 __all__ = [
+    "TABLE_CACHE_DIR",
+    "cached_table_loader",
     "load_2d_honda_table",
     "load_2d_bartol_table",
     "load_2d_table",
+    "integral_spline_derivative",
     "calculate_2d_flux_weights",
+    "make_2d_flux_grid",
+    "lookup_2d_flux_grid",
+    "flux_grid_max_deviation",
     "load_3d_honda_table",
     "load_3d_table",
     "calculate_3d_flux_weights",
+    "test_calculate_2d_flux_weights",
+    "test_calculate_3d_flux_weights",
+    "test_lookup_2d_flux_grid",
+    "test_cached_table_loader",
 ]
 
 __author__ = "S. Wren"
@@ -46,7 +65,153 @@ PRIMARIES = ["numu", "numubar", "nue", "nuebar"]
 T_MODE_PRIMARIES = ["numu", "numubar", "nue", "nuebar", "nutau", "nutaubar"]
 TEXPRIMARIES = [r"$\nu_{\mu}$", r"$\bar{\nu}_{\mu}$", r"$\nu_{e}$", r"$\bar{\nu}_{e}$"]
 
+CHUNK_SIZE = 2**16
+"""Number of events for which flux weights are evaluated at once"""
+
+
+def integral_spline_derivative(x, int_vals, x_eval):
+    """Derivative of interpolating cubic splines through many sets of
+    (integrated) values at the same knots, each evaluated at one point.
+
+    Equivalent to calling `scipy.interpolate.splrep(x, int_vals[i], s=0)` and
+    evaluating the first derivative of the result at `x_eval[i]` for every
+    `i`. Since the interpolating spline's coefficients depend linearly on the
+    values, the fit is done only once for each unit vector, and the
+    derivatives of all splines follow from a single weighted sum per point.
+
+    Parameters
+    ----------
+    x : 1d array
+        Knots, shape (n_knots,)
+    int_vals : 2d array
+        Values at the knots, shape (n_points, n_knots)
+    x_eval : 1d array
+        Point at which to evaluate each spline's derivative, shape (n_points,)
+
+    Returns
+    -------
+    derivatives : 1d array
+
+    """
+    n_knots = len(x)
+    # spline coefficients as a linear map of the values at the knots
+    tck_basis = [
+        interpolate.splrep(x, unit_vals, s=0) for unit_vals in np.eye(n_knots)
+    ]
+    knots = tck_basis[0][0]
+    coeff_map = np.stack([tck[1] for tck in tck_basis], axis=1)
+    # derivative of every B-spline at the evaluation points
+    basis_derivs = np.stack(
+        [
+            interpolate.splev(x_eval, (knots, unit_coeffs, 3), der=1)
+            for unit_coeffs in np.eye(len(knots))
+        ],
+        axis=1,
+    )
+    weights = basis_derivs @ coeff_map
+    return np.einsum("ij,ij->i", weights, int_vals)
+
+
+TABLE_CACHE_DIR = os.path.join(CACHE_DIR, "flux_table_cache")
+"""Directory in which parsed flux tables and their splines are cached"""
+
+
+def _splines_to_arrays(spline_dict):
+    """Pack the splines of every primary into stacked arrays of knots and
+    coefficients (all splines of a table share the same knots' length)"""
+    arrays = {}
+    for nutype, splines in spline_dict.items():
+        first = next(iter(splines.values()))
+        if isinstance(first, dict):
+            # 3D tables: a set of coszen splines for every azimuth
+            azkeys = list(splines.keys())
+            czkeys = list(first.keys())
+            tcks = [splines[azkey][czkey] for azkey in azkeys for czkey in czkeys]
+            shape = (len(azkeys), len(czkeys), -1)
+            arrays[f"spline__{nutype}__azkeys"] = np.array(azkeys, dtype=float)
+        else:
+            czkeys = list(splines.keys())
+            tcks = [splines[czkey] for czkey in czkeys]
+            shape = (len(czkeys), -1)
+        arrays[f"spline__{nutype}__czkeys"] = np.array(czkeys)
+        for i, name in enumerate(["t", "c"]):
+            arrays[f"spline__{nutype}__{name}"] = np.array(
+                [tck[i] for tck in tcks]
+            ).reshape(shape)
+        arrays[f"spline__{nutype}__k"] = np.array(tcks[0][2])
+    return arrays
+
+
+def _arrays_to_splines(arrays):
+    """Inverse of `_splines_to_arrays`"""
+    spline_dict = {}
+    nutypes = [
+        name.split("__")[1] for name in arrays
+        if name.startswith("spline__") and name.endswith("__czkeys")
+    ]
+    for nutype in nutypes:
+        czkeys = [str(czkey) for czkey in arrays[f"spline__{nutype}__czkeys"]]
+        t = arrays[f"spline__{nutype}__t"]
+        c = arrays[f"spline__{nutype}__c"]
+        k = int(arrays[f"spline__{nutype}__k"])
+        if f"spline__{nutype}__azkeys" in arrays:
+            spline_dict[nutype] = {
+                azkey: {
+                    czkey: (t[i, j], c[i, j], k) for j, czkey in enumerate(czkeys)
+                }
+                for i, azkey in enumerate(arrays[f"spline__{nutype}__azkeys"])
+            }
+        else:
+            spline_dict[nutype] = {
+                czkey: (t[j], c[j], k) for j, czkey in enumerate(czkeys)
+            }
+    return spline_dict
+
 
+def cached_table_loader(loader):
+    """Decorate a flux table loader such that the parsed table and its
+    splines are stored in a binary cache under `TABLE_CACHE_DIR` (identified
+    by the loader, the contents of the table file and all other arguments),
+    and are loaded from there, memory-mapped, on subsequent calls.
+
+    The cache is only used if the decorated loader is called with the
+    additional keyword argument `use_cache=True` (default False).
+    """
+    @wraps(loader)
+    def cached_loader(flux_file, enpow=1, return_table=False, use_cache=False,
+                      **kwargs):
+        if not use_cache:
+            return loader(flux_file, enpow=enpow, return_table=return_table,
+                          **kwargs)
+        cache = DiskCache(TABLE_CACHE_DIR)
+        cache_key = hash_obj(
+            [loader.__name__, hash_file(flux_file), enpow, sorted(kwargs.items())],
+            hash_to="hex"
+        )
+        arrays = cache.load(cache_key)
+        if arrays is None:
+            spline_dict, flux_dict = loader(
+                flux_file, enpow=enpow, return_table=True, **kwargs
+            )
+            arrays = _splines_to_arrays(spline_dict)
+            for key, vals in flux_dict.items():
+                arrays[f"table__{key}"] = vals
+            cache.store(cache_key, arrays)
+        else:
+            logging.debug("Loaded atmospheric flux table %s from cache", flux_file)
+            spline_dict = _arrays_to_splines(arrays)
+            flux_dict = {
+                name[len("table__"):]: vals for name, vals in arrays.items()
+                if name.startswith("table__")
+            }
+        if return_table:
+            return spline_dict, flux_dict
+        return spline_dict
+
+    return cached_loader
+
+
+@cached_table_loader
 def load_2d_honda_table(flux_file, enpow=1, return_table=False, hg_taumode=False):
     """
     Added "hg_taumode" to load in hillas gaisser h3a tables made with tau neutrino contributions.
@@ -130,6 +295,7 @@ def load_2d_honda_table(flux_file, enpow=1, return_table=False, hg_taumode=False
     return spline_dict
 
 
+@cached_table_loader
 def load_2d_bartol_table(flux_file, enpow=1, return_table=False):
 
     logging.debug("Loading atmospheric flux table %s", flux_file)
@@ -202,7 +368,7 @@ def load_2d_bartol_table(flux_file, enpow=1, return_table=False):
     return spline_dict
 
 
-def load_2d_table(flux_file, enpow=1, return_table=False):
+def load_2d_table(flux_file, enpow=1, return_table=False, use_cache=False):
     """Manipulate 2 dimensional flux tables.
 
     2D is expected to mean energy and cosZenith, where azimuth is averaged
@@ -220,6 +386,10 @@ def load_2d_table(flux_file, enpow=1, return_table=False):
     return_table : boolean
         Flag to true if you want the function to also return a dictionary
         of the underlying values from the tables. Useful for comparisons.
+    use_cache : boolean
+        Whether to load the parsed table and splines from the binary cache
+        under `TABLE_CACHE_DIR` (and store them there if not yet present).
+        Default is False.
 
     """
     if not isinstance(enpow, int):
@@ -234,10 +404,12 @@ def load_2d_table(flux_file, enpow=1, return_table=False):
         if "bartol" in flux_file:
             if return_table:
                 spline_dict, flux_dict = load_2d_bartol_table(
-                    flux_file, enpow=enpow, return_table=True
+                    flux_file, enpow=enpow, return_table=True, use_cache=use_cache
                 )
             else:
-                spline_dict = load_2d_bartol_table(flux_file, enpow=enpow)
+                spline_dict = load_2d_bartol_table(
+                    flux_file, enpow=enpow, use_cache=use_cache
+                )
             spline_dict["name"] = "bartol"
 
         else:
@@ -251,10 +423,14 @@ def load_2d_table(flux_file, enpow=1, return_table=False):
                 enpow=enpow,
                 return_table=True,
                 hg_taumode="hillas" in flux_file,
+                use_cache=use_cache,
             )
         else:
             spline_dict = load_2d_honda_table(
-                flux_file, enpow=enpow, hg_taumode="hillas" in flux_file
+                flux_file,
+                enpow=enpow,
+                hg_taumode="hillas" in flux_file,
+                use_cache=use_cache,
             )
         spline_dict["name"] = "hillas" if "hillas" in flux_file else "honda"
 
@@ -331,6 +507,210 @@ def calculate_2d_flux_weights(
     if out is None:
         out = np.empty_like(true_energies)
 
+    true_log_energies = np.log10(true_energies)
+    for start in range(0, len(true_energies), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        # evaluate all coszen knots' energy splines on the whole chunk at once
+        spline_vals = np.zeros((len(true_log_energies[chunk]), num_cz_points + 1))
+        for j in range(num_cz_points):
+            spline_vals[:, j + 1] = interpolate.splev(
+                true_log_energies[chunk], en_splines[czkeys[j]], der=1
+            )
+        int_spline_vals = np.cumsum(spline_vals, axis=1) * 0.1
+        out[chunk] = integral_spline_derivative(
+            cz_spline_points, int_spline_vals, true_coszens[chunk]
+        ) / np.power(true_energies[chunk], enpow)
+
+    return out
+
+
+def make_2d_flux_grid(en_splines, n_logenergy=1001, n_coszen=201, enpow=1):
+    """Tabulate the integral-preserving flux of one primary on a regular grid
+    in log10(energy) and cos(zenith), for fast evaluation with
+    `lookup_2d_flux_grid`.
+
+    The grid spans the full coszen range and the energy range covered by
+    `en_splines`. The logarithm of the flux is stored, since it varies much
+    more smoothly than the flux itself.
+
+    Parameters
+    ----------
+    en_splines : dict of splines
+        Energy splines of the primary of interest, see `load_2d_table`
+    n_logenergy, n_coszen : int
+        Number of grid points along each dimension
+    enpow : integer
+        The power to which the energy was raised in the construction of the
+        splines
+
+    Returns
+    -------
+    grid : dict
+        Grid points "logenergy" and "coszen" as well as "log_flux" (log10 of
+        the flux at the grid points, shape (n_logenergy, n_coszen))
+
+    """
+    knots = [tck[0] for key, tck in en_splines.items() if key != "name"]
+    logenergy = np.linspace(
+        max(t[0] for t in knots), min(t[-1] for t in knots), n_logenergy
+    )
+    coszen = np.linspace(-1, 1, n_coszen)
+    logenergy_mesh, coszen_mesh = np.meshgrid(logenergy, coszen, indexing="ij")
+    flux = calculate_2d_flux_weights(
+        np.power(10, logenergy_mesh.ravel()), coszen_mesh.ravel(), en_splines,
+        enpow=enpow
+    )
+    if not np.all(flux > 0):
+        raise ValueError("Cannot tabulate the logarithm of non-positive fluxes")
+    return dict(
+        logenergy=logenergy,
+        coszen=coszen,
+        log_flux=np.log10(flux).reshape(logenergy_mesh.shape),
+    )
+
+
+def lookup_2d_flux_grid(true_energies, true_coszens, grid, bicubic=True, out=None):
+    """Evaluate fluxes by interpolating a grid made with `make_2d_flux_grid`.
+
+    Interpolation happens in log10(flux), either bilinear or bicubic
+    (Catmull-Rom). Events outside of the grid's energy range get NaN.
+
+    Parameters
+    ----------
+    true_energies : numpy array
+        True energies in GeV
+    true_coszens : numpy array
+    grid : dict
+        See `make_2d_flux_grid`
+    bicubic : bool
+        Whether to interpolate bicubically (default) or bilinearly
+    out : np.array
+        optional array to store results
+
+    Returns
+    -------
+    out : numpy array
+
+    """
+    if out is None:
+        out = np.empty_like(true_energies)
+    logenergy = grid["logenergy"]
+    coszen = grid["coszen"]
+    _lookup_2d_grid(
+        np.log10(true_energies),
+        true_coszens,
+        np.ascontiguousarray(grid["log_flux"]),
+        logenergy[0],
+        (logenergy[-1] - logenergy[0]) / (len(logenergy) - 1),
+        coszen[0],
+        (coszen[-1] - coszen[0]) / (len(coszen) - 1),
+        bicubic,
+        out,
+    )
+    return out
+
+
+def flux_grid_max_deviation(grid, en_splines, bicubic=True, enpow=1):
+    """Maximum relative deviation of fluxes looked up from `grid` from the
+    integral-preserving splines they were tabulated from, probed at the centres
+    of all grid cells (where interpolation errors are largest).
+
+    Parameters
+    ----------
+    grid : dict
+        See `make_2d_flux_grid`
+    en_splines : dict of splines
+        Energy splines the grid was made from
+    bicubic : bool
+        Interpolation mode, see `lookup_2d_flux_grid`
+    enpow : integer
+
+    Returns
+    -------
+    max_deviation : float
+
+    """
+    logenergy = 0.5 * (grid["logenergy"][1:] + grid["logenergy"][:-1])
+    coszen = 0.5 * (grid["coszen"][1:] + grid["coszen"][:-1])
+    logenergy_mesh, coszen_mesh = np.meshgrid(logenergy, coszen, indexing="ij")
+    true_energies = np.power(10, logenergy_mesh.ravel())
+    true_coszens = coszen_mesh.ravel()
+    exact = calculate_2d_flux_weights(
+        true_energies, true_coszens, en_splines, enpow=enpow
+    )
+    looked_up = lookup_2d_flux_grid(
+        true_energies, true_coszens, grid, bicubic=bicubic
+    )
+    return np.max(np.abs(looked_up / exact - 1))
+
+
+@njit
+def _cubic_weights(t):
+    """Catmull-Rom weights of the four neighbouring grid points"""
+    t2 = t * t
+    t3 = t2 * t
+    return (
+        0.5 * (-t3 + 2. * t2 - t),
+        0.5 * (3. * t3 - 5. * t2 + 2.),
+        0.5 * (-3. * t3 + 4. * t2 + t),
+        0.5 * (t3 - t2),
+    )
+
+
+@njit
+def _grid_value(vals, jx, jy):
+    """Grid value, linearly extrapolated by one point beyond the boundaries"""
+    nx, ny = vals.shape
+    if jx < 0:
+        return 2. * _grid_value(vals, 0, jy) - _grid_value(vals, 1, jy)
+    if jx > nx - 1:
+        return 2. * _grid_value(vals, nx - 1, jy) - _grid_value(vals, nx - 2, jy)
+    if jy < 0:
+        return 2. * vals[jx, 0] - vals[jx, 1]
+    if jy > ny - 1:
+        return 2. * vals[jx, ny - 1] - vals[jx, ny - 2]
+    return vals[jx, jy]
+
+
+@njit(parallel=True if TARGET == "parallel" else False)
+def _lookup_2d_grid(x, y, log_vals, xmin, dx, ymin, dy, bicubic, out):
+    nx, ny = log_vals.shape
+    for idx in prange(len(out)):
+        u = (x[idx] - xmin) / dx
+        v = (y[idx] - ymin) / dy
+        if not (u >= 0. and u <= nx - 1 and v >= 0. and v <= ny - 1):
+            out[idx] = np.nan
+            continue
+        ix = min(int(u), nx - 2)
+        iy = min(int(v), ny - 2)
+        tx = u - ix
+        ty = v - iy
+        if bicubic:
+            wx = _cubic_weights(tx)
+            wy = _cubic_weights(ty)
+            val = 0.
+            for a in range(4):
+                row = 0.
+                for b in range(4):
+                    row += wy[b] * _grid_value(log_vals, ix - 1 + a, iy - 1 + b)
+                val += wx[a] * row
+        else:
+            val = (
+                (1. - tx) * ((1. - ty) * log_vals[ix, iy] + ty * log_vals[ix, iy + 1])
+                + tx * ((1. - ty) * log_vals[ix + 1, iy] + ty * log_vals[ix + 1, iy + 1])
+            )
+        out[idx] = 10.**val
+
+
+def _calculate_2d_flux_weights_loop(true_energies, true_coszens, en_splines, enpow=1):
+    """Event-by-event reference implementation of `calculate_2d_flux_weights`,
+    kept for regression testing"""
+    num_cz_points = 20
+    czkeys = ["%.2f" % x for x in np.linspace(-0.95, 0.95, num_cz_points)]
+    cz_spline_points = np.linspace(-1, 1, num_cz_points + 1)
+
+    out = np.empty_like(true_energies)
+
     spline_vals = np.zeros(num_cz_points + 1)
     for i in range(len(true_energies)):
         true_log_energy = np.log10(true_energies[i])
@@ -349,6 +729,7 @@ def calculate_2d_flux_weights(
     return out
 
 
+@cached_table_loader
 def load_3d_honda_table(flux_file, enpow=1, return_table=False):
 
     logging.debug("Loading atmospheric flux table %s", flux_file)
@@ -428,7 +809,7 @@ def load_3d_honda_table(flux_file, enpow=1, return_table=False):
     return spline_dict
 
 
-def load_3d_table(flux_file, enpow=1, return_table=False):
+def load_3d_table(flux_file, enpow=1, return_table=False, use_cache=False):
     """Manipulate 3 dimensional flux tables.
 
     3D is expected to mean energy, cosZenith and azimuth. The angular range
@@ -445,6 +826,10 @@ def load_3d_table(flux_file, enpow=1, return_table=False):
     return_table : boolean
         Flag to true if you want the function to also return a dictionary
         of the underlying values from the tables. Useful for comparisons.
+    use_cache : boolean
+        Whether to load the parsed table and splines from the binary cache
+        under `TABLE_CACHE_DIR` (and store them there if not yet present).
+        Default is False.
     """
 
     if not isinstance(enpow, int):
@@ -459,10 +844,12 @@ def load_3d_table(flux_file, enpow=1, return_table=False):
         raise ValueError("Flux file must be from the Honda group")
     if return_table:
         spline_dict, flux_dict = load_3d_honda_table(
-            flux_file, enpow=enpow, return_table=True
+            flux_file, enpow=enpow, return_table=True, use_cache=use_cache
         )
     else:
-        spline_dict = load_3d_honda_table(flux_file, enpow=enpow)
+        spline_dict = load_3d_honda_table(
+            flux_file, enpow=enpow, use_cache=use_cache
+        )
     spline_dict["name"] = "honda"
 
     if return_table:
@@ -557,6 +944,70 @@ def calculate_3d_flux_weights(
     czkeys = ["%.2f" % x for x in np.linspace(-0.95, 0.95, 20)]
     cz_spline_points = np.linspace(-1, 1, 21)
 
+    flux_weights = np.empty(len(true_energies))
+    true_log_energies = np.log10(true_energies)
+    true_azimuths = true_azimuths * 180.0 / np.pi
+    for start in range(0, len(true_energies), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        n_events = len(true_log_energies[chunk])
+        az_spline_vals = np.zeros((n_events, len(azkeys) + 1))
+        cz_spline_vals = np.zeros((n_events, len(czkeys) + 1))
+        for k, azkey in enumerate(azkeys):
+            for j, czkey in enumerate(czkeys):
+                cz_spline_vals[:, j + 1] = interpolate.splev(
+                    true_log_energies[chunk], en_splines[azkey][czkey], der=1
+                )
+            cz_int_spline_vals = np.cumsum(cz_spline_vals, axis=1) * 0.1
+            az_spline_vals[:, k] = integral_spline_derivative(
+                cz_spline_points, cz_int_spline_vals, true_coszens[chunk]
+            )
+        true_azimuth = true_azimuths[chunk]
+        # Treat the azimuthal dimension in an integral-preserving manner.
+        # This is not recommended.
+        if not az_linear:
+            az_spline_vals = np.roll(az_spline_vals, 1, axis=1)
+            az_int_spline_vals = np.cumsum(az_spline_vals, axis=1) * 30.0
+            flux_weights[chunk] = integral_spline_derivative(
+                az_spline_points, az_int_spline_vals, true_azimuth
+            ) / np.power(true_energies[chunk], enpow)
+        # Treat the azimuthal dimension with a linear interpolation.
+        # This is the best treatment.
+        else:
+            # Make the azimuthal spline cyclic
+            az_spline_vals[:, -1] = az_spline_vals[:, 0]
+            true_azimuth = np.where(
+                true_azimuth < 15.0, true_azimuth + 360.0, true_azimuth
+            )
+            idx = np.clip(
+                np.searchsorted(az_spline_points, true_azimuth, side="right") - 1,
+                0,
+                len(azkeys) - 1,
+            )
+            frac = (true_azimuth - az_spline_points[idx]) / (
+                az_spline_points[idx + 1] - az_spline_points[idx]
+            )
+            rows = np.arange(n_events)
+            # Account for the energy power that was applied in the first splines
+            flux_weights[chunk] = (
+                (1 - frac) * az_spline_vals[rows, idx]
+                + frac * az_spline_vals[rows, idx + 1]
+            ) / np.power(true_energies[chunk], enpow)
+    return flux_weights
+
+
+def _calculate_3d_flux_weights_loop(
+    true_energies, true_coszens, true_azimuths, en_splines, enpow=1, az_linear=True
+):
+    """Event-by-event reference implementation of `calculate_3d_flux_weights`,
+    kept for regression testing"""
+    azkeys = np.linspace(15.0, 345.0, 12)
+    if not az_linear:
+        az_spline_points = np.linspace(0.0, 360.0, 13)
+    else:
+        az_spline_points = np.linspace(15.0, 375.0, 13)
+    czkeys = ["%.2f" % x for x in np.linspace(-0.95, 0.95, 20)]
+    cz_spline_points = np.linspace(-1, 1, 21)
+
     flux_weights = []
     for true_energy, true_coszen, true_azimuth in zip(
         true_energies, true_coszens, true_azimuths
@@ -602,6 +1053,126 @@ def calculate_3d_flux_weights(
     return flux_weights
 
 
+def test_calculate_2d_flux_weights():
+    """Regression test of the vectorized `calculate_2d_flux_weights` against
+    the event-by-event reference implementation"""
+    rng = np.random.default_rng(0)
+    true_energies = np.power(10, rng.uniform(-1, 4, 2000))
+    true_coszens = rng.uniform(-1, 1, 2000)
+    true_coszens[:3] = [-1, 0, 1]
+    for flux_file in ["flux/honda-2015-spl-solmax-aa.d",
+                      "flux/bartol-2004-sno-solmax-aa.d"]:
+        spline_dict = load_2d_table(flux_file)
+        for prim in PRIMARIES:
+            ref = _calculate_2d_flux_weights_loop(
+                true_energies, true_coszens, spline_dict[prim]
+            )
+            out = np.full_like(true_energies, np.nan)
+            calculate_2d_flux_weights(
+                true_energies, true_coszens, spline_dict[prim], out=out
+            )
+            assert np.allclose(out, ref, rtol=1e-10, atol=0), (
+                f"{flux_file} {prim}: max. rel. deviation "
+                f"{np.max(np.abs(out / ref - 1))}"
+            )
+    logging.info("<< PASS : test_calculate_2d_flux_weights >>")
+
+
+def test_calculate_3d_flux_weights():
+    """Regression test of the vectorized `calculate_3d_flux_weights` against
+    the event-by-event reference implementation"""
+    rng = np.random.default_rng(0)
+    true_energies = np.power(10, rng.uniform(-1, 4, 300))
+    true_coszens = rng.uniform(-1, 1, 300)
+    true_azimuths = rng.uniform(0, 2 * np.pi, 300)
+    true_coszens[:3] = [-1, 0, 1]
+    true_azimuths[:4] = [0, 15 * np.pi / 180, np.pi, 2 * np.pi]
+    spline_dict = load_3d_table("flux/honda-2015-spl-solmax.d")
+    for prim in ["numu", "nuebar"]:
+        for az_linear in [True, False]:
+            ref = _calculate_3d_flux_weights_loop(
+                true_energies, true_coszens, true_azimuths, spline_dict[prim],
+                az_linear=az_linear
+            )
+            out = calculate_3d_flux_weights(
+                true_energies, true_coszens, true_azimuths, spline_dict[prim],
+                az_linear=az_linear
+            )
+            assert np.allclose(out, ref, rtol=1e-10, atol=0), (
+                f"{prim}, az_linear={az_linear}: max. rel. deviation "
+                f"{np.max(np.abs(out / ref - 1))}"
+            )
+    logging.info("<< PASS : test_calculate_3d_flux_weights >>")
+
+
+def test_lookup_2d_flux_grid():
+    """Unit test of flux lookup from a grid against the spline evaluation"""
+    spline_dict = load_2d_table("flux/honda-2015-spl-solmax-aa.d")
+    rng = np.random.default_rng(0)
+    true_energies = np.power(10, rng.uniform(-1, 4, 10000))
+    true_coszens = rng.uniform(-1, 1, 10000)
+    exact = calculate_2d_flux_weights(true_energies, true_coszens, spline_dict["numu"])
+    grid = make_2d_flux_grid(spline_dict["numu"], n_logenergy=501, n_coszen=101)
+    for bicubic in [True, False]:
+        max_dev = flux_grid_max_deviation(grid, spline_dict["numu"], bicubic=bicubic)
+        out = lookup_2d_flux_grid(true_energies, true_coszens, grid, bicubic=bicubic)
+        # the deviation probed at the cell centres is a close (but not a
+        # strict) bound of the deviation anywhere else
+        assert np.all(np.abs(out / exact - 1) <= 1.5 * max_dev), bicubic
+        assert max_dev < 1e-2, max_dev
+        # grid points themselves are reproduced
+        out = lookup_2d_flux_grid(
+            np.power(10, grid["logenergy"][[0, 10, -1]]),
+            grid["coszen"][[0, 50, -1]],
+            grid,
+            bicubic=bicubic,
+        )
+        assert np.allclose(np.log10(out), grid["log_flux"][[0, 10, -1], [0, 50, -1]])
+    # outside of the tabulated energy range
+    out = lookup_2d_flux_grid(np.array([1e-3, 1e6]), np.zeros(2), grid)
+    assert np.all(np.isnan(out))
+    logging.info("<< PASS : test_lookup_2d_flux_grid >>")
+
+
+def test_cached_table_loader():
+    """Unit test of loading flux tables from the binary cache"""
+    global TABLE_CACHE_DIR # pylint: disable=global-statement
+    orig_cache_dir = TABLE_CACHE_DIR
+    TABLE_CACHE_DIR = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        true_energies = np.power(10, rng.uniform(-1, 4, 100))
+        true_coszens = rng.uniform(-1, 1, 100)
+        true_azimuths = rng.uniform(0, 2 * np.pi, 100)
+        for flux_file, load, calc, args in [
+            ("flux/honda-2015-spl-solmax-aa.d", load_2d_table,
+             calculate_2d_flux_weights, (true_energies, true_coszens)),
+            ("flux/bartol-2004-sno-solmax-aa.d", load_2d_table,
+             calculate_2d_flux_weights, (true_energies, true_coszens)),
+            ("flux/honda-2015-spl-solmax.d", load_3d_table,
+             calculate_3d_flux_weights,
+             (true_energies, true_coszens, true_azimuths)),
+        ]:
+            n_entries = len(os.listdir(TABLE_CACHE_DIR))
+            ref_splines, ref_table = load(flux_file, return_table=True)
+            # nothing is cached by default
+            assert len(os.listdir(TABLE_CACHE_DIR)) == n_entries
+            # the first call fills the cache, the second loads from it
+            for _ in range(2):
+                spline_dict, flux_dict = load(
+                    flux_file, return_table=True, use_cache=True
+                )
+                assert len(os.listdir(TABLE_CACHE_DIR)) == n_entries + 1
+                for prim in PRIMARIES:
+                    out = calc(*args, spline_dict[prim])
+                    assert np.array_equal(out, calc(*args, ref_splines[prim]))
+                    assert np.array_equal(flux_dict[prim], ref_table[prim])
+    finally:
+        rmtree(TABLE_CACHE_DIR)
+        TABLE_CACHE_DIR = orig_cache_dir
+    logging.info("<< PASS : test_cached_table_loader >>")
+
+
 def main():
     """This is a slightly longer example than that given in the docstring of
     the calculate_flux_weights function. This will make a quick plot of the
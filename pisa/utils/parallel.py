@@ -0,0 +1,140 @@
+"""
+Utilities for distributing independent calculations across worker processes.
+"""
+
+
+from __future__ import absolute_import, division
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pisa.utils.log import logging, set_verbosity
+
+
+__all__ = [
+    'split_indices',
+    'map_chunks',
+    'test_map_chunks',
+]
+
+__license__ = '''Copyright (c) 2014-2025, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+def split_indices(num_items, num_chunks):
+    """Split the indices of `num_items` items into at most `num_chunks`
+    contiguous chunks of (nearly) equal size, none of them empty (unless there
+    are no items at all).
+
+    Parameters
+    ----------
+    num_items : int
+    num_chunks : int
+
+    Returns
+    -------
+    chunks : list of 1d np.ndarray of int
+
+    """
+    return np.array_split(np.arange(num_items), max(1, min(num_chunks, num_items)))
+
+
+def map_chunks(func, make_task, keys, num_items, num_chunks, pool=None,
+               merge=np.concatenate):
+    """Evaluate `func` for one task per key and chunk of items (see
+    `split_indices`), and merge the results of all chunks of a key in the
+    original order of the items.
+
+    Parameters
+    ----------
+    func : callable
+        Called with a single task; must be picklable if `pool` is given
+
+    make_task : callable
+        Called as ``make_task(key, chunk)`` with `chunk` the indices of the
+        items, returns the task
+
+    keys : sequence
+        E.g. the initial flavours for which all items are evaluated
+
+    num_items : int
+
+    num_chunks : int
+        Number of chunks the items are split into (at most)
+
+    pool : concurrent.futures.Executor or None
+        Executor whose `map` evaluates the tasks; if None, they are evaluated
+        serially in the calling process
+
+    merge : callable
+        Called with the list of the results of all chunks of a key (in order)
+
+    Returns
+    -------
+    merged : dict
+        Merged results by key
+
+    """
+    chunks = split_indices(num_items, num_chunks)
+    tasks = [make_task(key, chunk) for key in keys for chunk in chunks]
+    if pool is None:
+        results = [func(task) for task in tasks]
+    else:
+        results = list(pool.map(func, tasks))
+    n_chunks = len(chunks)
+    return {
+        key: merge(results[i * n_chunks:(i + 1) * n_chunks])
+        for i, key in enumerate(keys)
+    }
+
+
+def _test_task(task):
+    """Stand-in for an expensive calculation: tuple of two arrays, depending
+    on the key and the items of the task"""
+    key, values = task
+    return key * values, values + key
+
+
+def test_map_chunks():
+    """Unit tests for `split_indices` and `map_chunks`"""
+    for num_items, num_chunks in [(10, 3), (2, 5), (7, 1), (0, 4)]:
+        chunks = split_indices(num_items, num_chunks)
+        assert len(chunks) == max(1, min(num_items, num_chunks))
+        assert np.array_equal(np.concatenate(chunks), np.arange(num_items))
+        sizes = [len(chunk) for chunk in chunks]
+        assert max(sizes) - min(sizes) <= 1
+
+    values = np.linspace(0, 1, 11)
+    keys = [0, 1, 2]
+    make_task = lambda key, chunk: (key, values[chunk])
+    merge = lambda results: tuple(
+        np.concatenate([res[i] for res in results]) for i in (0, 1)
+    )
+    ref = {key: _test_task((key, values)) for key in keys}
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        for num_chunks, executor in [(1, None), (4, None), (4, pool), (20, pool)]:
+            merged = map_chunks(_test_task, make_task, keys, len(values),
+                                num_chunks, pool=executor, merge=merge)
+            assert list(merged) == keys
+            for key in keys:
+                for test, expected in zip(merged[key], ref[key]):
+                    assert np.array_equal(test, expected), (num_chunks, key)
+
+    logging.info('<< PASS : test_map_chunks >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_map_chunks()